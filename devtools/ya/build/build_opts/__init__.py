@@ -2230,6 +2230,7 @@ class LocalCacheOptions(ToolsOptions):
         self.new_store_ttl = 3 * 24 * 60 * 60  # 3 days
         self.cache_size = 300 * 1024 * 1024 * 1024
         self.auto_clean_results_cache = True
+        self.incremental_gc = False
 
     @staticmethod
     def consumer():
@@ -2277,6 +2278,18 @@ class LocalCacheOptions(ToolsOptions):
                 group=CACHE_CONTROL_GROUP,
                 visible=HelpLevel.ADVANCED,
             ),
+            ArgConsumer(
+                ['--incremental-gc'],
+                help='Keep cache within --cache-size by evicting old entries in small slices concurrently with the build',
+                hook=SetConstValueHook('incremental_gc', True),
+                group=CACHE_CONTROL_GROUP,
+                visible=HelpLevel.ADVANCED,
+            ),
+            EnvConsumer(
+                'YA_INCREMENTAL_GC',
+                help='Evict cache entries incrementally in background',
+                hook=SetValueHook('incremental_gc', transform=return_true_if_enabled),
+            ),
             ArgConsumer(
                 ['--cache-codec'],
                 help='Cache codec',
@@ -2324,6 +2337,7 @@ class LocalCacheOptions(ToolsOptions):
             ConfigConsumer('cache_size'),
             EnvConsumer('YA_CACHE_SIZE', hook=SetValueHook('cache_size')),
             ConfigConsumer('auto_clean_results_cache'),
+            ConfigConsumer('incremental_gc'),
             ConfigConsumer('strip_symlinks'),
         ]
 
@@ -122,22 +122,27 @@ class _OptimizableGraph(dict):
 
         return result
 
-    def optimize_resources(self):
+    @staticmethod
+    def collect_node_commands(item, commands):
+        item_env = item.get('env', {})
+        if item_env:
+            commands.update(item_env.values())
+
+        for cmd in item.get('cmds', []):
+            commands.update(cmd.get('cmd_args', []))
+            cmd_env = cmd.get('env', {})
+
+            if cmd_env:
+                commands.update(cmd_env.values())
+
+    def optimize_resources(self, commands=None):
         reduce_graph_resources_stage = stager.start('reduce_graph_resources')
         try:
             resources = self['conf']['resources']
-            commands = set()
-            for item in self.get('graph', []):
-                item_env = item.get('env', {})
-                if item_env:
-                    commands.update(item_env.values())
-
-                for cmd in item.get('cmds', []):
-                    commands.update(cmd.get('cmd_args', []))
-                    cmd_env = cmd.get('env', {})
-
-                    if cmd_env:
-                        commands.update(cmd_env.values())
+            if commands is None:
+                commands = set()
+                for item in self.get('graph', []):
+                    self.collect_node_commands(item, commands)
 
             if resources:
                 filtered_resources = self.filter_graph_resources(resources, commands)
@@ -266,11 +271,13 @@ def _merge_nodes(x, y):
     return ret
 
 
-def _optimize_graph(graph):
-    by_uid = {}
+def _uid_index(nodes):
+    return {n['uid']: n for n in nodes}
 
-    for x in graph['graph']:
-        by_uid[x['uid']] = x
+
+def _optimize_graph(graph, by_uid=None):
+    if by_uid is None:
+        by_uid = _uid_index(graph['graph'])
 
     r_deps = collections.defaultdict(list)
 
@@ -280,8 +287,11 @@ def _optimize_graph(graph):
 
     def iter_nodes():
         visited = set()
+        # Iterative pre-order DFS, deps are pushed in reverse order to be visited in the original order
+        stack = [by_uid[n] for n in reversed(graph['result'])]
 
-        def visit(x):
+        while stack:
+            x = stack.pop()
             uid = x['uid']
 
             if uid not in visited:
@@ -292,13 +302,7 @@ def _optimize_graph(graph):
 
                 yield x
 
-                for dep in x['deps']:
-                    for xx in visit(by_uid[dep]):
-                        yield xx
-
-        for n in graph['result']:
-            for x in visit(by_uid[n]):
-                yield x
+                stack.extend(by_uid[dep] for dep in reversed(x['deps']))
 
     return {
         'inputs': graph.get('inputs', {}),
@@ -372,6 +376,7 @@ def _gen_rename_nodes(graph, uid_map, src_dir):
 
     graph['result'] = [x for x in iter_results()]
     graph['graph'].extend(node_gen.extra_nodes)
+    uid_map.update(_uid_index(node_gen.extra_nodes))
     return graph
 
 
@@ -434,9 +439,10 @@ def _add_resources(resources, to):
     return to
 
 
-def strip_graph(graph, result=None):
+def strip_graph(graph, result=None, by_uid=None):
+    """by_uid is uid -> node index of the graph, if given it's updated to index the stripped graph"""
     result = result or graph['result']
-    nodes = _strip_unused_nodes(graph['graph'], result)
+    nodes = _strip_unused_nodes(graph['graph'], result, by_uid)
 
     conf = graph.get('conf', {}).copy()
     conf['resources'] = _filter_duplicate_resources(conf.get('resources', []))
@@ -444,21 +450,25 @@ def strip_graph(graph, result=None):
     return {'conf': conf, 'inputs': graph.get('inputs', {}), 'result': list(set(result)), 'graph': nodes}
 
 
-def _strip_unused_nodes(graph_nodes, result):
-    by_uid = {n['uid']: n for n in graph_nodes}
-
-    def visit(uid):
-        if uid in by_uid:
-            node = by_uid.pop(uid)
-            yield node
-            for dep in node['deps']:
-                for xx in visit(dep):
-                    yield xx
+def _strip_unused_nodes(graph_nodes, result, by_uid=None):
+    if by_uid is None:
+        by_uid = _uid_index(graph_nodes)
 
+    # Iterative pre-order DFS, keeps the order of the recursive traversal
+    visited = set()
     result_nodes = []
-    for uid in result:
-        for node in visit(uid):
+    stack = list(reversed(result))
+    while stack:
+        uid = stack.pop()
+        node = by_uid.get(uid) if uid not in visited else None
+        if node is not None:
+            visited.add(uid)
             result_nodes.append(node)
+            stack.extend(reversed(node['deps']))
+
+    if len(visited) != len(by_uid):
+        for uid in [uid for uid in by_uid if uid not in visited]:
+            del by_uid[uid]
 
     logger.debug('stripped %d, left %d nodes', len(graph_nodes) - len(result_nodes), len(result_nodes))
 
@@ -618,21 +628,16 @@ def _split_gcc(g):
             yield n
 
 
-def _substitute_uids(graph, tests, replaces, propagate=False):
+def _substitute_uids(graph, tests, replaces, propagate=False, by_uid=None):
+    """by_uid is uid -> node index of the graph, if given it's updated with the new uids"""
     timer = exts.timer.Timer('substitude_uids')
 
     if propagate:
-        nodes = {}
-
-        for n in graph['graph']:
-            nodes[n['uid']] = n
+        nodes = by_uid if by_uid is not None else _uid_index(graph['graph'])
 
         seen = {}
 
-        def traverse(uid):
-            if uid in seen:
-                return seen[uid]
-
+        def finish(uid):
             deps = nodes[uid].get('deps', ())
             affected = uid in replaces
 
@@ -642,7 +647,7 @@ def _substitute_uids(graph, tests, replaces, propagate=False):
                 newdeps = None
 
             for i, x in enumerate(deps):
-                if traverse(x):
+                if seen[x]:
                     affected = True
                     # materialize new deps only in case of processing affected node
                     if newdeps is None:
@@ -659,22 +664,46 @@ def _substitute_uids(graph, tests, replaces, propagate=False):
                 nodes[uid]['deps'] = newdeps
 
             seen[uid] = affected
-            return affected
+
+        def traverse(root):
+            # Iterative post-order DFS: a node is finished after all its deps
+            if root in seen:
+                return
+            stack = [(root, iter(nodes[root].get('deps', ())))]
+            in_progress = {root}
+            while stack:
+                uid, deps = stack[-1]
+                for dep in deps:
+                    if dep not in seen and dep not in in_progress:
+                        in_progress.add(dep)
+                        stack.append((dep, iter(nodes[dep].get('deps', ()))))
+                        break
+                else:
+                    stack.pop()
+                    in_progress.discard(uid)
+                    finish(uid)
 
         for x in graph['result']:
             traverse(x)
 
-        for x in replaces:
-            n = nodes[x]
-            n['uid'] = replaces[x]
+        renamed = [nodes[x] for x in replaces]
+        for n in renamed:
+            n['uid'] = replaces[n['uid']]
 
         timer.show_step("propagation")
     else:
+        renamed = []
         for node in graph['graph']:
             if node['uid'] in replaces:
                 node['uid'] = replaces[node['uid']]
+                renamed.append(node)
             node['deps'] = [replaces.get(dep_uid, dep_uid) for dep_uid in node['deps']]
 
+    if by_uid is not None:
+        for x in replaces:
+            by_uid.pop(x, None)
+        by_uid.update(_uid_index(renamed))
+
     graph['result'] = [replaces.get(res_uid, res_uid) for res_uid in graph['result']]
     if 'context' in graph['conf'] and 'sandbox_run_test_result_uids' in graph['conf']['context']:
         graph['conf']['context']['sandbox_run_test_result_uids'] = [
@@ -717,12 +746,6 @@ def _inject_default_requirements(graph, tests, reqs):
     _substitute_uids(graph, tests, old_to_new_uids)
 
 
-def _inject_stats_uid(graph):
-    for node in graph['graph']:
-        if 'stats_uid' not in node:
-            node['stats_uid'] = _calculate_stats_uid(node)
-
-
 def _calculate_stats_uid(node):
     return hashing.md5_value(
         str(
@@ -746,18 +769,27 @@ def _is_host_platform(node):
     return bool(node.get('host_platform'))
 
 
-# This function removes all common tags (tags which present in all nodes)
+# Final per-node transforms fused into two passes over the graph (in the order they used to run as separate passes):
+# stats_uid injection, tags stripping, applying of historical statistics, commands collection for
+# _OptimizableGraph.optimize_resources (the collected commands are returned).
+#
+# Tags stripping removes all common tags (tags which present in all nodes)
 # and assign the only tag "tool" to the host (tool) nodes.
 # The former is to reduce length of a runner progress report (runner adds all tags to a report line)
 # and the latter is somehow used in distbuild.
 # TODO:
 # - do the common tag removing in the runner before start (not in graph generating like this).
 # - assign tool tag in _build_tools().
-def _strip_tags(nodes):
+def _finalize_nodes(graph, apply_stat=None):
+    nodes = graph['graph']
     by_tag = collections.defaultdict(long)
     node_count = 0
+    commands = set()
 
     for node in nodes:
+        if 'stats_uid' not in node:
+            node['stats_uid'] = _calculate_stats_uid(node)
+
         if _is_host_platform(node):
             node['tags'] = ['tool']
         else:
@@ -767,15 +799,24 @@ def _strip_tags(nodes):
                 for t in tags:
                     by_tag[t] += 1
 
+        _OptimizableGraph.collect_node_commands(node, commands)
+
     bad_tags = frozenset(k for k, v in by_tag.items() if v == node_count)
-    if bad_tags:
+
+    if bad_tags or apply_stat is not None:
         for node in nodes:
-            if not _is_host_platform(node):
+            if bad_tags and not _is_host_platform(node):
                 tags = node.get('tags')
                 if tags:
                     node['tags'] = [tag for tag in tags if tag not in bad_tags]
 
-    return nodes
+            if apply_stat is not None:
+                apply_stat(node)
+
+    if apply_stat is not None:
+        apply_stat.finish()
+
+    return commands
 
 
 # See build_graph_and_tests::iter_target_flags
@@ -945,9 +986,7 @@ def _load_stat(graph_stat_path):
         load_graph_stat_stage.finish()
 
 
-def _add_stat_to_graph(graph, stat, path_filters=None):
-    add_stat_to_graph_stage = stager.start("add_stat_to_graph")
-
+def _check_stat_version(stat):
     stat_version = (stat or {}).get("version")
     if stat_version != GRAPH_STAT_VERSION:
         logger.error(
@@ -955,16 +994,25 @@ def _add_stat_to_graph(graph, stat, path_filters=None):
             stat_version,
             GRAPH_STAT_VERSION,
         )
-        add_stat_to_graph_stage.finish()
-        return
+        return False
+    return True
+
 
-    path_filters = ["$(BUILD_ROOT)/{}".format(pf) for pf in (path_filters or [])]
+class _StatApplier(object):
+    """Applies statistics to nodes within the apply pass of _finalize_nodes, the 'add_stat_to_graph' stage spans it"""
 
-    min_reqs_errors = 0
-    for node in graph["graph"]:
+    def __init__(self, graph, stat, path_filters=None):
+        self._stage = stager.start("add_stat_to_graph")
+        self._graph = graph
+        self._stat = stat
+        self._path_filters = ["$(BUILD_ROOT)/{}".format(pf) for pf in (path_filters or [])]
+        self._min_reqs_errors = 0
+
+    def __call__(self, node):
+        stat = self._stat
         try:
-            if not _node_matches_filter(node, path_filters):
-                continue
+            if not _node_matches_filter(node, self._path_filters):
+                return
 
             node_stat = stat["by_stats_uid"].get(node["stats_uid"])
             if node.get("kv") and node.get("kv").get("p"):
@@ -973,16 +1021,16 @@ def _add_stat_to_graph(graph, stat, path_filters=None):
                 )
             if node_stat and "skip" not in node_stat:
                 node["min_reqs"] = node_stat
-                _update_graph_execution_cost(node_stat, graph["conf"]["execution_cost"])
+                _update_graph_execution_cost(node_stat, self._graph["conf"]["execution_cost"])
 
         except Exception as e:
             _handle_error("Can not apply statistics: %r", e)
             node["min_reqs_error"] = 1
-            min_reqs_errors += 1
+            self._min_reqs_errors += 1
 
-    graph["conf"]["min_reqs_errors"] = min_reqs_errors
-
-    add_stat_to_graph_stage.finish()
+    def finish(self):
+        self._graph["conf"]["min_reqs_errors"] = self._min_reqs_errors
+        self._stage.finish()
 
 
 def _get_full_platform_name(platform, tags):
@@ -2096,13 +2144,15 @@ def _build_graph_and_tests(opts, check, event_queue, exit_stack, display):
         with stager.scope('strip_packages_from_results'):
             graph = _strip_packages_from_results(graph)
 
+    # uid -> node index shared by the graph passes below
+    by_uid = _uid_index(graph['graph'])
+
     with stager.scope('strip-graph'):
-        graph = strip_graph(graph)
+        graph = strip_graph(graph, by_uid=by_uid)
         timer.show_step('strip graph')
 
     if opts.gen_renamed_results:
         # TODO: this works incorrectly with tests outputs
-        by_uid = {n['uid']: n for n in graph['graph']}
         graph = _gen_rename_nodes(graph, by_uid, src_dir)
         timer.show_step('gen rename nodes')
 
@@ -2131,7 +2181,7 @@ def _build_graph_and_tests(opts, check, event_queue, exit_stack, display):
         graph['graph'] = list(_split_gcc(graph['graph']))
 
     if 0:
-        graph = _optimize_graph(graph)
+        graph = _optimize_graph(graph, by_uid)
 
     if opts.yndexing:
         graph = _make_yndexing_graph(graph, opts, ymake_bin, host_tool_resolver)
@@ -2173,25 +2223,24 @@ def _build_graph_and_tests(opts, check, event_queue, exit_stack, display):
         imprint.stats()
     bg_cache.archive_cache_dir(opts)
 
-    with stager.scope('inject_stats_uid'):
-        _inject_stats_uid(graph)
-
-    with stager.scope("strip-tags"):
-        graph['graph'] = _strip_tags(graph['graph'])
-        timer.show_step('strip tags')
-
+    apply_stat = None
     if opts.graph_stat_path:
         stat = _load_stat(opts.graph_stat_path)
 
         nodes_stat_path_filters = opts.nodes_stat_path_filters.split(';') if opts.nodes_stat_path_filters else []
-        _add_stat_to_graph(graph, stat, nodes_stat_path_filters)
+        if _check_stat_version(stat):
+            apply_stat = _StatApplier(graph, stat, nodes_stat_path_filters)
+
+    with stager.scope('finalize-nodes'):
+        commands = _finalize_nodes(graph, apply_stat)
+        timer.show_step('finalize nodes')
 
     if opts.dump_graph_execution_cost:
         with open(opts.dump_graph_execution_cost, 'w') as f:
             f.write(json.dumps(graph['conf'].get('execution_cost', {})))
 
     graph = _OptimizableGraph(graph)
-    graph.optimize_resources()
+    graph.optimize_resources(commands)
 
     with stager.scope('clean-intern-string-storage'):
         # After this point all ccgraphs become useless (all python graphs remain good).
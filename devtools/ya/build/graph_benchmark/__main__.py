@@ -0,0 +1,83 @@
+"""Benchmark of build graph post-processing on synthetic graphs: graph_benchmark [size ...]"""
+
+from __future__ import print_function
+
+import random
+import resource
+import sys
+
+from core import stage_tracer
+import build.graph as lg
+
+stager = stage_tracer.get_tracer("graph")
+
+
+def gen_synthetic_graph(size, max_deps=4, seed=0):
+    rnd = random.Random(seed)
+    nodes = []
+    for i in range(size):
+        uid = 'uid-{}'.format(i)
+        deps = ['uid-{}'.format(rnd.randrange(i)) for _ in range(min(i, rnd.randint(0, max_deps)))]
+        nodes.append(
+            {
+                'uid': uid,
+                'deps': deps,
+                'inputs': ['$(SOURCE_ROOT)/src/{}.cpp'.format(i)],
+                'outputs': ['$(BUILD_ROOT)/src/{}.o'.format(i)],
+                'cmds': [{'cmd_args': ['$(CLANG)/bin/clang++', '-c', 'src/{}.cpp'.format(i)], 'env': {}}],
+                'kv': {'p': 'CC'},
+                'tags': ['release', 'x86_64'],
+                'platform': 'linux',
+                'host_platform': i % 10 == 0,
+            }
+        )
+    # Chain of dependencies through the whole graph to check deep traversals
+    for i in range(1, size):
+        nodes[i]['deps'].append(nodes[i - 1]['uid'])
+    result = [nodes[-1]['uid']] + [n['uid'] for n in nodes[-100:]]
+    return {'graph': nodes, 'result': result, 'conf': {'resources': [{'pattern': 'CLANG'}, {'pattern': 'UNUSED'}]}}
+
+
+class RssConsumer(stage_tracer.Consumer):
+    def __init__(self):
+        self.peak_rss = {}
+
+    def start(self, name, start_time):
+        pass
+
+    def finish(self, name, start_time, finish_time):
+        # ru_maxrss is in kilobytes on Linux
+        self.peak_rss[name] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def benchmark_postprocessing(sizes):
+    rss = RssConsumer()
+    stage_tracer.stage_tracer.add_consumer(rss, send_existing_events=False)
+
+    for size in sizes:
+        prefix = 'bench-{}-'.format(size)
+        with stager.scope(prefix + 'generate'):
+            graph = gen_synthetic_graph(size)
+        by_uid = lg._uid_index(graph['graph'])
+        with stager.scope(prefix + 'strip-graph'):
+            graph = lg.strip_graph(graph, by_uid=by_uid)
+        with stager.scope(prefix + 'substitute-uids'):
+            replaces = {n['uid']: n['uid'] + '-new' for n in graph['graph'][::1000]}
+            lg._substitute_uids(graph, [], replaces, propagate=True, by_uid=by_uid)
+        with stager.scope(prefix + 'finalize-nodes'):
+            commands = lg._finalize_nodes(graph)
+        graph = lg._OptimizableGraph(graph)
+        with stager.scope(prefix + 'optimize-resources'):
+            graph.optimize_resources(commands)
+
+    for name, stat in sorted(stage_tracer.get_stat('graph').items()):
+        if name.startswith('bench-'):
+            print('{:<40} {:>8.3f}s peak rss {:>6} MiB'.format(name, stat.duration, rss.peak_rss.get(name)))
+
+
+def main():
+    benchmark_postprocessing([int(x) for x in sys.argv[1:]] or [100000, 500000, 2000000])
+
+
+if __name__ == '__main__':
+    main()
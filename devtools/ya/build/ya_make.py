@@ -358,7 +358,15 @@ def _setup_content_uids(opts, enable):
         logger.debug('content UIDs forced')
 
 
+def setup_digest_cache(garbage_dir):
+    from exts import digest_cache
+
+    if hashing.get_digest_cache() is None:
+        hashing.setup_digest_cache(digest_cache.DigestCache(os.path.join(garbage_dir, 'digests')))
+
+
 def make_cache(opts, garbage_dir):
+    setup_digest_cache(garbage_dir)
     if exts.windows.on_win():
         _setup_content_uids(opts, False)
         return uid_store.UidStore(os.path.join(garbage_dir, 'cache', CACHE_GENERATION))
@@ -382,7 +390,7 @@ def make_cache(opts, garbage_dir):
         return ring_store.RingStore(os.path.join(garbage_dir, 'cache', CACHE_GENERATION))
 
 
-def init_bazel_remote_cache(opts):
+def init_bazel_remote_cache(opts, garbage_dir=None):
     use_bazel_dist_cache = all(
         (
             getattr(opts, 'bazel_remote_store', False),
@@ -414,6 +422,7 @@ def init_bazel_remote_cache(opts):
                 readonly=getattr(opts, 'bazel_remote_readonly', True),
                 max_connections=getattr(opts, 'dist_store_threads', 24),
                 fits_filter=fits_filter,
+                digest_cache_file=os.path.join(garbage_dir, 'bazel_digests') if garbage_dir else None,
             )
 
 
@@ -821,7 +830,7 @@ class Context(object):
         self.output_replacements = [(opts.oauth_token, "<YA-TOKEN>")] if opts.oauth_token else []
 
         if getattr(opts, 'bazel_remote_store', False):
-            dist_cache_future = core_async.future(lambda: init_bazel_remote_cache(opts))
+            dist_cache_future = core_async.future(lambda: init_bazel_remote_cache(opts, self.garbage_dir))
         else:
             dist_cache_future = core_async.future(lambda: init_yt_dist_cache(opts))
 
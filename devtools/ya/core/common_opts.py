@@ -417,6 +417,7 @@ class EventLogFileOptions(Options):
         self.dump_platform_to_evlog = False
         self.dump_failed_node_info_to_evlog = False
         self.evlog_dump_node_stat = False
+        self.evlog_async = False
 
     @staticmethod
     def consumer():
@@ -472,6 +473,17 @@ class EventLogFileOptions(Options):
                 name='YA_EVLOG_NODE_STAT',
                 hook=SetConstValueHook('evlog_dump_node_stat', return_true_if_enabled),
             ),
+            ArgConsumer(
+                ['--evlog-async'],
+                help='Buffer event log records in memory and write them from a background thread',
+                hook=SetConstValueHook('evlog_async', True),
+                group=PRINT_CONTROL_GROUP,
+                visible=HelpLevel.INTERNAL,
+            ),
+            EnvConsumer(
+                name='YA_EVLOG_ASYNC',
+                hook=SetValueHook('evlog_async', return_true_if_enabled),
+            ),
         ]
 
     def postprocess2(self, params):
@@ -48,12 +48,10 @@ class ThreadPoolMapper(SimpleMapper):
             logging.exception("Can't create thread pool for ThreadPoolMapper; Using FakePool")
             cls.pool = cls._FakePool()
 
-    def __init__(self, f):
-        super(ThreadPoolMapper, self).__init__(f)
-        self.pool = ThreadPool(cpu_count())
-
     def __call__(self, *items):
         # TODO: yieldable map?
+        # Pool is shared by all mappers and created on the first use
+        self._init_pool()
         return dict(zip(items, self.pool.map(self.f, items)))
 
 
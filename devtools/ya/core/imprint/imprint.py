@@ -1,14 +1,21 @@
 import os
 import logging
+import stat
+import threading
 
 import six
 
-from exts import func, os2, hashing
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+from exts import func, hashing
 from core.config import misc_root, find_root
 
 # from yalibrary.monitoring import YaMonEvent
 
-from .base import SimpleMapper, BaseCache, BaseFileCache
+from .base import SimpleMapper, ThreadPoolMapper, BaseCache, BaseFileCache
 from .change_list import ChangeList
 
 
@@ -52,14 +59,50 @@ class ArcPath:
         return path
 
 
+class PathCache(BaseCache):
+    """Cache keyed by absolute paths, a change list invalidates entries of changed paths, their children and parents"""
+
+    def _invalidate(self, rel_paths):
+        changed = set(map(ArcPath.to_abs, rel_paths))
+        parents = set()
+        for path in changed:
+            parent = os.path.dirname(path)
+            while parent not in parents and parent != path:
+                parents.add(parent)
+                path, parent = parent, os.path.dirname(parent)
+
+        def affected(path):
+            path = os.path.normpath(path)
+            if path in parents:
+                return True
+            while True:
+                if path in changed:
+                    return True
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return False
+                path = parent
+
+        to_invalidate = [item for item in self._cache if affected(item)]
+        for item in to_invalidate:
+            del self._cache[item]
+
+        self.logger.debug("Invalidated %d items", len(to_invalidate))
+
+
 class YaStoredCache(BaseFileCache):
     CACHE_PATH_DEFAULT = "{misc_root}/conf/cache/"
     CACHE_FILE_DEFAULT = "fs.cache.{version}"
     CACHE_VERSION = 1
 
-    def __init__(self, name, f, read=True, write=True, cache_source_path=None, process_arcadia_clash=True):
+    def __init__(
+        self, name, f, read=True, write=True, cache_source_path=None, process_arcadia_clash=True, counters=None
+    ):
         self.cache_source_path = cache_source_path
         self.process_arcadia_clash = process_arcadia_clash
+        self._counters = counters
+        # mtimes from the last validation pass
+        self._mtimes = {}
 
         super(YaStoredCache, self).__init__(name, f, check=self._mtime_files_check, read=read, write=write)
 
@@ -88,14 +131,30 @@ class YaStoredCache(BaseFileCache):
 
         return os.path.join(path_name, file_name)
 
-    @staticmethod
-    def _mtime_files_check(abs_path, result):
-        return os.stat(abs_path).st_mtime != result['check']
+    def _mtime(self, abs_path):
+        if self._counters:
+            self._counters.add(stat_calls=1)
+        return os.stat(abs_path).st_mtime
+
+    def _mtime_files_check(self, abs_path, result):
+        mtime = self._mtimes.get(abs_path)
+        if mtime is None:
+            mtime = self._mtime(abs_path)
+        return mtime != result['check']
+
+    def _apply(self, _items):
+        if self._additional_check_enabled:
+            # Validate all cached items with a single parallel stat pass
+            items = [item for item in set(_items) if item in self._cache]
+            ThreadPoolMapper._init_pool()
+            self._mtimes = dict(zip(items, ThreadPoolMapper.pool.map(self._mtime, items)))
+        try:
+            return super(YaStoredCache, self)._apply(_items)
+        finally:
+            self._mtimes = {}
 
     def _update_cache(self, abs_path, result):
-        return super(YaStoredCache, self)._update_cache(
-            abs_path, {'value': result, 'check': os.stat(abs_path).st_mtime}
-        )
+        return super(YaStoredCache, self)._update_cache(abs_path, {'value': result, 'check': self._mtime(abs_path)})
 
     def _do_calcs(self, abs_paths):
         for abs_path, result in super(YaStoredCache, self)._do_calcs(abs_paths):
@@ -143,7 +202,7 @@ class YaStoredCache(BaseFileCache):
         for abs_path in abs_paths:
             # clean child files
             index = items_indexes.get(abs_path, None)
-            if index:
+            if index is not None:
                 to_invalidate.add(abs_path)
                 index += 1
 
@@ -170,14 +229,41 @@ class ImprintException(Exception):
     pass
 
 
+class ImprintCounters(object):
+    NAMES = ('stat_calls', 'files_hashed', 'bytes_hashed')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def add(self, **kwargs):
+        with self._lock:
+            for name, value in six.iteritems(kwargs):
+                setattr(self, name, getattr(self, name) + value)
+
+    def clear(self):
+        with self._lock:
+            for name in self.NAMES:
+                setattr(self, name, 0)
+
+    def _json(self):
+        with self._lock:
+            return {name: getattr(self, name) for name in self.NAMES}
+
+    def __repr__(self):
+        return "<{} {}>".format(self.__class__.__name__, self._json())
+
+
 class Imprint:
     def __init__(self, excluded=None):
         self.logger = logging.getLogger(__name__ + ":" + self.__class__.__name__)
 
+        self.counters = ImprintCounters()
+
         self._rel_path = BaseCache("to_rel", SimpleMapper(ArcPath.to_rel))
         self._content_hash = self._new_content_hash()
-        self._iter_files = BaseCache("iter_cache", SimpleMapper(lambda item: sorted(self._do_iter_files(item))))
-        self._dir_cache = BaseCache("dir_cache", lambda *items: dict(self._do(items)))
+        self._iter_files = PathCache("iter_cache", SimpleMapper(lambda item: sorted(self._do_iter_files(item))))
+        self._dir_cache = PathCache("dir_cache", lambda *items: dict(self._do(items)))
 
         self._excluded_dirs = (excluded or tuple()) + ('.svn', '.cache', '.idea')
 
@@ -185,9 +271,13 @@ class Imprint:
 
         self._change_list_applied = False
 
-    @staticmethod
-    def _new_content_hash():
-        return BaseCache("content_hash", SimpleMapper(hashing.fast_filehash))
+    def _new_content_hash(self):
+        return PathCache("content_hash", ThreadPoolMapper(self._hash_file))
+
+    def _hash_file(self, abs_path):
+        result = hashing.fast_filehash(abs_path)
+        self.counters.add(stat_calls=1, files_hashed=1, bytes_hashed=os.stat(abs_path).st_size)
+        return result
 
     def enable_fs(self, read=True, write=True, cache_source_path=None, process_arcadia_clash=True, quiet=False):
         # TODO: Check -xx
@@ -208,6 +298,7 @@ class Imprint:
             write=write,
             cache_source_path=cache_source_path,
             process_arcadia_clash=process_arcadia_clash,
+            counters=self.counters,
         )
 
     def disable_fs(self):
@@ -272,12 +363,18 @@ class Imprint:
         if os.path.basename(abs_path) in self._excluded_dirs:
             yield "excluded", True
 
-    @staticmethod
-    def _is_build_file(abs_p):
-        return os.path.isfile(abs_p) and not os.path.islink(abs_p) and not abs_p.endswith('.pyc')
+    def _lstat_mode(self, abs_p):
+        self.counters.add(stat_calls=1)
+        try:
+            return os.lstat(abs_p).st_mode
+        except OSError:
+            return 0
+
+    def _is_build_file(self, abs_p):
+        return not abs_p.endswith('.pyc') and stat.S_ISREG(self._lstat_mode(abs_p))
 
     def _is_build_dir(self, abs_p):
-        return os.path.isdir(abs_p) and not os.path.islink(abs_p) and not os.path.basename(abs_p) in self._excluded_dirs
+        return not os.path.basename(abs_p) in self._excluded_dirs and stat.S_ISDIR(self._lstat_mode(abs_p))
 
     def _do_iter_files(self, abs_path, yield_dirs=False, do_recursively=True):
         if self._is_build_file(abs_path):
@@ -287,22 +384,26 @@ class Imprint:
             if yield_dirs:
                 yield abs_path
 
-            for root, dirs, files in os2.fastwalk(abs_path):
-                for d in [p for p in dirs if not self._is_build_dir(os.path.join(root, p))]:
-                    dirs.remove(d)
-
-                if yield_dirs:
-                    for d in dirs:
-                        yield os.path.join(root, d)
-
-                for file_name in files:
-                    abs_file = os.path.join(root, file_name)
-
-                    if self._is_build_file(abs_file):
-                        yield abs_file
-
-                if not do_recursively:
-                    return
+            # Entry types come from readdir, so the walk doesn't stat every entry
+            roots = [abs_path]
+            while roots:
+                root = roots.pop()
+                try:
+                    entries = list(scandir(root))
+                except OSError as e:
+                    self.logger.debug("Can't list %s: %s", root, e)
+                    continue
+
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name in self._excluded_dirs:
+                            continue
+                        if yield_dirs:
+                            yield entry.path
+                        if do_recursively:
+                            roots.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and not entry.name.endswith('.pyc'):
+                        yield entry.path
         else:
             self.logger.warning("%s should be either file or folder to generate imprint for", abs_path)
 
@@ -323,6 +424,7 @@ class Imprint:
         self._content_hash.clear()
         self._iter_files.clear()
         self._dir_cache.clear()
+        self.counters.clear()
 
     def store(self):
         self._content_hash.store()
@@ -337,6 +439,7 @@ class Imprint:
         # Iter files just helper cache
         # self.logger.debug(self._iter_files.stats)
         self.logger.debug(self._dir_cache.stats)
+        self.logger.debug(self.counters)
 
         # for name, stats in {
         #     'ImprintRelPath': self._rel_path.stats,
@@ -352,6 +455,7 @@ class Imprint:
             # Iter files just helper cache
             # self._iter_files.stats._json(),
             self._dir_cache.stats._json(),
+            self.counters._json(),
         )
 
     def use_change_list(self, file_name, quiet=False):
@@ -370,13 +474,22 @@ class Imprint:
             else:
                 change_list = ChangeList(file_name)
 
-            self._dir_cache.use_change_list(change_list.paths)
-            self._iter_files.use_change_list(change_list.paths)
-            self._content_hash.use_change_list(change_list.paths)
-            self._rel_path.use_change_list(change_list.paths)
+            self.use_changed_paths(change_list.paths)
 
             self._change_list_applied = True
 
+    def use_changed_paths(self, paths):
+        """
+        Revalidate only given paths (relative to arcadia root or absolute) and directories containing them,
+        other files are not checked for modification anymore.
+        A long-living process computes imprints once with modification checks and then calls it
+        for every change set it gets from a file system watcher, the cached imprints are kept between calls.
+        """
+        paths = tuple(paths)
+        self._dir_cache.use_change_list(paths)
+        self._iter_files.use_change_list(paths)
+        self._content_hash.use_change_list(paths)
+
     # backward compatibility
 
     # DEPRECATED
@@ -90,6 +90,17 @@ def profile_value(value_name, value):
     _flush()
 
 
+def profile_values(values):
+    """profile_value() for a dict of values with a single flush"""
+    logger.debug('Profile values {}'.format(values))
+
+    with _profile_lock():
+        for value_name, value in iteritems(values):
+            _set_value('value', value_name, value)
+
+    _flush()
+
+
 def profile_inc_value(value_name, delta=1):
     with _profile_lock():
         _set_value('value', value_name, delta + _get_value('value', value_name, 0))
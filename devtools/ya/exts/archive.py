@@ -10,17 +10,24 @@ import exts.tmp
 import library.python.archive as archive
 from library.python.archive import (  # noqa
     GZIP,
+    STREAM_HEADER_SIZE,
     ZSTD,
     Compression,
     Level,
     get_compression_level,
     get_archive_filter_name,
+    get_stream_mode,
 )  # noqa
 
 
-def extract_from_tar(tar_file_path, output_dir, strip_components=None):
+def extract_from_tar(tar_file_path, output_dir, strip_components=None, threads=None):
     exts.fs.create_dirs(output_dir)
-    archive.extract_tar(tar_file_path, output_dir, strip_components=strip_components)
+    archive.extract_tar(tar_file_path, output_dir, strip_components=strip_components, threads=threads)
+
+
+def extract_from_tar_stream(stream, output_dir, strip_components=None, mode="r|*"):
+    exts.fs.create_dirs(output_dir)
+    archive.extract_tar_stream(stream, output_dir, strip_components=strip_components, mode=mode)
 
 
 def create_tar(
@@ -33,6 +40,7 @@ def create_tar(
     postprocess=None,
     dereference=False,
     work_dir=None,
+    threads=None,
 ):
     '''
     Creates stable archive by default (bitexact for same content):
@@ -49,6 +57,7 @@ def create_tar(
     :param postprocess: function that accepts tree parameters: src, dst, st_mode
         which will be called when src is successfully added to the archive
     :param dereference: dereference symbolic links
+    :param threads: number of compression threads (zstd only)
     '''
     if isinstance(paths, six.string_types):
         # (path, arcname)
@@ -56,7 +65,15 @@ def create_tar(
     with exts.tmp.temp_dir(dir=work_dir) as temp_dir:
         temp_tar_path = os.path.join(temp_dir, os.path.basename(tar_file_path))
         archive.tar(
-            paths, temp_tar_path, compression_filter, compression_level, fixed_mtime, onerror, postprocess, dereference
+            paths,
+            temp_tar_path,
+            compression_filter,
+            compression_level,
+            fixed_mtime,
+            onerror,
+            postprocess,
+            dereference,
+            threads=threads,
         )
         shutil.move(temp_tar_path, tar_file_path)
 
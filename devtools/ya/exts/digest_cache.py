@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Digests of files modified less than this many seconds ago are not cached
+RACY_INTERVAL = 2
+
+
+def _time_ns(st, name):
+    # st_*time_ns are python 3 only
+    value = getattr(st, name + '_ns', None)
+    return value if value is not None else int(getattr(st, name) * 10**9)
+
+
+def stat_key(st):
+    return st.st_dev, st.st_ino, st.st_size, _time_ns(st, 'st_mtime'), _time_ns(st, 'st_ctime')
+
+
+class DigestCache(object):
+    """
+    Persistent (st_dev, st_ino, size, mtime_ns, ctime_ns) -> digest map.
+    Any change of the file content or metadata (including links count) changes ctime and invalidates the entry.
+    Records are appended to the file with O_APPEND, so the file is shared between processes:
+    records of other processes are picked up on cache miss.
+    Digests of files modified within RACY_INTERVAL are not cached: the file may be rewritten within the same
+    timestamp tick keeping the key.
+    """
+
+    KEY_FIELDS = 5
+    # Rewrite the file on load if it holds this many times more records than unique keys
+    COMPACTION_RATIO = 2
+    # Start from scratch when the cache grows too big (entries of removed files are never removed otherwise)
+    MAX_ENTRIES = 1 << 20
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._offset = 0
+        self._file_id = None
+        self.hits = 0
+        self.misses = 0
+        self.bytes_avoided = 0
+        self.bytes_hashed = 0
+        if path:
+            records = self._read_tail()
+            if len(self._digests) > self.MAX_ENTRIES:
+                self._digests = {}
+                self._compact()
+            elif records > self.COMPACTION_RATIO * len(self._digests):
+                self._compact()
+
+    def _read_tail(self):
+        """Load records appended since the last read"""
+        return self._apply_tail(self._file_id, self._offset, self._read_file(self._file_id, self._offset))
+
+    def _read_file(self, file_id, offset):
+        """Data appended to the file after offset of file_id (I/O part of _read_tail, needs no lock)"""
+        try:
+            with open(self._path, 'rb') as afile:
+                st = os.fstat(afile.fileno())
+                new_file_id = (st.st_dev, st.st_ino)
+                if new_file_id != file_id or st.st_size < offset:
+                    # File was compacted by another process
+                    offset = 0
+                afile.seek(offset)
+                return new_file_id, offset, afile.read()
+        except (IOError, OSError) as e:
+            logger.debug("Can't load digest cache %s: %s", self._path, e)
+            return None
+
+    def _apply_tail(self, file_id, offset, tail):
+        """Parse data read by _read_file(file_id, offset) unless the state has been changed meanwhile"""
+        records = 0
+        if tail is None or (self._file_id, self._offset) != (file_id, offset):
+            return records
+        self._file_id, start, data = tail
+
+        # Keep partially written last record for the next read
+        end = data.rfind(b'\n') + 1
+        self._offset = start + end
+        for line in data[:end].decode('utf-8', 'replace').splitlines():
+            records += 1
+            parts = line.split()
+            if len(parts) != self.KEY_FIELDS + 1:
+                continue
+            try:
+                key = tuple(int(x) for x in parts[: self.KEY_FIELDS])
+            except ValueError:
+                continue
+            self._digests[key] = parts[self.KEY_FIELDS]
+        return records
+
+    def _compact(self):
+        tmp_path = '{}.tmp.{}'.format(self._path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as afile:
+                for key, digest in self._digests.items():
+                    afile.write(self._format(key, digest))
+                self._offset = afile.tell()
+                st = os.fstat(afile.fileno())
+                self._file_id = (st.st_dev, st.st_ino)
+            os.rename(tmp_path, self._path)
+        except (IOError, OSError) as e:
+            logger.debug("Can't compact digest cache %s: %s", self._path, e)
+
+    @staticmethod
+    def _format(key, digest):
+        return ' '.join(str(x) for x in key + (digest,)).encode('utf-8') + b'\n'
+
+    def _store(self, key, digest):
+        self._digests[key] = digest
+        if not self._path:
+            return
+        try:
+            # Single short write with O_APPEND doesn't interleave with other writers
+            fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, self._format(key, digest))
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.debug("Can't update digest cache %s: %s", self._path, e)
+
+    def get(self, path, compute, st=None):
+        """Return cached digest of the file at path or compute(path) and remember it"""
+        st = st or os.stat(path)
+        key = stat_key(st)
+        with self._lock:
+            digest = self._digests.get(key)
+            file_id, offset = self._file_id, self._offset
+        if digest is None and self._path:
+            # Records of other processes
+            tail = self._read_file(file_id, offset)
+            with self._lock:
+                self._apply_tail(file_id, offset, tail)
+                digest = self._digests.get(key)
+        if digest is not None:
+            with self._lock:
+                self.hits += 1
+                self.bytes_avoided += st.st_size
+            return digest
+
+        digest = compute(path)
+        now = time.time()
+        with self._lock:
+            self.misses += 1
+            self.bytes_hashed += st.st_size
+            # File might be changed while hashing. A file modified within the timestamp granularity
+            # may be modified again without changing the key, its digest is not cached (racy stat)
+            if stat_key(os.stat(path)) == key and now - max(st.st_mtime, st.st_ctime) > RACY_INTERVAL:
+                self._store(key, digest)
+        return digest
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes_avoided': self.bytes_avoided,
+                'bytes_hashed': self.bytes_hashed,
+            }
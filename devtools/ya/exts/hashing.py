@@ -1,32 +1,51 @@
 import os
 import hashlib
+import mmap
+import stat
 from hashlib import md5  # hashlib.md5 deprecated
 import six
 
 import exts.os2
 
+# Files larger than this are hashed through mmap in a single update() call (hashlib releases GIL)
+MMAP_HASH_THRESHOLD = 1 << 20
 
-def git_like_hash_with_size(filepath, follow_links=False):
-    """
-    Calculate git like hash for path
-    """
+_digest_cache = None
 
-    if not follow_links and os.path.islink(filepath):
-        return git_like_hash_str_with_size(os.readlink(filepath))
 
+def setup_digest_cache(cache):
+    """Set exts.digest_cache.DigestCache shared by git_like_hash_with_size callers"""
+    global _digest_cache
+    _digest_cache = cache
+
+
+def get_digest_cache():
+    return _digest_cache
+
+
+def _git_like_file_hash(filepath):
     sha = hashlib.sha1()
 
     file_size = 0
 
     with open(filepath, 'rb') as f:
-        while True:
-            block = f.read(2**16)
-
-            if not block:
-                break
-
-            file_size += len(block)
-            sha.update(block)
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_HASH_THRESHOLD:
+            mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                sha.update(mm)
+            finally:
+                mm.close()
+            file_size = size
+        else:
+            while True:
+                block = f.read(2**16)
+
+                if not block:
+                    break
+
+                file_size += len(block)
+                sha.update(block)
 
     sha.update(six.ensure_binary('\0'))
     sha.update(six.ensure_binary(str(file_size)))
@@ -34,6 +53,22 @@ def git_like_hash_with_size(filepath, follow_links=False):
     return sha.hexdigest(), file_size
 
 
+def git_like_hash_with_size(filepath, follow_links=False):
+    """
+    Calculate git like hash for path
+    """
+
+    if not follow_links and os.path.islink(filepath):
+        return git_like_hash_str_with_size(os.readlink(filepath))
+
+    if _digest_cache is not None:
+        st = os.stat(filepath)
+        if stat.S_ISREG(st.st_mode):
+            return _digest_cache.get(filepath, lambda path: _git_like_file_hash(path)[0], st), st.st_size
+
+    return _git_like_file_hash(filepath)
+
+
 def git_like_hash_str_with_size(s):
     """
     Calculate git like hash for string
@@ -42,16 +42,32 @@ def make_headers(headers=None):
     return result
 
 
-@exts.retry.retrying(max_times=7, retry_sleep=lambda i, t: i * 5)
-def download_file(url, path, mode=0, expected_md5=None, headers=None):
-    exts.fs.ensure_removed(path)
-    exts.fs.create_dirs(os.path.dirname(path))
+class StreamNotSupportedException(Exception):
+    pass
 
-    file_md5 = hashlib.md5()
-    chunks_sizes = []
 
-    logger.debug('Downloading %s to %s, expect md5=%s', url, path, expected_md5)
-    start_time = time.time()
+class _HashingReader(object):
+    """File-like wrapper of the response which passes all read data to the callbacks"""
+
+    def __init__(self, read, callbacks, prefix=b''):
+        self._read = read
+        self._callbacks = callbacks
+        self._prefix = prefix
+
+    def read(self, size=-1):
+        if self._prefix:
+            if size < 0 or size >= len(self._prefix):
+                data, self._prefix = self._prefix, b''
+            else:
+                data, self._prefix = self._prefix[:size], self._prefix[size:]
+            return data
+        data = self._read(size)
+        for callback in self._callbacks:
+            callback(data)
+        return data
+
+
+def _open_url(url, headers=None):
     try:
         request = urllib.request.Request(url)
         for k, v in six.iteritems(make_headers(headers=headers)):
@@ -71,6 +87,20 @@ def download_file(url, path, mode=0, expected_md5=None, headers=None):
         raise DownloadTimeoutException(e)
 
     logger.debug('Request to %s has headers %s', url, res.info())
+    return res
+
+
+@exts.retry.retrying(max_times=7, retry_sleep=lambda i, t: i * 5)
+def download_file(url, path, mode=0, expected_md5=None, headers=None):
+    exts.fs.ensure_removed(path)
+    exts.fs.create_dirs(os.path.dirname(path))
+
+    file_md5 = hashlib.md5()
+    chunks_sizes = []
+
+    logger.debug('Downloading %s to %s, expect md5=%s', url, path, expected_md5)
+    start_time = time.time()
+    res = _open_url(url, headers)
 
     with open(path, 'wb') as dest_file:
         exts.io2.copy_stream(res.read, dest_file.write, file_md5.update, lambda d: chunks_sizes.append(len(d)))
@@ -90,6 +120,56 @@ def download_file(url, path, mode=0, expected_md5=None, headers=None):
     )
 
 
+def download_and_extract(url, output_dir, expected_md5=None, headers=None, strip_components=None):
+    """
+    Extracts tar archive to output_dir while it's being downloaded, the archive is never stored on disk.
+    MD5 is computed on the fly and checked when the whole body is read, so on BadMD5Exception
+    output_dir contains untrusted data and must be cleaned by the caller.
+    Raises StreamNotSupportedException (before anything is extracted) if the archive compression
+    can't be decoded on the fly.
+    No retries: the caller is expected to fall back to download_file() and extraction from the file.
+    """
+    import exts.archive
+
+    file_md5 = hashlib.md5()
+    chunks_sizes = []
+
+    logger.debug('Downloading and extracting %s to %s, expect md5=%s', url, output_dir, expected_md5)
+    start_time = time.time()
+    res = _open_url(url, headers)
+
+    header = b''
+    while len(header) < exts.archive.STREAM_HEADER_SIZE:
+        data = res.read(exts.archive.STREAM_HEADER_SIZE - len(header))
+        if not data:
+            break
+        header += data
+    file_md5.update(header)
+    chunks_sizes.append(len(header))
+
+    stream_mode = exts.archive.get_stream_mode(header)
+    if stream_mode is None:
+        res.close()
+        raise StreamNotSupportedException('Archive from {} cannot be extracted on the fly'.format(url))
+
+    stream = _HashingReader(res.read, (file_md5.update, lambda d: chunks_sizes.append(len(d))), prefix=header)
+    exts.archive.extract_from_tar_stream(stream, output_dir, strip_components=strip_components, mode=stream_mode)
+    # The end of tar archive may be followed by padding, it's needed for md5
+    exts.io2.copy_stream(stream.read)
+
+    if expected_md5 and expected_md5 != file_md5.hexdigest():
+        raise BadMD5Exception('MD5 sum expected {}, but was {}'.format(expected_md5, file_md5.hexdigest()))
+
+    logger.debug(
+        'Downloading and extracting finished %s to %s, md5=%s, size=%s, elapsed=%f',
+        url,
+        output_dir,
+        file_md5.hexdigest(),
+        str(sum(chunks_sizes)),
+        time.time() - start_time,
+    )
+
+
 def _http_call(url, method, data=None, headers=None, timeout=30):
     # type: (str, str, tp.Any, dict[str, str] | None, int) -> bytes
     logger.debug('%s request using urllib2 %s%s', method, url, ', {} bytes'.format(len(data)) if data else '')
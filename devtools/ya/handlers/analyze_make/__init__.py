@@ -32,6 +32,10 @@ class EvlogFileOptions(core.yarg.Options):
         self.analyze_evlog_file = None
         self.analyze_distbuild_json_file = None
         self.detailed = False
+        self.timeline_from = None
+        self.timeline_to = None
+        self.trace_format = 'json'
+        self.evlog_index = False
 
     @staticmethod
     def consumer():
@@ -47,6 +51,26 @@ class EvlogFileOptions(core.yarg.Options):
             core.yarg.ArgConsumer(
                 ['--detailed'], help='Draw detailed data', hook=core.yarg.SetConstValueHook('detailed', True)
             ),
+            core.yarg.ArgConsumer(
+                ['--from'],
+                help='Draw only events after this time (seconds from the build start)',
+                hook=core.yarg.SetValueHook('timeline_from', transform=float),
+            ),
+            core.yarg.ArgConsumer(
+                ['--to'],
+                help='Draw only events before this time (seconds from the build start)',
+                hook=core.yarg.SetValueHook('timeline_to', transform=float),
+            ),
+            core.yarg.ArgConsumer(
+                ['--format'],
+                help='Trace format',
+                hook=core.yarg.SetValueHook('trace_format', values=['json', 'perfetto']),
+            ),
+            core.yarg.ArgConsumer(
+                ['--index'],
+                help='Use sidecar index of the event log (built on the first use) to read only the requested time range',
+                hook=core.yarg.SetConstValueHook('evlog_index', True),
+            ),
         ]
 
 
@@ -1,12 +1,13 @@
+import itertools
 import sys
 import os
 
-import exts.yjson as json
-
 import devtools.ya.tools.analyze_make.common as common
 import yalibrary.display
 import yalibrary.formatter
 
+from .trace_writer import JsonTraceWriter, PerfettoTraceWriter
+
 
 def convert_to_chromium_trace(nodes):
     threads = {}
@@ -42,6 +43,42 @@ def get_display(stream):
     return yalibrary.display.Display(stream, formatter)
 
 
+def filter_by_time(nodes, time_from, time_to):
+    for node in nodes:
+        if (time_from is None or node.end >= time_from) and (time_to is None or node.start <= time_to):
+            yield node
+
+
+def write_trace(nodes, fname, trace_format):
+    """Write nodes into the trace file, returns False if there is nothing to write"""
+    nodes = iter(nodes)
+    first = next(nodes, None)
+    if first is None:
+        return False
+    nodes = itertools.chain([first], nodes)
+
+    if trace_format == 'perfetto':
+        with open(fname, 'wb') as f:
+            writer = PerfettoTraceWriter(f)
+            for node in nodes:
+                writer.write_slice(
+                    node.thread_name,
+                    node.start,
+                    node.end,
+                    node.tag,
+                    'critical' if node.is_critical else 'other',
+                    {'name': node.name},
+                )
+            writer.close()
+    else:
+        with open(fname, 'w') as f:
+            writer = JsonTraceWriter(f)
+            for event in convert_to_chromium_trace(nodes):
+                writer.write(event)
+            writer.close()
+    return True
+
+
 def main(opts):
     import app_ctx
 
@@ -51,18 +88,24 @@ def main(opts):
     if not (evlog_file or distbuild_json_file):
         display.emit_message('[[bad]]One of --evlog or --distbuild-json-from-yt is required.')
         sys.exit(1)
-    items = None
-    file_name = ''
 
     if distbuild_json_file is not None:
-        items = list(common.set_zero_start(common.load_from_file(distbuild_json_file, 'distbuild')))
+        items = filter_by_time(
+            common.set_zero_start(common.load_from_file(distbuild_json_file, 'distbuild')),
+            opts.timeline_from,
+            opts.timeline_to,
+        )
         file_name = os.path.basename(distbuild_json_file)
-    if items is None:
-        items = list(common.set_zero_start(common.load_from_file(evlog_file, 'evlog', opts.detailed)))
+    else:
+        index = common.EvlogIndex.get(evlog_file) if opts.evlog_index else None
+        items = common.stream_from_evlog(evlog_file, opts.detailed, opts.timeline_from, opts.timeline_to, index)
         file_name = os.path.basename(evlog_file)
 
-    if items:
-        fname = file_name + '.json'
-        with open(fname, 'w') as f:
-            json.dump(list(convert_to_chromium_trace(items)), f)
-        display.emit_message(f'[[imp]]Open about://tracing in Chromium and load {fname} file.')
+    if opts.trace_format == 'perfetto':
+        fname = file_name + PerfettoTraceWriter.extension
+        if write_trace(items, fname, opts.trace_format):
+            display.emit_message(f'[[imp]]Open https://ui.perfetto.dev and load {fname} file.')
+    else:
+        fname = file_name + JsonTraceWriter.extension
+        if write_trace(items, fname, opts.trace_format):
+            display.emit_message(f'[[imp]]Open about://tracing in Chromium and load {fname} file.')
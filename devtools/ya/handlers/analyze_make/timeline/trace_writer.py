@@ -0,0 +1,145 @@
+import exts.yjson as json
+
+
+class JsonTraceWriter(object):
+    """Writes Chromium trace events as a JSON array one by one"""
+
+    extension = '.json'
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._first = True
+        self._stream.write('[')
+
+    def write(self, event):
+        if not self._first:
+            self._stream.write(',\n')
+        self._first = False
+        self._stream.write(json.dumps(event))
+
+    def close(self):
+        self._stream.write(']\n')
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _int_field(number, value):
+    return _varint(number << 3) + _varint(value)
+
+
+def _bytes_field(number, data):
+    if not isinstance(data, bytes):
+        data = str(data).encode('utf-8')
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+class PerfettoTraceWriter(object):
+    """
+    Writes Perfetto protobuf trace (perfetto.protos.Trace) of slices on thread tracks packet by packet.
+    Only the few used fields are encoded by hand, so no protobuf runtime is needed.
+    """
+
+    extension = '.perfetto-trace'
+
+    PID = 1
+    PROCESS_UUID = 1
+    SEQUENCE_ID = 1
+
+    # TracePacket
+    PACKET = 1
+    TIMESTAMP = 8
+    TRUSTED_PACKET_SEQUENCE_ID = 10
+    TRACK_EVENT = 11
+    TRACK_DESCRIPTOR = 60
+    # TrackDescriptor
+    UUID = 1
+    NAME = 2
+    PROCESS = 3
+    THREAD = 4
+    PARENT_UUID = 5
+    # ProcessDescriptor / ThreadDescriptor
+    DESCRIPTOR_PID = 1
+    DESCRIPTOR_TID = 2
+    PROCESS_NAME = 6
+    THREAD_NAME = 5
+    # TrackEvent
+    DEBUG_ANNOTATIONS = 4
+    TYPE = 9
+    TRACK_UUID = 11
+    CATEGORIES = 22
+    EVENT_NAME = 23
+    SLICE_BEGIN = 1
+    SLICE_END = 2
+    # DebugAnnotation
+    ANNOTATION_STRING_VALUE = 6
+    ANNOTATION_NAME = 10
+
+    def __init__(self, stream, process_name='ya make'):
+        self._stream = stream
+        self._threads = {}
+        process = _int_field(self.DESCRIPTOR_PID, self.PID) + _bytes_field(self.PROCESS_NAME, process_name)
+        self._write_packet(
+            _bytes_field(
+                self.TRACK_DESCRIPTOR,
+                _int_field(self.UUID, self.PROCESS_UUID) + _bytes_field(self.PROCESS, process),
+            )
+        )
+
+    def _write_packet(self, packet):
+        self._stream.write(_bytes_field(self.PACKET, packet))
+
+    def _track(self, thread_name):
+        uuid = self._threads.get(thread_name)
+        if uuid is None:
+            uuid = self._threads[thread_name] = self.PROCESS_UUID + 1 + len(self._threads)
+            thread = (
+                _int_field(self.DESCRIPTOR_PID, self.PID)
+                + _int_field(self.DESCRIPTOR_TID, uuid)
+                + _bytes_field(self.THREAD_NAME, thread_name)
+            )
+            descriptor = (
+                _int_field(self.UUID, uuid)
+                + _int_field(self.PARENT_UUID, self.PROCESS_UUID)
+                + _bytes_field(self.THREAD, thread)
+            )
+            self._write_packet(_bytes_field(self.TRACK_DESCRIPTOR, descriptor))
+        return uuid
+
+    def _write_event(self, ts, event):
+        self._write_packet(
+            _int_field(self.TIMESTAMP, max(0, int(ts * 1e9)))
+            + _int_field(self.TRUSTED_PACKET_SEQUENCE_ID, self.SEQUENCE_ID)
+            + _bytes_field(self.TRACK_EVENT, event)
+        )
+
+    def write_slice(self, thread_name, start, end, name, category, args):
+        track = _int_field(self.TRACK_UUID, self._track(thread_name))
+        annotations = b''.join(
+            _bytes_field(
+                self.DEBUG_ANNOTATIONS,
+                _bytes_field(self.ANNOTATION_NAME, k) + _bytes_field(self.ANNOTATION_STRING_VALUE, v),
+            )
+            for k, v in sorted(args.items())
+        )
+        self._write_event(
+            start,
+            _int_field(self.TYPE, self.SLICE_BEGIN)
+            + track
+            + _bytes_field(self.CATEGORIES, category)
+            + _bytes_field(self.EVENT_NAME, name)
+            + annotations,
+        )
+        self._write_event(end, _int_field(self.TYPE, self.SLICE_END) + track)
+
+    def close(self):
+        pass
@@ -16,6 +16,7 @@ from core.common_opts import CustomBuildRootOptions
 from build.build_opts import LocalCacheOptions, DistCacheSetupOptions, parse_size_arg, parse_timespan_arg
 from exts.windows import on_win
 from yalibrary.runner import result_store
+from yalibrary.store.incremental_gc import IncrementalGC
 import yalibrary.toolscache as tc
 
 if six.PY3:
@@ -233,7 +234,9 @@ def do_cache(opts):
                 cache.analyze(app_ctx.display)
             errors = 0
         else:
-            errors = _do_collect_cache(cache, build_root, opts)
+            errors = _do_collect_cache(
+                cache, build_root, opts, incremental=opts.incremental_gc and IncrementalGC.supported(cache)
+            )
 
         if cache:
             cache.flush()
@@ -250,7 +253,7 @@ def do_cache(opts):
         )
 
 
-def _do_collect_cache(cache, build_root, opts):
+def _do_collect_cache(cache, build_root, opts, incremental=False):
     logger.debug('Cleaning tmp root')
     fs.remove_tree_safe(cc.tmp_path())
 
@@ -294,7 +297,9 @@ def _do_collect_cache(cache, build_root, opts):
 
     if opts.cache_size is not None and opts.object_size_limit is None and opts.age_limit is None:
         logger.debug('Cleaning for total size %s', opts.cache_size)
-        if hasattr(cache, 'strip'):
+        if incremental:
+            _do_collect_cache_incrementally(cache, opts)
+        elif hasattr(cache, 'strip'):
             cache.strip(FilterBySize(opts.cache_size))
         elif hasattr(cache, 'strip_total_size'):
             cache.strip_total_size(opts.cache_size)
@@ -320,6 +325,13 @@ def _do_collect_cache(cache, build_root, opts):
     return errors
 
 
+def _do_collect_cache_incrementally(cache, opts):
+    logger.debug('Incremental cleaning for total size %s', opts.cache_size)
+    gc = IncrementalGC(cache, opts.cache_size, low_watermark=1.0, slice_pause=0)
+    gc.run()
+    logger.debug("ya gc incremental stats %s", gc.stats())
+
+
 def do_strip_yt_cache(opts):
     try:
         from yalibrary.store.yt_store import yt_store
@@ -4,10 +4,24 @@ import os
 import random
 import stat
 import errno
+import logging
 import shutil
+import sys
 
 import exts.fs
 
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# ioctl to share extents of a file (linux/fs.h), supported by btrfs, xfs and others
+FICLONE = 0x40049409
+# Errors of copy_file_range which mean it's not supported for the files
+_COPY_FILE_RANGE_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+
 
 def _temp_path(path):
     return path + '.tmp.' + str(random.random())
@@ -23,10 +37,93 @@ def cleanup(path, force=False):
     exts.fs.ensure_removed(path)
 
 
+def _reflink(src_fd, dst_fd):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(src_fd, dst_fd, size - copied)
+            if not n:
+                break
+            copied += n
+    except OSError as e:
+        if copied or e.errno not in _COPY_FILE_RANGE_UNSUPPORTED:
+            raise
+        return False
+    # A short copy is redone from scratch by shutil.copyfile
+    return copied == size
+
+
+def _same_file(source, destination):
+    if not hasattr(os.path, 'samefile'):  # python 2 on windows
+        return os.path.normcase(os.path.abspath(source)) == os.path.normcase(os.path.abspath(destination))
+    try:
+        return os.path.samefile(source, destination)
+    except OSError:
+        return False
+
+
+def copy_file_data(source, destination):
+    """
+    Copies file content as shutil.copyfile does, but avoids copying data where the file system allows:
+    the copy shares data blocks with the source (clonefile on macOS, FICLONE on linux)
+    or is made in kernel by copy_file_range (which may also share blocks or copy them on the server side).
+    """
+    if _same_file(source, destination):
+        # Opening the destination for writing would truncate the source
+        raise getattr(shutil, 'SameFileError', shutil.Error)(
+            "{!r} and {!r} are the same file".format(source, destination)
+        )
+
+    if exts.fs.supports_clone():
+        exts.fs.ensure_removed(destination)
+        try:
+            if exts.fs.macos_clone_file(source, destination):
+                return
+        except Exception as e:
+            logger.debug('Unable to clone %s to %s: %s', source, destination, e)
+
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        if _reflink(src_fd, dst_fd) or _copy_file_range(src_fd, dst_fd, os.fstat(src_fd).st_size):
+            return
+
+    shutil.copyfile(source, destination)
+
+
+def copy_file(source, destination):
+    """shutil.copy() on top of copy_file_data()"""
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    copy_file_data(source, destination)
+    shutil.copymode(source, destination)
+    return destination
+
+
+def copy_file2(source, destination):
+    """shutil.copy2() on top of copy_file_data()"""
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    copy_file_data(source, destination)
+    shutil.copystat(source, destination)
+    return destination
+
+
 def copy_tree(source, destination):
     def copy_function_with_follback_on_dirs(src, dst):
         try:
-            return shutil.copy2(src, dst)
+            return copy_file2(src, dst)
         except IOError as e:
             if e.errno == errno.EISDIR:
                 return exts.fs.copytree3(src, dst)
@@ -3,6 +3,7 @@ import copy
 import functools
 import itertools
 import logging
+import multiprocessing
 import os
 import random
 import re
@@ -11,6 +12,7 @@ import sys
 import time
 import traceback
 from jsonschema import Draft4Validator, ValidationError
+from multiprocessing.pool import ThreadPool
 
 import library.python.resource as rs
 
@@ -18,7 +20,6 @@ import exts.archive
 import exts.fs
 import exts.func
 import exts.hashing
-import exts.os2
 import exts.path2
 import exts.timer
 import exts.tmp
@@ -443,22 +444,27 @@ def get_tool_path(name, tool_platform=None):
     return tool_path
 
 
-def strip_binary(executable_name, debug_file_name=None, tool_platform=None, full_strip=False):
+def strip_binary(
+    executable_name, debug_file_name=None, tool_platform=None, full_strip=False, objcopy_tool=None, strip_tool=None
+):
+    objcopy_tool = objcopy_tool or get_tool_path('objcopy', tool_platform)
+    strip_tool = strip_tool or get_tool_path('strip', tool_platform)
+
     # Separate debug symbols
     if debug_file_name:
         args = ['--only-keep-debug', executable_name, debug_file_name]
 
-    package.process.run_process(get_tool_path('objcopy', tool_platform), args)
+        package.process.run_process(objcopy_tool, args)
 
     # Strip the executable
     strip_args = [executable_name] if full_strip else ['-g', executable_name]
-    package.process.run_process(get_tool_path('strip', tool_platform), strip_args)
+    package.process.run_process(strip_tool, strip_args)
 
     # Add link to the debug symbols
     if debug_file_name:
         args = ['--remove-section=.gnu_debuglink', '--add-gnu-debuglink', debug_file_name, executable_name]
 
-        package.process.run_process(get_tool_path('objcopy', tool_platform), args)
+        package.process.run_process(objcopy_tool, args)
 
 
 def get_platform_from_build_info(tool_platform):
@@ -485,8 +491,13 @@ def guess_tool_platform(filename, tool_platforms):
         return get_platform_from_build_info(tool_platforms[0])
 
 
-@timeit
-def strip_binaries(result_dir, debug_dir, source_elements, full_strip=False):
+StripJob = collections.namedtuple('StripJob', ['executable', 'debug_file', 'tool_platform'])
+
+
+def plan_strip_jobs(result_dir, debug_dir, source_elements):
+    jobs = []
+    # The same binary may be reached through symlinks or several elements, it's stripped once
+    planned = set()
     for element in source_elements:
         if element.data['source']['type'] != 'BUILD_OUTPUT':
             logger.debug('Strip binaries only from BUILD_OUTPUT section. Skip %s', element.data)
@@ -504,36 +515,74 @@ def strip_binaries(result_dir, debug_dir, source_elements, full_strip=False):
         tool_platform = guess_tool_platform(element.data['source']['path'], tool_platforms)
         for destination_path in element.destination_paths:
             if os.path.isdir(destination_path):
-                for root, _, files in os.walk(destination_path):
-                    for f in files:
-                        try_strip_file(
-                            result_dir,
-                            debug_dir,
-                            os.path.join(root, f),
-                            tool_platform=tool_platform,
-                            full_strip=full_strip,
-                        )
+                paths = [os.path.join(root, f) for root, _, files in os.walk(destination_path) for f in files]
             else:
-                try_strip_file(
-                    result_dir, debug_dir, destination_path, tool_platform=tool_platform, full_strip=full_strip
-                )
+                paths = [destination_path]
+
+            for path in paths:
+                job = _plan_strip_file(result_dir, debug_dir, path, tool_platform)
+                if job and os.path.realpath(job.executable) not in planned:
+                    planned.add(os.path.realpath(job.executable))
+                    jobs.append(job)
+    return jobs
 
 
-def try_strip_file(result_dir, debug_dir, destination_path, tool_platform=None, full_strip=False):
+def _plan_strip_file(result_dir, debug_dir, destination_path, tool_platform):
     if os.path.isfile(destination_path) and os.access(destination_path, os.X_OK) and is_application(destination_path):
         executable_name = os.path.basename(destination_path)
         executable_relative_dir = os.path.dirname(os.path.relpath(destination_path, result_dir))
+        debug_file_name = os.path.join(debug_dir, executable_relative_dir, executable_name + ".debug")
+        return StripJob(os.path.abspath(destination_path), os.path.abspath(debug_file_name), tool_platform)
+    return None
 
-        with exts.os2.change_dir(os.path.dirname(destination_path)):
-            debug_file_name = os.path.join(debug_dir, executable_relative_dir, executable_name + ".debug")
 
-            exts.fs.create_dirs(os.path.dirname(debug_file_name))
-            try:
-                strip_binary(
-                    executable_name, debug_file_name=debug_file_name, tool_platform=tool_platform, full_strip=full_strip
-                )
-            except package.packager.YaPackageException as e:
-                package.display.emit_message('[[bad]]Strip failed: {}[[rst]]'.format(e))
+def _run_strip_job(job, tools, full_strip):
+    objcopy_tool, strip_tool = tools[job.tool_platform]
+    start = time.time()
+    error = None
+    try:
+        exts.fs.create_dirs(os.path.dirname(job.debug_file))
+        strip_binary(
+            job.executable,
+            debug_file_name=job.debug_file,
+            full_strip=full_strip,
+            objcopy_tool=objcopy_tool,
+            strip_tool=strip_tool,
+        )
+    except package.packager.YaPackageException as e:
+        error = e
+    return time.time() - start, error
+
+
+@timeit
+def strip_binaries(result_dir, debug_dir, source_elements, full_strip=False, threads=None):
+    jobs = plan_strip_jobs(result_dir, debug_dir, source_elements)
+    if not jobs:
+        return
+
+    # Resolving a tool may fetch its toolchain, so it's done once per platform before stripping in parallel
+    tools = {}
+    for job in jobs:
+        if job.tool_platform not in tools:
+            tools[job.tool_platform] = (
+                get_tool_path('objcopy', job.tool_platform),
+                get_tool_path('strip', job.tool_platform),
+            )
+
+    # objcopy and strip run in child processes, so a thread per running tool is enough
+    pool = ThreadPool(min(threads or multiprocessing.cpu_count(), len(jobs)))
+    try:
+        results = pool.map(lambda job: _run_strip_job(job, tools, full_strip), jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    durations = {}
+    for job, (duration, error) in zip(jobs, results):
+        durations['strip_binaries_' + os.path.relpath(job.executable, result_dir)] = duration
+        if error:
+            package.display.emit_message('[[bad]]Strip failed: {}[[rst]]'.format(error))
+    core.profiler.profile_values(durations)
 
 
 def is_old_format(package_data):
@@ -640,7 +689,13 @@ def create_package(package_context, output_root, builds):
 
             if params.strip or params.full_strip:
                 debug_dir = exts.fs.create_dirs(os.path.join(temp_work_dir, '.debug'))
-                strip_binaries(temp_work_dir, debug_dir, source_elements, full_strip=params.full_strip)
+                strip_binaries(
+                    temp_work_dir,
+                    debug_dir,
+                    source_elements,
+                    full_strip=params.full_strip,
+                    threads=params.build_threads,
+                )
                 if params.create_dbg:
                     debug_dir = os.path.join(debug_dir, '.content')
                     if os.path.exists(debug_dir):
@@ -2,7 +2,6 @@ import os
 import stat
 import codecs
 import random
-import shutil
 import fnmatch
 import logging
 import path as pathlib
@@ -10,6 +9,7 @@ import path as pathlib
 import exts.archive
 import exts.path2
 import exts.fs
+import exts.hashing
 import exts.tmp
 
 from pathlib2 import PurePath
@@ -204,7 +204,12 @@ class Source(object):
     def _prepare(self):
         raise NotImplementedError
 
-    def create_directory_if_necessary(self, path):
+    def create_directory_if_necessary(self, path, known_dirs=None):
+        # known_dirs: directories which are already created or checked by the caller
+        if known_dirs is not None:
+            if path in known_dirs:
+                return
+            known_dirs.add(path)
         if not os.path.exists(path):
             exts.fs.create_dirs(path)
             package.display.emit_message(
@@ -227,7 +232,8 @@ class Source(object):
         if self.keep_symlinks() and os.path.islink(source):
             self._copy_link(source, destination)
         else:
-            shutil.copy(source, destination)
+            copied = package.fs_util.copy_file(source, destination)
+            self._files_comparator.add_copy(source, copied)
 
     def copy_directory(self, source, destination):
         package.display.emit_message(
@@ -271,6 +277,7 @@ class Source(object):
                 # )
 
             used_patterns = set()
+            known_dirs = set()
             for path, pattern in filter_files(source, self.data['source']['files']):
                 used_patterns.add(pattern)
                 source_path = os.path.join(source, path)
@@ -304,13 +311,13 @@ class Source(object):
                             )
                         )
 
-                self.create_directory_if_necessary(os.path.dirname(destination_path))
+                self.create_directory_if_necessary(os.path.dirname(destination_path), known_dirs)
 
                 if os.path.isdir(source_path):
                     if os.path.islink(source_path) and self.keep_symlinks():
                         self._copy_link(source_path, destination_path)
                     else:
-                        self.create_directory_if_necessary(destination_path)
+                        self.create_directory_if_necessary(destination_path, known_dirs)
                     self._destination_paths.append(destination_path)
                 else:
                     self.copy_file(source_path, destination_path)
@@ -546,13 +553,42 @@ class InlineFileSource(Source):
             self.copy(source, destination)
 
 
+def _stat_key(filename):
+    st = os.stat(filename)
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime
+
+
 class FilesComparator(object):
+    """
+    Checks files for equality by cheap metadata first: files of different size differ, the same file
+    (or an unmodified copy of an unmodified file made by the package) is equal to itself.
+    Contents are compared by md5 only if metadata is not enough, checksums are cached while files are not modified.
+    """
+
     def __init__(self):
         self._cache = {}
+        self._copies = {}
+
+    def add_copy(self, source, destination):
+        self._copies[os.path.realpath(destination)] = (_stat_key(destination), _stat_key(source))
+
+    def _identity(self, filename):
+        key = _stat_key(filename)
+        copy = self._copies.get(os.path.realpath(filename))
+        if copy and copy[0] == key:
+            return copy[1]
+        return key
 
     def is_equal(self, file1, file2):
+        if os.path.getsize(file1) != os.path.getsize(file2):
+            return False
+        if self._identity(file1) == self._identity(file2):
+            return True
         return self.get_checksum(file1) == self.get_checksum(file2)
 
     def get_checksum(self, filename):
         filename = os.path.realpath(filename)
-        return self._cache.setdefault(filename, exts.hashing.md5_path(filename))
+        key = (filename, _stat_key(filename))
+        if key not in self._cache:
+            self._cache[key] = exts.hashing.md5_path(filename)
+        return self._cache[key]
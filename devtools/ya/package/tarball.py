@@ -1,12 +1,78 @@
+import io
 import os
-import shutil
+import threading
 
+import library.python.archive
 import library.python.compress
 
 import multiprocessing
 import exts.tmp
 import exts.archive
 
+# How long the compressor waits for the tar writer to append data
+_POLL_INTERVAL = 0.05
+
+
+class _GrowingFileReader(object):
+    """Reads a file which is being written by another thread, EOF is reported when the writer is done"""
+
+    def __init__(self, path, done):
+        self._file = io.open(path, 'rb')
+        self._done = done
+
+    def read(self, size):
+        chunks = []
+        left = size
+        while left:
+            # Check before reading: all data written before the writer is done is read then
+            finished = self._done.is_set()
+            data = self._file.read(left)
+            if data:
+                chunks.append(data)
+                left -= len(data)
+            elif finished:
+                break
+            else:
+                self._done.wait(_POLL_INTERVAL)
+        return b''.join(chunks)
+
+    def close(self):
+        self._file.close()
+
+
+def _create_compressed_tar(package_dir, result_path, codec, threads, work_dir):
+    """
+    Tar is written by a separate thread while blocks of it are compressed in parallel with the codec as soon as
+    they are written, so compression doesn't wait for the whole tar and doesn't reread it from disk.
+    """
+    tar_path = os.path.join(work_dir, 'package.tar')
+    temp_result_path = os.path.join(work_dir, os.path.basename(result_path))
+    done = threading.Event()
+    errors = []
+
+    def write_tar(stream):
+        try:
+            library.python.archive.tar([(package_dir, '.')], stream, fixed_mtime=None)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            stream.close()
+            done.set()
+
+    tar_stream = io.open(tar_path, 'wb')
+    reader = _GrowingFileReader(tar_path, done)
+    writer = threading.Thread(target=write_tar, args=(tar_stream,), name='TarWriter')
+    writer.start()
+    try:
+        library.python.compress.compress(reader, temp_result_path, codec, threads=threads)
+    finally:
+        writer.join()
+        reader.close()
+    if errors:
+        raise errors[0]
+
+    os.rename(temp_result_path, result_path)
+
 
 def create_tarball_package(
     result_dir,
@@ -29,10 +95,17 @@ def create_tarball_package(
 
     if codec:
         threads = threads or multiprocessing.cpu_count()
+        archive_file += ".uc." + codec
+
+    result_path = os.path.join(result_dir, archive_file)
+
+    # Temp files are kept next to the result, so it's renamed into place instead of copying
+    with exts.tmp.temp_dir(dir=result_dir) as temp_dir:
+        if codec:
+            _create_compressed_tar(package_dir, result_path, codec, threads, temp_dir)
+            return result_path
 
-    with exts.tmp.temp_dir() as temp_dir:
-        tar_archive = os.path.join(temp_dir, archive_file)
-        if compress and not codec:
+        if compress:
             compression_filter = compression_filter or exts.archive.GZIP
             if compression_level is None:
                 compression_level = exts.archive.get_compression_level(
@@ -40,17 +113,15 @@ def create_tarball_package(
                 )
         else:
             compression_filter, compression_level = None, None
-        exts.archive.create_tar(package_dir, tar_archive, compression_filter, compression_level, fixed_mtime=None)
-
-        if codec:
-            uc_archive_path = archive_file + ".uc." + codec
-            library.python.compress.compress(tar_archive, uc_archive_path, codec, threads=threads)
-            archive_file = uc_archive_path
-        else:
-            archive_file = tar_archive
-
-        result_path = os.path.join(result_dir, os.path.basename(archive_file))
-        shutil.move(archive_file, result_path)
+        exts.archive.create_tar(
+            package_dir,
+            result_path,
+            compression_filter,
+            compression_level,
+            fixed_mtime=None,
+            work_dir=temp_dir,
+            threads=threads,
+        )
         return result_path
 
 
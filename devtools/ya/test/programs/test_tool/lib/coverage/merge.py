@@ -1,4 +1,6 @@
 import array
+import functools
+import itertools
 import logging
 import os
 import six
@@ -84,141 +86,97 @@ def merge_resolved_sancov(cov_files, test_mode):
     }
 
 
-def merge_granular_coverage_segments(record, segments):
-    if not record:
-        return segments
-    start_line = 0
-    start_shift = 1
-    end_line = 2
-    end_shift = 3
-    is_covered = 4
-
-    # invariant: l_seg start <= r_seg start
-    def compare_segments(l_seg, r_seg):
-        if l_seg is None:
-            return True
-        elif l_seg[start_line] != r_seg[start_line]:
-            return l_seg[start_line] < r_seg[start_line]
-        elif l_seg[start_shift] != r_seg[start_shift]:
-            return l_seg[start_shift] < r_seg[start_shift]
-        elif l_seg[end_line] != r_seg[end_line]:
-            return l_seg[end_line] < r_seg[end_line]
-        elif l_seg[end_shift] != r_seg[end_shift]:
-            return l_seg[end_shift] < r_seg[end_shift]
-        else:
-            return False
-
-    # invariant: l_seg start <= r_seg start
-    def is_equal_starts(l_seg, r_seg):
-        return l_seg[start_line] == r_seg[start_line] and l_seg[start_shift] == r_seg[start_shift]
-
-    # invariant: l_seg start <= r_seg start
-    def is_equal_ends(l_seg, r_seg):
-        return l_seg[end_line] == r_seg[end_line] and l_seg[end_shift] == r_seg[end_shift]
-
-    # invariant: l_seg start <= r_seg start
-    def is_equal_ranges(l_seg, r_seg):
-        return is_equal_starts(l_seg, r_seg) and is_equal_ends(l_seg, r_seg)
-
-    # invariant: l_seg start <= r_seg start
-    def compare_ends(l_seg, r_seg):
-        if l_seg[end_line] != r_seg[end_line]:
-            return l_seg[end_line] < r_seg[end_line]
-        else:
-            return l_seg[end_shift] < r_seg[end_shift]
+def _merge_granular_sorted(left, right):
+    """Merge segment lists ordered by (start, end) positions, right segment goes first if positions are equal"""
+    res = []
+    left_len = len(left)
+    right_len = len(right)
+    left_pos = 0
+    right_pos = 0
+    if left_len and right_len:
+        l_seg = left[0]
+        r_seg = right[0]
+        while True:
+            # Segment fields: start line, start shift, end line, end shift, is covered
+            if l_seg[0] != r_seg[0]:
+                left_first = l_seg[0] < r_seg[0]
+            elif l_seg[1] != r_seg[1]:
+                left_first = l_seg[1] < r_seg[1]
+            elif l_seg[2] != r_seg[2]:
+                left_first = l_seg[2] < r_seg[2]
+            else:
+                left_first = l_seg[3] < r_seg[3]
 
-    # invariant: l_seg start <= r_seg start
-    def can_be_merged(l_seg, r_seg):
-        """compare left end with right start. if (left end >= right start) => segments can be merged"""
-        if l_seg[end_line] + 1 >= r_seg[start_line]:
-            return True
-        else:
-            return False
-
-    def segments_iterator(left_seg, right_seg):
-        left_len = len(left_seg)
-        right_len = len(right_seg)
-        left_pos = 0
-        right_pos = 0
-        while left_pos < left_len or right_pos < right_len:
-            if left_pos == left_len:
-                yield right_seg[right_pos]
-                right_pos += 1
-                continue
-            elif right_pos == right_len:
-                yield left_seg[left_pos]
-                left_pos += 1
-                continue
-            if compare_segments(left_seg[left_pos], right_seg[right_pos]):
-                yield left_seg[left_pos]
+            if left_first:
+                res.append(l_seg)
                 left_pos += 1
+                if left_pos == left_len:
+                    break
+                l_seg = left[left_pos]
             else:
-                yield right_seg[right_pos]
+                res.append(r_seg)
                 right_pos += 1
+                if right_pos == right_len:
+                    break
+                r_seg = right[right_pos]
+    res.extend(left[left_pos:])
+    res.extend(right[right_pos:])
+    return res
 
-    def check_inter(left, right):
-        if left[end_line] != right[start_line]:
-            return left[end_line] > right[start_line]
+
+def _compact_granular(segments):
+    """Join adjacent (by lines) segments with the same covered state"""
+    if len(segments) < 2:
+        return segments
+    result = []
+    prev = segments[0]
+    for seg in itertools.islice(segments, 1, None):
+        if prev[2] + 1 >= seg[0] and prev[4] == seg[4]:
+            prev[2] = seg[2]
+            prev[3] = seg[3]
         else:
-            return left[end_shift] >= right[start_shift]
+            result.append(prev)
+            prev = seg
+    result.append(prev)
+    return result
 
-    def merge():
-        uni_res = []
-        sorted_segments = segments_iterator(record, segments)
-        cur_seg = None
-        for seg in sorted_segments:
-            seg = list(seg)
-            if cur_seg is None:
-                cur_seg = seg
-            elif check_inter(cur_seg, seg):
-                if not is_equal_starts(cur_seg, seg):
-                    # |-----------|
-                    #     |-------|
-                    uni_res.append(
-                        [cur_seg[start_line], cur_seg[start_shift], seg[start_line], seg[start_shift], cur_seg[4]]
-                    )
-                    cur_seg[start_line] = seg[start_line]
-                    cur_seg[start_shift] = seg[start_shift]
-                if compare_ends(cur_seg, seg):
-                    cur_seg, seg = seg, cur_seg
-                uni_res.append(
-                    [
-                        seg[start_line],
-                        seg[start_shift],
-                        seg[end_line],
-                        seg[end_shift],
-                        seg[is_covered] | cur_seg[is_covered],
-                    ]
-                )
-                if not is_equal_ranges(cur_seg, seg):
-                    cur_seg[start_line] = seg[end_line]
-                    cur_seg[start_shift] = seg[end_shift]
-                else:
-                    cur_seg = None
-            else:
-                uni_res.append(cur_seg)
-                cur_seg = seg
-        if cur_seg is not None:
-            uni_res.append(cur_seg)
-        return uni_res
-
-    def compact_flatten_segments(merged_segments):
-        if len(merged_segments) < 2:
-            return merged_segments
-        result = []
-        prev_seg = merged_segments[0]
-        for seg in merged_segments[1:]:
-            if can_be_merged(prev_seg, seg) and prev_seg[is_covered] == seg[is_covered]:
-                prev_seg[end_line] = seg[end_line]
-                prev_seg[end_shift] = seg[end_shift]
-            else:
-                result.append(prev_seg)
-                prev_seg = seg
-        if prev_seg:
-            result.append(prev_seg)
-        return result
 
-    return compact_flatten_segments(merge())
+def merge_granular_coverage_segments(record, segments):
+    if not record:
+        return segments
+
+    # Sweep over segments sorted by start splitting intersections.
+    # Only the current segment is modified, so segments are copied when they become current
+    uni_res = []
+    cur = None
+    for seg in _merge_granular_sorted(record, segments):
+        if cur is None:
+            cur = list(seg)
+            continue
+        cur_end_line = cur[2]
+        seg_start_line = seg[0]
+        if cur_end_line > seg_start_line or (cur_end_line == seg_start_line and cur[3] >= seg[1]):
+            seg_start_shift = seg[1]
+            if cur[0] != seg_start_line or cur[1] != seg_start_shift:
+                # |-----------|
+                #     |-------|
+                uni_res.append([cur[0], cur[1], seg_start_line, seg_start_shift, cur[4]])
+                cur[0] = seg_start_line
+                cur[1] = seg_start_shift
+            if cur_end_line < seg[2] or (cur_end_line == seg[2] and cur[3] < seg[3]):
+                cur, seg = list(seg), cur
+            uni_res.append([seg[0], seg[1], seg[2], seg[3], seg[4] | cur[4]])
+            if cur[2] != seg[2] or cur[3] != seg[3]:
+                cur[0] = seg[2]
+                cur[1] = seg[3]
+            else:
+                cur = None
+        else:
+            uni_res.append(cur)
+            cur = list(seg)
+    if cur is not None:
+        uni_res.append(cur)
+    return _compact_granular(uni_res)
 
 
 def merge_functions_inplace(result, record):
@@ -235,6 +193,23 @@ def merge_functions_inplace(result, record):
                 target[funcname] += count
 
 
+def _tip_segments(seq):
+    """
+    Unified segments without empty ones (aka java-missed-branch-in-line-indicator),
+    knowledge about them is put into the missing branch flag (segment line pos) of the following segment.
+    """
+    missed_branch = False
+    for useg in seq:
+        if useg[0] == useg[2]:
+            missed_branch = True
+            continue
+        segment = list(useg)
+        assert not segment[1], segment
+        segment[1] = missed_branch
+        yield segment
+        missed_branch = False
+
+
 def merge_segments(record1, record2):
     if not record1:
         return record2
@@ -246,38 +221,9 @@ def merge_segments(record1, record2):
     # line coverage doesn't use segment line pos - use it to store missing brach flag
     missing_branch = 1
 
-    def next_segment(seq):
-        def tip_iter():
-            try:
-                it = iter(seq)
-                while True:
-                    missed_branch = False
-                    useg = next(it)
-                    # Skip all empty segments (aka java-missed-branch-in-line-indicator) and put this knowledge into the flag
-                    while useg[start_pos] == useg[end_pos]:
-                        missed_branch = True
-                        useg = next(it)
-
-                    segment = list(useg)
-                    assert not segment[missing_branch], segment
-                    segment[missing_branch] = missed_branch
-                    yield segment
-            except StopIteration:
-                return
-
-        it = tip_iter()
-
-        def next_item():
-            try:
-                return next(it)
-            except StopIteration:
-                return None
-
-        return next_item
-
     def merge():
-        next_left = next_segment(record1)
-        next_right = next_segment(record2)
+        next_left = functools.partial(next, _tip_segments(record1), None)
+        next_right = functools.partial(next, _tip_segments(record2), None)
         left = next_left()
         right = next_right()
 
@@ -296,8 +242,7 @@ def merge_segments(record1, record2):
                     head[counter] += right[counter]
                     yield head
                     # skip uncovered segment - it's not a part of head (which is covered)
-                    if end_diff:
-                        next_right()
+                    next_right()
                     right = next_right()
                     left = next_left()
                     continue
@@ -339,41 +284,35 @@ def merge_segments(record1, record2):
             yield right
             right = next_right()
 
-    def unify(s):
-        s[missing_branch] = 0
-        return s
-
-    def flatten():
-        curr = None
-        for segment in merge():
-            # process missed-branch-in-line-indicator (mbili)
-            if segment[missing_branch]:
-                if curr:
-                    # previous segment
-                    yield curr
-                # gen mbili
-                yield [segment[start_pos], 0, segment[start_pos], 0, 0]
-                yield unify(segment)
-                curr = None
-                continue
-
-            # Direct flatten (no mbili here)
-            if not curr:
-                curr = unify(segment)
-            elif (
-                curr[end_pos] >= segment[start_pos]
-                and bool(curr[counter]) == bool(segment[counter])
-                and curr[missing_branch] == curr[missing_branch]
-            ):
-                curr[end_pos] = segment[end_pos]
-            else:
-                yield curr
-                curr = unify(segment)
+    result = []
+    curr = None
+    for segment in merge():
+        # process missed-branch-in-line-indicator (mbili)
+        if segment[missing_branch]:
+            if curr:
+                # previous segment
+                result.append(curr)
+            # gen mbili
+            result.append([segment[start_pos], 0, segment[start_pos], 0, 0])
+            segment[missing_branch] = 0
+            result.append(segment)
+            curr = None
+            continue
 
-        if curr:
-            yield curr
+        # Direct flatten (no mbili here)
+        if not curr:
+            segment[missing_branch] = 0
+            curr = segment
+        elif curr[end_pos] >= segment[start_pos] and bool(curr[counter]) == bool(segment[counter]):
+            curr[end_pos] = segment[end_pos]
+        else:
+            result.append(curr)
+            segment[missing_branch] = 0
+            curr = segment
 
-    return list(flatten())
+    if curr:
+        result.append(curr)
+    return result
 
 
 def merge_clang_segments(segments):
@@ -394,43 +333,42 @@ def merge_clang_segments(segments):
     # Too big counter cannot be serialized to json by ujson module
     COUNTER_LIMIT = 1 << 62
 
-    def update_by(seg_to_update, seg):
-        seg_to_update[COUNTER_FIELD] = min(seg_to_update[COUNTER_FIELD] + seg[COUNTER_FIELD], COUNTER_LIMIT)
-        seg_to_update[HASCOUNT_FIELD] = seg_to_update[HASCOUNT_FIELD] or seg[HASCOUNT_FIELD]
-        seg_to_update[ISREGIONENTRY_FIELD] = seg_to_update[ISREGIONENTRY_FIELD] or seg[ISREGIONENTRY_FIELD]
-        seg_to_update[ISGAPREGION_FIELD] = seg_to_update[ISGAPREGION_FIELD] and seg[ISGAPREGION_FIELD]
-
     left = sorted(left)
     right = sorted(right)
+    left_len = len(left)
+    right_len = len(right)
 
     result = []  # type: list[list[int|bool]]
     l_idx = 0
     r_idx = 0
-    while l_idx < len(left) or r_idx < len(right):
-        if l_idx >= len(left):
-            result.append(list(right[r_idx]))
-            # update by last left not needed. Last left is always (*, *, 0, false, false, false)
-            r_idx += 1
-        elif r_idx >= len(right):
-            result.append(list(left[l_idx]))
-            # update by last right not needed. Last right is always (*, *, 0, false, false, false)
-            l_idx += 1
-        elif left[l_idx][:COUNTER_FIELD] == right[r_idx][:COUNTER_FIELD]:
-            result.append(list(left[l_idx]))
-            update_by(result[-1], right[r_idx])
+    while l_idx < left_len and r_idx < right_len:
+        l_seg = left[l_idx]
+        r_seg = right[r_idx]
+        # Compare positions (Line, Col)
+        if l_seg[0] == r_seg[0] and l_seg[1] == r_seg[1]:
+            seg_to_update = list(l_seg)
+            seg = r_seg
             l_idx += 1
             r_idx += 1
-        elif left[l_idx][:2] < right[r_idx][:2]:
-            result.append(list(left[l_idx]))
-            if r_idx > 0:
-                update_by(result[-1], right[r_idx - 1])
+        elif l_seg[0] < r_seg[0] or (l_seg[0] == r_seg[0] and l_seg[1] < r_seg[1]):
+            seg_to_update = list(l_seg)
+            seg = right[r_idx - 1] if r_idx > 0 else None
             l_idx += 1
         else:
-            result.append(list(right[r_idx]))
-            if l_idx > 0:
-                update_by(result[-1], left[l_idx - 1])
+            seg_to_update = list(r_seg)
+            seg = left[l_idx - 1] if l_idx > 0 else None
             r_idx += 1
 
+        if seg is not None:
+            seg_to_update[COUNTER_FIELD] = min(seg_to_update[COUNTER_FIELD] + seg[COUNTER_FIELD], COUNTER_LIMIT)
+            seg_to_update[HASCOUNT_FIELD] = seg_to_update[HASCOUNT_FIELD] or seg[HASCOUNT_FIELD]
+            seg_to_update[ISREGIONENTRY_FIELD] = seg_to_update[ISREGIONENTRY_FIELD] or seg[ISREGIONENTRY_FIELD]
+            seg_to_update[ISGAPREGION_FIELD] = seg_to_update[ISGAPREGION_FIELD] and seg[ISGAPREGION_FIELD]
+        result.append(seg_to_update)
+
+    # update by the last segment of other side not needed. It is always (*, *, 0, false, false, false)
+    result.extend(map(list, itertools.islice(left, l_idx, None)))
+    result.extend(map(list, itertools.islice(right, r_idx, None)))
     return result
 
 
@@ -469,3 +407,37 @@ def compact_segments(segments):
         prev_ln = sln
 
     yield (start_ln, 0, eln, 0, start_state)
+
+
+def _gen_benchmark_chunks(rnd, chunks, lines):
+    """Synthetic coverage of a single file from several test chunks: (granular, line, clang) segments per chunk"""
+    for _ in range(chunks):
+        granular = []
+        line = []
+        clang = []
+        for ln in range(0, lines, 4):
+            covered = int(rnd.random() < 0.5)
+            granular.append([ln, rnd.randint(0, 3), ln + rnd.randint(0, 3), rnd.randint(4, 8), covered])
+            if rnd.random() < 0.1:
+                line.append([ln, 0, ln, 0, 0])
+            line.append([ln, 0, ln + 4, 0, covered * rnd.randint(1, 3)])
+            clang.append([ln + 1, rnd.randint(1, 4), covered, True, rnd.random() < 0.3, False])
+        clang.append([lines + 1, 1, 0, False, False, False])
+        yield granular, line, clang
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    chunks = list(_gen_benchmark_chunks(random.Random(0), 200, 20000))
+    for name, merger, pos in (
+        ('merge_granular_coverage_segments', merge_granular_coverage_segments, 0),
+        ('merge_segments', merge_segments, 1),
+        ('merge_clang_segments', lambda x, y: merge_clang_segments([x, y]), 2),
+    ):
+        start = time.time()
+        merged = []
+        for chunk in chunks:
+            merged = merger(merged, chunk[pos])
+        print('{}: {:.3f}s for {} chunks, {} segments'.format(name, time.time() - start, len(chunks), len(merged)))
@@ -3,7 +3,10 @@
 """
 Accumulates output results from splitted tests
 """
+import functools
+import io
 import os
+import re
 import sys
 import six
 import json
@@ -22,6 +25,7 @@ from test.util import shared
 from devtools.ya.test.programs.test_tool.lib import coverage
 import library.python.cores as cores
 from test.test_types import common
+from devtools.ya.test import tracefile
 from test import const
 
 logger = logging.getLogger(__name__)
@@ -307,15 +311,36 @@ def _cut_common_prefix(chunk_ids):
         chunk_ids[chunk] = chunk_ids[chunk][prefix_len:]
 
 
+def _path_rewriter(replacements):
+    """Function to replace all occurrences of replacements keys in a string in a single pass"""
+    if not replacements:
+        return lambda s: s
+    # Longer paths go first, so a path is never cut by its prefix
+    pattern = re.compile('|'.join(re.escape(x) for x in sorted(replacements, key=len, reverse=True)))
+    return functools.partial(pattern.sub, lambda m: replacements[m.group(0)])
+
+
+def _rewrite_files(files, dst, replacements):
+    """Concatenate text files into dst line by line replacing paths"""
+    rewrite = _path_rewriter(replacements)
+    with io.open(dst, 'w', encoding='utf-8') as dstfile:
+        for filename in files:
+            if not os.path.isfile(filename):
+                logger.warning('%s is not a regular file', filename)
+                continue
+            with io.open(filename, encoding='utf-8') as afile:
+                for line in afile:
+                    dstfile.write(rewrite(line))
+
+
 @shared.timeit
 def concatenate_traces(args, files, dst):
     # We need to replace after the concatenation all paths in the trace file that point to
     # modulo** dirs to ones that point to the merged dir
     build_root = os.path.realpath(os.getcwd())
-    shared.concatenate_files(files, dst)
-    trace_content = exts.fs.read_file_unicode(dst, binary=False)
     dst_build_rel_path = os.path.relpath(os.path.realpath(args.accumulator_path), build_root)
-    chunk_ids = {}
+    chunk_ids = collections.OrderedDict()
+    replacements = {}
 
     for o in args.outputs:
         o = os.path.realpath(o)
@@ -325,15 +350,20 @@ def concatenate_traces(args, files, dst):
             assert relative[0] != os.pardir
             chunk_ids[o] = relative
         else:
-            trace_content = trace_content.replace(output_build_rel_path + os.path.sep, dst_build_rel_path + os.path.sep)
+            replacements[output_build_rel_path + os.path.sep] = dst_build_rel_path + os.path.sep
 
     if not args.keep_paths:
-        with open(dst, "w") as dstfile:
-            dstfile.write(trace_content)
+        _rewrite_files(files, dst, replacements)
         return
 
     _cut_common_prefix(chunk_ids)
 
+    # Chunk traces are read once: every line goes both to the chunk's suite and to the merged suite
+    # (which is the same as loading the concatenation of chunk traces)
+    suite = common.PerformedTestSuite(None, None)
+    suite.set_work_dir(os.getcwd())
+    merged_parser = tracefile.IncrementalTraceParser(suite=suite, relaxed=True)
+
     statuses = dict()
     errors = []
 
@@ -341,56 +371,58 @@ def concatenate_traces(args, files, dst):
         trace = os.path.join(chunk, "ytest.report.trace")
         assert os.path.isfile(trace)
 
-        suite = common.PerformedTestSuite(None, None)
-        suite.set_work_dir(os.getcwd())
-        suite.load_run_results(trace)
+        chunk_suite = common.PerformedTestSuite(None, None)
+        chunk_suite.set_work_dir(os.getcwd())
+        chunk_parser = tracefile.IncrementalTraceParser(suite=chunk_suite, relaxed=True)
+        with io.open(trace, errors='ignore', encoding='utf-8') as afile:
+            for line in afile:
+                # Both parsers stop on the first broken line
+                if not (chunk_parser.feed(line) | merged_parser.feed(line)):
+                    break
+        chunk_parser.finish()
 
         chunk_suffix = '_'.join(chunk_ids[chunk])
         chunk_suffix = '_' + chunk_suffix if chunk_suffix else chunk_suffix
-        suite.chunk_suffix = chunk_suffix
-        suite.chunk_name = ' '.join(chunk_ids[chunk])
-        status = suite.get_status()
+        chunk_suite.chunk_suffix = chunk_suffix
+        chunk_suite.chunk_name = ' '.join(chunk_ids[chunk])
+        status = chunk_suite.get_status()
 
         if status not in statuses and status != const.Status.GOOD:
-            statuses[status] = suite
+            statuses[status] = chunk_suite
+
+    merged_parser.finish()
 
     chunk_logs = {}
     invalid_logs = set()
     keylist = sorted(statuses.keys())
     for st in keylist[:MAX_SUITE_CHUNKS]:
-        suite = statuses[st]
-        chunk_suffix = suite.chunk_suffix
-        for log in suite.logs.keys():
+        chunk_suite = statuses[st]
+        chunk_suffix = chunk_suite.chunk_suffix
+        for log in chunk_suite.logs.keys():
             if log == 'log':  # merged by results accumulator
                 continue
             invalid_logs.add(log)
-            chunk_logs[log + chunk_suffix] = suite.logs[log]
+            chunk_logs[log + chunk_suffix] = chunk_suite.logs[log]
 
-    suite = common.PerformedTestSuite(None, None)
-    suite.set_work_dir(os.getcwd())
-    suite.load_run_results(dst)
     for log in invalid_logs:
         del suite.logs[log]
     suite.logs.update(chunk_logs)
     suite._errors.extend(errors)
 
-    os.remove(dst)  # rewrite trace to delete renamed
+    if os.path.exists(dst):
+        os.remove(dst)
     shared.dump_trace_file(suite, dst)
 
 
 @shared.timeit
 def merge_in_trace(trace, files, dst):
     build_root = os.path.realpath(os.getcwd())
-    trace_content = exts.fs.read_file_unicode(trace, binary=False)
     dst_rel_path = os.path.relpath(os.path.realpath(dst), build_root)
+    replacements = {os.path.relpath(os.path.realpath(o), build_root): dst_rel_path for o in files}
 
-    for o in files:
-        o = os.path.realpath(o)
-        file_rel_path = os.path.relpath(o, build_root)
-        trace_content = trace_content.replace(file_rel_path, dst_rel_path)
-
-    with open(trace, "w") as dstfile:
-        dstfile.write(trace_content)
+    tmp_path = trace + '.tmp'
+    _rewrite_files([trace], tmp_path, replacements)
+    exts.fs.replace_file(tmp_path, trace)
 
 
 @shared.timeit
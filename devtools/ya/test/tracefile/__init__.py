@@ -1,3 +1,3 @@
 # flake8 noqa: F401
 
-from .tracefile import TestTraceParser, TestEventParser
+from .tracefile import TestTraceParser, TestEventParser, IncrementalTraceParser
@@ -245,25 +245,11 @@ class TestTraceParser(object):
 
     @staticmethod
     def parse(it, reporter=None, suite=None, relaxed=False):
-        event_parser = TestEventParser(suite, reporter)
-        error = None
-
-        try:
-            for entry in it:
-                TestTraceParser.process_event(event_parser, entry, relaxed)
-        except ParsingError as e:
-            error = e.data
-
-        event_parser.finalize()
-
-        if error:
-            event_parser.suite.chunk.add_error(
-                "[[bad]]Test run information is incomplete. Did you run out of space? Unable to load line b64: '{}'".format(
-                    error
-                )
-            )
-
-        return event_parser.suite
+        parser = IncrementalTraceParser(reporter, suite, relaxed)
+        for entry in it:
+            if not parser.feed(entry):
+                break
+        return parser.finish()
 
     @staticmethod
     def process_event(event_parser, line, relaxed=False):
@@ -292,3 +278,38 @@ class TestTraceParser(object):
             except Exception:
                 logger.error('Failed to process event, b64:"%s"', base64.b64encode(six.ensure_binary(line)))
                 raise
+
+
+class IncrementalTraceParser(object):
+    """
+    Parses trace lines as they are fed, so several suites can be loaded in a single pass over trace files.
+    With relaxed=True the first broken line stops parsing, the rest of lines are ignored.
+    """
+
+    def __init__(self, reporter=None, suite=None, relaxed=False):
+        self._event_parser = TestEventParser(suite, reporter)
+        self._relaxed = relaxed
+        self._error = None
+
+    def feed(self, line):
+        """Returns False if parsing is stopped"""
+        if self._error is not None:
+            return False
+        try:
+            TestTraceParser.process_event(self._event_parser, line, self._relaxed)
+        except ParsingError as e:
+            self._error = e.data
+            return False
+        return True
+
+    def finish(self):
+        self._event_parser.finalize()
+
+        if self._error:
+            self._event_parser.suite.chunk.add_error(
+                "[[bad]]Test run information is incomplete. Did you run out of space? Unable to load line b64: '{}'".format(
+                    self._error
+                )
+            )
+
+        return self._event_parser.suite
@@ -1,5 +1,6 @@
 import json
 import logging
+import os
 
 
 logger = logging.getLogger(__name__)
@@ -70,13 +71,27 @@ def load_from_distbuild(fname):
         )
 
 
-def load_from_evlog(fname, detailed=False):
-    ymake_stage_started = 'NEvent.TStageStarted'
-    ymake_stage_finished = 'NEvent.TStageFinished'
+YMAKE_STAGE_STARTED = 'NEvent.TStageStarted'
+YMAKE_STAGE_FINISHED = 'NEvent.TStageFinished'
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+# Evlog is indexed by blocks of whole lines of at least this size
+INDEX_BLOCK_SIZE = 4 << 20
+
 
-    events_to_check = ['node-finished', 'stage-finished']
+def _timeline_events(detailed):
+    events = ['node-finished', 'stage-finished']
     if detailed:
-        events_to_check.append('node-detailed')
+        events.append('node-detailed')
+    return events
+
+
+def load_from_evlog(fname, detailed=False):
+    ymake_stage_started = YMAKE_STAGE_STARTED
+    ymake_stage_finished = YMAKE_STAGE_FINISHED
+
+    events_to_check = _timeline_events(detailed)
 
     nodes = []
     critical_uids = {}
@@ -140,3 +155,246 @@ def set_zero_start(nodes):
         x.start -= min_time
         x.end -= min_time
         yield x
+
+
+def iter_evlog(fname, start=0, end=None):
+    """Yield (offset, event) for evlog lines within [start, end) byte range, broken lines are skipped"""
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if end is not None and offset >= end:
+                break
+            line_offset = offset
+            offset += len(line)
+            try:
+                v = json.loads(line)
+            except ValueError as e:
+                logger.warning("Skip broken entry at %d offset: %s", line_offset, e)
+                continue
+            yield line_offset, v
+
+
+def _event_span(v):
+    """Time range covered by the event (in seconds) or None"""
+    value = v.get('value')
+    if isinstance(value, dict):
+        tm = value.get('time')
+        if isinstance(tm, (list, tuple)) and len(tm) == 2:
+            return tm[0], tm[1]
+        if 'time' in value and not tm:
+            # Node without timing is not drawn
+            return None
+        if v.get('namespace') == 'ymake' and '_timestamp' in value:
+            ts = value['_timestamp'] / 1e6
+            return ts, ts
+    ts = v.get('timestamp')
+    if ts is None:
+        return None
+    return ts, ts
+
+
+class EvlogIndex(object):
+    """
+    Sidecar index of the evlog: byte ranges of the file (blocks of whole lines)
+    with time span of every event type met in the block, and the critical path uids.
+    Time span of ymake stage started event covers the whole stage.
+    """
+
+    def __init__(self, size, mtime, blocks, critical_uids):
+        self.size = size
+        self.mtime = mtime
+        self.blocks = blocks
+        self.critical_uids = critical_uids
+
+    @staticmethod
+    def path(fname):
+        return fname + INDEX_SUFFIX
+
+    @classmethod
+    def build(cls, fname, block_size=INDEX_BLOCK_SIZE):
+        st = os.stat(fname)
+        blocks = []
+        block = None
+        # Stage started event -> block of the event
+        opened_ymake_stages = {}
+        critical_uids = []
+
+        def extend(spans, event, span):
+            if event in spans:
+                spans[event] = [min(spans[event][0], span[0]), max(spans[event][1], span[1])]
+            else:
+                spans[event] = list(span)
+
+        for offset, v in iter_evlog(fname, 0, st.st_size):
+            if block is None or offset - block['offset'] >= block_size:
+                if block is not None:
+                    block['end'] = offset
+                block = {'offset': offset, 'end': None, 'spans': {}}
+                blocks.append(block)
+
+            event = v.get('event')
+            span = _event_span(v)
+            if span is not None:
+                extend(block['spans'], event, span)
+
+            if event == 'critical_path':
+                critical_uids = [x['uid'] for x in v['value']['nodes']]
+            elif v.get('namespace') == 'ymake':
+                key = (v.get('thread_name'), v['value'].get('StageName'))
+                if event == YMAKE_STAGE_STARTED:
+                    opened_ymake_stages[key] = (block, span[0])
+                elif event == YMAKE_STAGE_FINISHED and key in opened_ymake_stages:
+                    # Both blocks with started and finished events are needed to restore the stage
+                    started_block, start = opened_ymake_stages.pop(key)
+                    extend(started_block['spans'], YMAKE_STAGE_STARTED, (start, span[1]))
+                    extend(block['spans'], YMAKE_STAGE_FINISHED, (start, span[1]))
+
+        if block is not None:
+            block['end'] = st.st_size
+        return cls(st.st_size, st.st_mtime, blocks, critical_uids)
+
+    @classmethod
+    def load(cls, fname):
+        """Load index of fname, None if it is missing or stale"""
+        try:
+            with open(cls.path(fname)) as f:
+                data = json.load(f)
+            st = os.stat(fname)
+        except (IOError, OSError, ValueError) as e:
+            logger.debug("Can't load evlog index for %s: %s", fname, e)
+            return None
+        if data.get('version') != INDEX_VERSION or data['size'] != st.st_size or data['mtime'] != st.st_mtime:
+            logger.debug("Evlog index for %s is stale", fname)
+            return None
+        return cls(data['size'], data['mtime'], data['blocks'], data['critical_uids'])
+
+    def save(self, fname):
+        data = {
+            'version': INDEX_VERSION,
+            'size': self.size,
+            'mtime': self.mtime,
+            'critical_uids': self.critical_uids,
+            'blocks': self.blocks,
+        }
+        tmp_path = '{}.{}.tmp'.format(self.path(fname), os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp_path, self.path(fname))
+        except (IOError, OSError) as e:
+            logger.warning("Can't save evlog index for %s: %s", fname, e)
+
+    @classmethod
+    def get(cls, fname):
+        index = cls.load(fname)
+        if index is None:
+            index = cls.build(fname)
+            index.save(fname)
+        return index
+
+    def start_time(self, events):
+        starts = [b['spans'][e][0] for b in self.blocks for e in events if e in b['spans']]
+        return min(starts) if starts else None
+
+    def ranges(self, events, time_from=None, time_to=None):
+        """Byte ranges of blocks with the events overlapping [time_from, time_to] (absolute time)"""
+        ranges = []
+        for b in self.blocks:
+            for e in events:
+                span = b['spans'].get(e)
+                if span is None:
+                    continue
+                if time_from is not None and span[1] < time_from:
+                    continue
+                if time_to is not None and span[0] > time_to:
+                    continue
+                if ranges and ranges[-1][1] == b['offset']:
+                    ranges[-1] = (ranges[-1][0], b['end'])
+                else:
+                    ranges.append((b['offset'], b['end']))
+                break
+        return ranges
+
+
+def stream_from_evlog(fname, detailed=False, time_from=None, time_to=None, index=None):
+    """
+    Streaming version of set_zero_start(load_from_evlog(...)) limited to nodes overlapping [time_from, time_to]
+    (in seconds from the start of the build). Nodes are yielded in evlog order, memory usage doesn't depend on the
+    evlog size. The evlog is read twice without index (to find the start of the build and the critical path),
+    with EvlogIndex only blocks overlapping the time window are read.
+    """
+    events_to_check = _timeline_events(detailed)
+    timeline_events = events_to_check + [YMAKE_STAGE_STARTED, YMAKE_STAGE_FINISHED]
+
+    if index is not None:
+        zero = index.start_time(timeline_events)
+        critical_uids = set(index.critical_uids)
+    else:
+        zero = None
+        critical_uids = set()
+        for _, v in iter_evlog(fname):
+            event = v['event']
+            if event in events_to_check and v['value']['time']:
+                start = v['value']['time'][0]
+            elif event == YMAKE_STAGE_STARTED and v['namespace'] == 'ymake':
+                start = v['value']['_timestamp'] / 1e6
+            else:
+                if event == 'critical_path':
+                    critical_uids = set(x['uid'] for x in v['value']['nodes'])
+                continue
+            zero = start if zero is None else min(zero, start)
+
+    if zero is None:
+        return
+
+    abs_from = zero + time_from if time_from is not None else None
+    abs_to = zero + time_to if time_to is not None else None
+    if index is not None:
+        ranges = index.ranges(timeline_events, abs_from, abs_to)
+    else:
+        ranges = [(0, None)]
+
+    def in_window(start, end):
+        return (abs_from is None or end >= abs_from) and (abs_to is None or start <= abs_to)
+
+    opened_ymake_stages = {}
+    for start, end in ranges:
+        for _, v in iter_evlog(fname, start, end):
+            event = v['event']
+            if event in events_to_check:
+                timing = v['value']['time']
+                if not timing or not in_window(timing[0], timing[1]):
+                    continue
+                short_name = v['value'].get('tag', '??')
+                yield Node(
+                    name=v['value']['name'],
+                    tag=short_name,
+                    start=timing[0] - zero,
+                    end=timing[1] - zero,
+                    color=short_name,
+                    thread_name=v['thread_name'],
+                    is_critical=v['value'].get('uid') in critical_uids,
+                    event=event,
+                    has_detailed=v['value']['name'].startswith('Run'),
+                )
+            elif v['namespace'] == 'ymake':
+                if event == YMAKE_STAGE_STARTED:
+                    opened_ymake_stages[(v['thread_name'], v['value']['StageName'])] = v
+                elif event == YMAKE_STAGE_FINISHED:
+                    x = opened_ymake_stages.pop((v['thread_name'], v['value']['StageName']), None)
+                    if x is None:
+                        continue
+                    start_time = x['value']['_timestamp'] / 1e6
+                    end_time = v['value']['_timestamp'] / 1e6
+                    if not in_window(start_time, end_time):
+                        continue
+                    yield Node(
+                        name=x['value']['StageName'],
+                        tag='YG',
+                        start=start_time - zero,
+                        end=end_time - zero,
+                        color='black',
+                        thread_name=x['thread_name'],
+                        is_critical=True,
+                    )
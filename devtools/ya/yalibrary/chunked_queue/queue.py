@@ -1,17 +1,24 @@
+import itertools
+import mmap
 import os
+import struct
 import threading
 import datetime as dt
 
+import six
+
 from exts import fs
 from exts import uniq_id
 from exts import filelock
 
 
-__all__ = ['Queue']
+__all__ = ['Queue', 'LINE_CODEC', 'RECORD_CODEC']
 
 
 DATE_FMT = '%Y_%m_%d_%H_%M_%S'
 UNIQ_ID = 0
+OFFSET_SUFFIX = '.offset'
+KEYS_SUFFIX = '.keys'
 
 
 def uniq_name():
@@ -25,13 +32,131 @@ def unpack_date(uniq_id):
     return dt.datetime.strptime(date, DATE_FMT)
 
 
+class LineCodec(object):
+    """Values are text lines"""
+
+    mode = ''
+    buffering = -1
+    keyed = False
+
+    @staticmethod
+    def encode(value):
+        return value + '\n'
+
+    @staticmethod
+    def dump(values):
+        return ''.join(values)
+
+    @staticmethod
+    def iterate(stream, start=0, keys=None):
+        """Yields (value, index of the next value) starting from the value with index start"""
+        return _enumerate_from(itertools.islice(stream, start, None), start)
+
+
+class RecordCodec(object):
+    """
+    Values are (key, stamp, id) tuples stored as fixed-width binary records (64-bit hash of the key, stamp, id),
+    so a record is found by its index. Keys are stored once per chunk in a sidecar file of
+    (hash, key length, utf-8 key) entries which is written before the records referring to them.
+    """
+
+    mode = 'b'
+    buffering = 1 << 16
+    keyed = True
+    RECORD = struct.Struct('<QII')
+    KEY_HEADER = struct.Struct('<QH')
+
+    @staticmethod
+    def hash(key):
+        import cityhash
+
+        return cityhash.hash64(six.ensure_binary(key))
+
+    @classmethod
+    def encode(cls, h, stamp, id):
+        return cls.RECORD.pack(h, stamp, id)
+
+    @classmethod
+    def encode_key(cls, h, key):
+        key = six.ensure_binary(key)
+        return cls.KEY_HEADER.pack(h, len(key)) + key
+
+    @classmethod
+    def dump(cls, values):
+        return b''.join(cls.encode(cls.hash(key), stamp, id) for key, stamp, id in values)
+
+    @classmethod
+    def dump_keys(cls, values):
+        keys = {cls.hash(key): key for key, _, _ in values}
+        return b''.join(cls.encode_key(h, key) for h, key in six.iteritems(keys))
+
+    @classmethod
+    def load_keys(cls, path):
+        keys = {}
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return keys
+        offset = 0
+        header_size = cls.KEY_HEADER.size
+        while offset + header_size <= len(data):
+            h, key_size = cls.KEY_HEADER.unpack_from(data, offset)
+            offset += header_size
+            if offset + key_size > len(data):
+                # Partially written entry
+                break
+            keys[h] = six.ensure_str(data[offset : offset + key_size])
+            offset += key_size
+        return keys
+
+    @classmethod
+    def iterate(cls, stream, start=0, keys=None):
+        """
+        Yields (value, index of the next value) starting from the record with index start.
+        Records with keys missing in keys (their writer was interrupted) are skipped.
+        """
+        stream.flush()
+        size = os.fstat(stream.fileno()).st_size
+        record_size = cls.RECORD.size
+        if size < (start + 1) * record_size:
+            return
+        mm = mmap.mmap(stream.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            index = start
+            for offset in six.moves.xrange(start * record_size, size - record_size + 1, record_size):
+                h, stamp, id = cls.RECORD.unpack_from(mm, offset)
+                index += 1
+                key = keys.get(h)
+                if key is not None:
+                    yield (key, stamp, id), index
+        finally:
+            mm.close()
+
+
+def _enumerate_from(values, start):
+    for index, value in enumerate(values, start + 1):
+        yield value, index
+
+
+LINE_CODEC = LineCodec()
+RECORD_CODEC = RecordCodec()
+
+
 class Chunk(object):
-    def __init__(self, data_dir, tag):
+    def __init__(self, data_dir, tag, codec=LINE_CODEC):
         self._data_dir = data_dir
         self._tag = tag
+        self._codec = codec
         self._data_path = os.path.join(data_dir, tag)
+        # Number of values consumed (written when consumption is interrupted)
+        self._offset_path = self._data_path + OFFSET_SUFFIX
+        self._keys_path = self._data_path + KEYS_SUFFIX
         self._lock = threading.Lock()
         self._stream = None
+        self._keys_stream = None
+        # hash -> key of the keys written to the keys file of the opened chunk
+        self._written_keys = {}
 
     @property
     def tag(self):
@@ -45,26 +170,64 @@ class Chunk(object):
         with self._lock:
             if self._stream is not None:
                 raise RuntimeError('Already opened')
-            self._stream = open(self._data_path, 'w+')
+            if self._codec.keyed:
+                self._keys_stream = open(self._keys_path, 'wb', self._codec.buffering)
+            self._stream = open(self._data_path, 'w+' + self._codec.mode, self._codec.buffering)
 
     def close(self):
         with self._lock:
             if self._stream is None:
                 raise RuntimeError('Stream is not opened')
+            if self._keys_stream is not None:
+                self._keys_stream.close()
             self._stream.close()
 
+    def _keys(self):
+        if not self._codec.keyed:
+            return None
+        if self._written_keys:
+            # Keys of the chunk opened by this process are kept in memory
+            return self._written_keys
+        return self._codec.load_keys(self._keys_path)
+
+    def _read_offset(self):
+        try:
+            with open(self._offset_path) as f:
+                return int(f.read())
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _save_offset(self, offset):
+        tmp_path = '{}.{}.tmp'.format(self._offset_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+        os.rename(tmp_path, self._offset_path)
+
+    def _remove_files(self):
+        fs.remove_file(self._data_path)
+        fs.ensure_removed(self._offset_path)
+        fs.ensure_removed(self._keys_path)
+
     def consume(self, action):
         with self._lock:
             if self._stream is None:
-                with open(self._data_path, 'r') as f:
-                    for line in f:
-                        for x in action(line):
+                offset = self._read_offset()
+                with open(self._data_path, 'r' + self._codec.mode) as f:
+                    for value, next_offset in self._codec.iterate(f, offset, self._keys()):
+                        try:
+                            results = list(action(value))
+                        except Exception:
+                            # Only the offset is saved, so interrupted consumption resumes where it stopped
+                            self._save_offset(offset)
+                            raise
+                        offset = next_offset
+                        for x in results:
                             yield x
-                fs.remove_file(self._data_path)
+                self._remove_files()
             else:
                 self._stream.seek(0)
-                for line in self._stream:
-                    for x in action(line):
+                for value, _ in self._codec.iterate(self._stream, 0, self._keys()):
+                    for x in action(value):
                         yield x
                 self._stream.seek(0)
                 self._stream.truncate()
@@ -73,9 +236,10 @@ class Chunk(object):
     def analyze(self, analyzer):
         self.flush()
         with self._lock:
-            with open(self._data_path, 'r') as f:
-                for line in f:
-                    for x in analyzer(line):
+            offset = self._read_offset() if self._stream is None else 0
+            with open(self._data_path, 'r' + self._codec.mode) as f:
+                for value, _ in self._codec.iterate(f, offset, self._keys()):
+                    for x in analyzer(value):
                         yield x
 
     def consume_lines(self, lines_filter):
@@ -85,22 +249,27 @@ class Chunk(object):
                 def __enter__(rself):
                     rself._opened = self._stream is not None
                     if rself._opened:
+                        self._flush()
                         self._stream.close()
                         self._stream = None
 
                 def __exit__(rself, type, value, traceback):
                     if rself._opened:
-                        self._stream = open(self._data_path, 'a')
+                        self._stream = open(self._data_path, 'a+' + self._codec.mode, self._codec.buffering)
                     return isinstance(value, OSError)
 
             with reopener():
-                with open(self._data_path, 'r+') as f:
-                    left_over = [x for line in f for x in lines_filter(line)]
+                offset = self._read_offset()
+                with open(self._data_path, 'r+' + self._codec.mode) as f:
+                    values = self._codec.iterate(f, offset, self._keys())
+                    left_over = [x for value, _ in values for x in lines_filter(value)]
                     if left_over:
                         f.seek(0)
-                        data = ''.join(left_over)
+                        data = self._codec.dump(left_over)
                         f.write(data)
                         f.truncate()
+                # Consumed values are dropped by the rewrite, keys of the chunk are kept as they are
+                fs.ensure_removed(self._offset_path)
 
                 if not left_over:
                     fs.remove_file(self._data_path)
@@ -109,16 +278,47 @@ class Chunk(object):
         with self._lock:
             if self._stream is None:
                 raise RuntimeError('Chunk is not opened')
-            self._stream.write(value + '\n')
+            if self._codec.keyed:
+                key, stamp, id = value
+                h = self._codec.hash(key)
+                if h not in self._written_keys:
+                    self._keys_stream.write(self._codec.encode_key(h, key))
+                    self._written_keys[h] = key
+                self._stream.write(self._codec.encode(h, stamp, id))
+            else:
+                self._stream.write(self._codec.encode(value))
+
+    def _flush(self):
+        # Keys go first, so the records are never written before their keys
+        if self._keys_stream is not None:
+            self._keys_stream.flush()
+        self._stream.flush()
 
     def flush(self):
         with self._lock:
             if self._stream is not None:
-                self._stream.flush()
+                self._flush()
+
+    def write_all(self, values):
+        with self._lock:
+            if self._codec.keyed:
+                self._write_file(self._keys_path, self._codec.dump_keys(values))
+            self._write_file(self._data_path, self._codec.dump(values))
+            fs.ensure_removed(self._offset_path)
+
+    def _write_file(self, path, data):
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w' + self._codec.mode) as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+    def remove(self):
+        with self._lock:
+            self._remove_files()
 
     @staticmethod
-    def create_new(data_dir):
-        return Chunk(data_dir, uniq_name())
+    def create_new(data_dir, codec=LINE_CODEC):
+        return Chunk(data_dir, uniq_name(), codec)
 
 
 class NoChunkError(Exception):
@@ -126,23 +326,33 @@ class NoChunkError(Exception):
 
 
 class Queue(object):
-    def __init__(self, store_dir):
+    def __init__(self, store_dir, codec=LINE_CODEC):
         fs.create_dirs(store_dir)
 
+        self._codec = codec
         self._data_dir = os.path.join(store_dir, 'data')
         self._consume_lock = filelock.FileLock(os.path.join(store_dir, 'consume.lock'))
         fs.create_dirs(self._data_dir)
-        self._active_chunk = Chunk.create_new(self._data_dir)
+        self._active_chunk = Chunk.create_new(self._data_dir, codec)
         self._active_chunk.open()
 
+    def _chunk(self, chunk_name):
+        if chunk_name == self._active_chunk.tag:
+            return self._active_chunk
+        return Chunk(self._data_dir, chunk_name, self._codec)
+
+    def _chunk_names(self):
+        # Skip temporary files of write_all(), offsets and keys of chunks
+        return sorted(x for x in os.listdir(self._data_dir) if not x.endswith(('.tmp', OFFSET_SUFFIX, KEYS_SUFFIX)))
+
     def close(self):
         self._active_chunk.close()
 
     def sieve(self, consumer, max_chunks=None):
         with self._consume_lock:
-            for chunk_name in sorted(os.listdir(self._data_dir))[:max_chunks]:
-                if os.path.basename(chunk_name) != self._active_chunk.tag:
-                    chunk = Chunk(self._data_dir, chunk_name)
+            for chunk_name in self._chunk_names()[:max_chunks]:
+                if chunk_name != self._active_chunk.tag:
+                    chunk = self._chunk(chunk_name)
                     for x in chunk.consume(consumer):
                         yield x
 
@@ -153,13 +363,8 @@ class Queue(object):
 
     def analyze(self, analyzer):
         with self._consume_lock:
-            for chunk_name in sorted(os.listdir(self._data_dir)):
-                chunk = (
-                    Chunk(self._data_dir, chunk_name)
-                    if os.path.basename(chunk_name) != self._active_chunk.tag
-                    else self._active_chunk
-                )
-                for x in chunk.analyze(analyzer):
+            for chunk_name in self._chunk_names():
+                for x in self._chunk(chunk_name).analyze(analyzer):
                     yield x
 
     def push(self, value):
@@ -170,10 +375,30 @@ class Queue(object):
 
     def strip(self, lines_filter):
         with self._consume_lock:
-            for chunk_name in sorted(os.listdir(self._data_dir)):
-                chunk = (
-                    Chunk(self._data_dir, chunk_name)
-                    if os.path.basename(chunk_name) != self._active_chunk.tag
-                    else self._active_chunk
-                )
-                chunk.consume_lines(lines_filter)
+            for chunk_name in self._chunk_names():
+                self._chunk(chunk_name).consume_lines(lines_filter)
+
+    def compact(self, lines_filter, min_chunks, min_age):
+        """
+        Merge chunks older than min_age into the oldest one retaining values accepted by lines_filter.
+        Does nothing if there are less than min_chunks such chunks.
+        """
+        with self._consume_lock:
+            now = dt.datetime.utcnow()
+            names = [
+                x
+                for x in self._chunk_names()
+                if x != self._active_chunk.tag and now - unpack_date(x) > min_age
+            ]
+            if len(names) < min_chunks:
+                return 0
+
+            chunks = [self._chunk(x) for x in names]
+            left_over = []
+            for chunk in chunks:
+                for x in chunk.analyze(lines_filter):
+                    left_over.append(x)
+            chunks[0].write_all(left_over)
+            for chunk in chunks[1:]:
+                chunk.remove()
+            return len(chunks)
@@ -1,6 +1,9 @@
+import collections
 import datetime
+import heapq
 import logging
 import os
+import re
 import six
 import sys
 import threading
@@ -16,6 +19,13 @@ _LOG_FILE_NAME_FMT = '%H-%M-%S'
 _LOG_DIR_NAME_FMT = '%Y-%m-%d'
 _EVLOG_SUFFIX = '.evlog'
 
+# Async mode: how often the flusher thread writes buffered events
+_FLUSH_INTERVAL = 0.2
+# Async mode: wake up the flusher when a thread buffer holds this many events
+_FLUSH_BATCH = 1000
+# Async mode: a thread blocks until the flusher drains its buffer when it holds this many events
+_MAX_THREAD_BUFFER = 50000
+
 
 def _fix_non_utf8(data):
     from six.moves import collections_abc
@@ -51,7 +61,7 @@ class DummyEvlog(object):
 
 
 class Evlog(object):
-    def __init__(self, evlog_dir, chunk_name, filename, replacements=None):
+    def __init__(self, evlog_dir, chunk_name, filename, replacements=None, async_write=False):
         self._evlog_dir = evlog_dir
         self._chunk_name = chunk_name
         self._filename = filename
@@ -78,6 +88,20 @@ class Evlog(object):
                     self._replacements.append(v)
 
         self._replacements = sorted(self._replacements)
+        # Replace all secrets in a single pass, alternatives are tried in the order of former sequential replaces
+        self._secrets_re = re.compile('|'.join(re.escape(r) for r in self._replacements)) if self._replacements else None
+
+        self._closed = False
+        self._flusher = None
+        if async_write:
+            self._local = threading.local()
+            self._buffers = []
+            self._buffers_lock = threading.Lock()
+            self._wakeup = threading.Event()
+            self._drained = threading.Condition()
+            self._flusher = threading.Thread(target=self._flush_loop, name='EvlogFlusher')
+            self._flusher.daemon = True
+            self._flusher.start()
 
     @staticmethod
     def __json_safe(s):
@@ -106,23 +130,25 @@ class Evlog(object):
         return True
 
     def _remove_secrets(self, s):
-        for r in self._replacements:
-            s = s.replace(r, "[SECRET]")
-        return s
+        if self._secrets_re is None:
+            return s
+        return self._secrets_re.sub("[SECRET]", s)
 
-    def write(self, namespace, event, **kwargs):
+    def _dumps(self, namespace, event, kwargs):
+        timestamp = time.time()
         value = {
-            'timestamp': time.time(),
+            'timestamp': timestamp,
             'thread_name': threading.current_thread().name,
             'namespace': namespace,
             'event': event,
             'value': kwargs,
         }
         try:
-            s = yjson.dumps(value) + '\n'
+            return timestamp, yjson.dumps(value) + '\n'
         except (UnicodeDecodeError, OverflowError):
-            s = yjson.dumps(_fix_non_utf8(value)) + '\n'
+            return timestamp, yjson.dumps(_fix_non_utf8(value)) + '\n'
 
+    def _write_to_file(self, s):
         s = self._remove_secrets(s)
 
         with self._lock:
@@ -137,6 +163,64 @@ class Evlog(object):
                 else:
                     raise e
 
+    def write(self, namespace, event, **kwargs):
+        timestamp, s = self._dumps(namespace, event, kwargs)
+        if self._flusher is None or self._closed:
+            self._write_to_file(s)
+            return
+
+        buf = getattr(self._local, 'buffer', None)
+        if buf is None:
+            buf = self._local.buffer = collections.deque()
+            with self._buffers_lock:
+                self._buffers.append((threading.current_thread(), buf))
+
+        # deque.append is atomic, the thread doesn't take any lock on the fast path
+        buf.append((timestamp, s))
+        if self._closed:
+            # Raced with close()
+            self._flush_buffers()
+        elif len(buf) >= _FLUSH_BATCH:
+            self._wakeup.set()
+            if len(buf) >= _MAX_THREAD_BUFFER:
+                # Backpressure: don't let the buffer grow while the flusher is behind
+                with self._drained:
+                    while len(buf) >= _MAX_THREAD_BUFFER and not self._closed:
+                        self._drained.wait(_FLUSH_INTERVAL)
+
+    def _flush_buffers(self):
+        with self._buffers_lock:
+            buffers = list(self._buffers)
+            # Forget buffers of finished threads
+            self._buffers = [(t, b) for t, b in buffers if b or t.is_alive()]
+
+        batches = []
+        for _, buf in buffers:
+            batch = []
+            try:
+                while True:
+                    batch.append(buf.popleft())
+            except IndexError:
+                pass
+            if batch:
+                batches.append(batch)
+
+        if batches:
+            # Each thread buffer is ordered by time, keep the file ordered the same way as in the sync mode
+            self._write_to_file(''.join(s for _, s in heapq.merge(*batches)))
+
+        with self._drained:
+            self._drained.notify_all()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self._flush_buffers()
+            except Exception:
+                logging.exception("Error while writing event log %s", self.path)
+
     def get_writer(self, namespace):
         def inner(event, **kwargs):
             self.write(namespace, event, **kwargs)
@@ -144,6 +228,11 @@ class Evlog(object):
         return inner
 
     def close(self):
+        self._closed = True
+        if self._flusher is not None:
+            self._wakeup.set()
+            self._flusher.join()
+            self._flush_buffers()
         self._fileobj.close()
 
     @property
@@ -184,7 +273,9 @@ def with_evlog(params, evlog_dir, days_to_save, now_time, run_uid, hide_token):
     )
     logging.debug('Event log file is %s', filename)
 
-    evlog = Evlog(evlog_dir, log_chunk, filename, replacements=hide_token)
+    evlog = Evlog(
+        evlog_dir, log_chunk, filename, replacements=hide_token, async_write=getattr(params, 'evlog_async', False)
+    )
     evlog.write('init', 'init', args=sys.argv, env=os.environ.copy())
 
     try:
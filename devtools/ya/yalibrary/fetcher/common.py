@@ -27,17 +27,24 @@ def clean_dir(dir):
     fs.create_dirs(dir)
 
 
-def deploy_tool(archive, extract_to, post_process, resource_info, resource_uri, binname=None, strip_prefix=None):
-    RESOURCE_INFO_JSON = "resource_info.json"
-    RESOURCE_CONTENT_FILE_NAME = "resource"
-    RESOURCE_URI = "lnk"
+RESOURCE_INFO_JSON = "resource_info.json"
+RESOURCE_CONTENT_FILE_NAME = "resource"
+RESOURCE_URI = "lnk"
+# Number of file writers for archive extraction
+EXTRACT_THREADS = 4
+
+
+def stream_extract_enabled():
+    return os.environ.get('YA_STREAM_EXTRACT', 'yes').lower() not in ('0', 'no', 'false')
 
+
+def deploy_tool(archive, extract_to, post_process, resource_info, resource_uri, binname=None, strip_prefix=None):
     if UNTAR == post_process:
         try:
             import exts.archive
 
             logger.debug("extract {0} to {1} dir (strip_prefix={2})".format(archive, extract_to, strip_prefix))
-            exts.archive.extract_from_tar(archive, extract_to, strip_components=strip_prefix)
+            exts.archive.extract_from_tar(archive, extract_to, strip_components=strip_prefix, threads=EXTRACT_THREADS)
         finally:
             fs.remove_file(archive)
     elif RENAME == post_process:
@@ -54,6 +61,22 @@ def deploy_tool(archive, extract_to, post_process, resource_info, resource_uri,
         st = os.stat(full_path)
         os.chmod(full_path, st.st_mode | stat.S_IEXEC)
 
+    _store_resource_info(extract_to, resource_info, resource_uri)
+
+
+def deploy_tool_from_url(url, expected_md5, extract_to, resource_info, resource_uri, strip_prefix=None):
+    """
+    UNTAR deploy_tool() pipelined with the download: the archive is extracted while it's being downloaded.
+    Raises on md5 mismatch or broken archive, extract_to must be cleaned and the resource deployed in two steps then.
+    """
+    from exts import http_client
+
+    logger.debug("extract {0} to {1} dir on the fly (strip_prefix={2})".format(url, extract_to, strip_prefix))
+    http_client.download_and_extract(url, extract_to, expected_md5=expected_md5, strip_components=strip_prefix)
+    _store_resource_info(extract_to, resource_info, resource_uri)
+
+
+def _store_resource_info(extract_to, resource_info, resource_uri):
     meta_info = os.path.join(extract_to, RESOURCE_INFO_JSON)
     if os.path.exists(meta_info):
         logger.debug("Meta information cannot be stored: {} already exists".format(meta_info))
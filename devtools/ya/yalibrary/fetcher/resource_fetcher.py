@@ -16,7 +16,9 @@ from .common import (
     ProgressPrinter,
     clean_dir,
     deploy_tool,
+    deploy_tool_from_url,
     parse_resource_uri,
+    stream_extract_enabled,
 )
 
 from .cache_helper import install_resource
@@ -84,7 +86,17 @@ def fetch_resource_if_need(
     def do_deploy(download_to, resource_info):
         deploy_tool(download_to, result_dir, post_process, resource_info, resource_uri, binname, strip_prefix)
 
-    return _do_fetch_resource_if_need(result_dir, downloader, do_deploy, target_is_tool_dir, force_refetch)
+    stream_deployer = None
+    if post_process == UNTAR and isinstance(downloader, _HttpDownloader) and stream_extract_enabled():
+
+        def deploy_on_the_fly():
+            downloader.deploy_on_the_fly(result_dir, resource_uri, strip_prefix)
+
+        stream_deployer = deploy_on_the_fly
+
+    return _do_fetch_resource_if_need(
+        result_dir, downloader, do_deploy, target_is_tool_dir, force_refetch, stream_deployer=stream_deployer
+    )
 
 
 def select_resource(item, platform=None):
@@ -131,9 +143,26 @@ def _get_downloader(fetcher, parsed_uri, progress_callback, state, keep_director
         raise Exception('Unsupported resource_uri {}'.format(parsed_uri.resource_uri))
 
 
-def _do_fetch_resource_if_need(result_dir, downloader, deployer, target_is_tool_dir=True, force_refetch=False):
+def _try_stream_deploy(result_dir, stream_deployer):
+    try:
+        stream_deployer()
+        return True
+    except http_client.StreamNotSupportedException as e:
+        logger.debug("%s, archive will be extracted after download", e)
+    except Exception as e:
+        # Md5 mismatch, truncated or broken archive: download it to disk (with retries) and check before extraction
+        logger.warning("Extraction on the fly to %s failed: %s. Falling back to download and extraction", result_dir, e)
+    clean_dir(result_dir)
+    return False
+
+
+def _do_fetch_resource_if_need(
+    result_dir, downloader, deployer, target_is_tool_dir=True, force_refetch=False, stream_deployer=None
+):
     def do_install():
         guards.update_guard(guards.GuardTypes.FETCH)
+        if stream_deployer is not None and _try_stream_deploy(result_dir, stream_deployer):
+            return
         download_to = os.path.join(result_dir, 'resource.' + uniq_id.gen8())
         resource_info = downloader(download_to)
         deployer(download_to, resource_info)
@@ -161,6 +190,9 @@ class _HttpDownloader(DownloaderBase):
         http_client.download_file(url=self._url, path=download_to, expected_md5=self._md5)
         return self._info
 
+    def deploy_on_the_fly(self, extract_to, resource_uri, strip_prefix=None):
+        deploy_tool_from_url(self._url, self._md5, extract_to, self._info, resource_uri, strip_prefix)
+
 
 class _HttpDownloaderWithConfigMapping(_HttpDownloader):
     def __init__(self, resource_id, resource_info):
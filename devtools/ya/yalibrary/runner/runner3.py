@@ -16,6 +16,7 @@ import core.config
 import core.error
 import core.report
 import exts.archive
+import exts.hashing
 import exts.os2
 import exts.process
 import exts.shlex2
@@ -33,6 +34,7 @@ from yalibrary.runner import statcalc
 from yalibrary.runner import worker_threads
 from yalibrary.runner import task_cache
 from yalibrary.runner.command_file.python import command_file as cf
+from yalibrary.store.incremental_gc import IncrementalGC
 import yalibrary.runner.sandboxing as sandboxing
 from yalibrary.status_view.helpers import format_paths
 
@@ -260,6 +262,8 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
             self.priority = kwargs.get('priority')
             self.target_properties = kwargs.get('target_properties', {})
             self.max_dist = 0
+            self.min_reqs = kwargs.get('min_reqs')
+            self.critical_prio = 0
             self.ignore_broken_dependencies = kwargs.get('ignore_broken_dependencies', False)
             self.refcount = 0
             self.stable_dir_outputs = kwargs.get('stable_dir_outputs', False)
@@ -339,6 +343,9 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
             who_provides[p] = n
     timer.show_step('build who provides, ref count')
 
+    predicted_critical_time = statcalc.calc_critical_prio(nodes)
+    timer.show_step('calc critical path priorities')
+
     def setup_incremental_cleanup():
         if not ctx.opts.use_distbuild:
             for n in nodes:
@@ -385,6 +392,10 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
 
     runq = runqueue.RunQueue(workers.add, queue_status.listener())
 
+    incremental_gc = None
+    if getattr(opts, 'incremental_gc', False) and opts.cache_size and IncrementalGC.supported(cache):
+        incremental_gc = IncrementalGC(cache, opts.cache_size)
+
     res = collections.defaultdict(list)
 
     build_errors = {}
@@ -420,7 +431,9 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
 
             import yalibrary.runner.tasks.cache
 
-            self.compact_cache_task = yalibrary.runner.tasks.cache.CompactCacheTask(cache, state, opts, execution_log)
+            self.compact_cache_task = yalibrary.runner.tasks.cache.CompactCacheTask(
+                cache, state, opts, execution_log, incremental_gc=incremental_gc is not None
+            )
             self.clean_symres_task = yalibrary.runner.tasks.cache.CleanSymresTask(
                 symlink_result, state, opts, execution_log
             )
@@ -677,6 +690,8 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
 
     ienv.start()
     start_time = time.time()
+    if incremental_gc is not None:
+        incremental_gc.start()
     try:
         runq.add(task_context.clean_symres_task)
         runq.add(task_context.prepare_all_nodes_task)
@@ -699,9 +714,21 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
     finally:
         exit_stack.pop_all().close()
 
+        if incremental_gc is not None:
+            incremental_gc.stop()
+            stats = incremental_gc.stats()
+            core.report.telemetry.report('incremental_gc_stats', stats)
+            execution_log['$(incremental-gc)'] = stats
+
         if hasattr(cache, 'stats'):
             cache.stats(execution_log)
 
+        digest_cache = exts.hashing.get_digest_cache()
+        if digest_cache:
+            stats = digest_cache.stats()
+            core.report.telemetry.report('digest_cache_stats', stats)
+            execution_log['$(digest-cache)'] = stats
+
         if dist_cache and hasattr(dist_cache, 'stats'):
             dist_cache_evlog_writer = app_ctx.evlog.get_writer('yt_store') if getattr(app_ctx, 'evlog', None) else None
             dist_cache.stats(execution_log, dist_cache_evlog_writer)
@@ -742,8 +769,11 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
     merged_exit_code = core.error.merge_exit_codes([0] + list(exit_code_map.values()))
     logger.debug("Merged exit code: %d", merged_exit_code)
 
+    critical_tasks = statcalc.calc_critical(replay_info)
+    actual_critical_time = statcalc.critical_time(critical_tasks)
+    logger.debug('Critical path: predicted %0.2fs, actual %0.2fs', predicted_critical_time, actual_critical_time)
+
     def calc_critical_path():
-        critical_tasks = statcalc.calc_critical(replay_info)
         for task_info in critical_tasks:
             yield {
                 'name': str(task_info.task),  # TODO: better
@@ -755,6 +785,10 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
     data.update(
         {
             'critical_path': list(calc_critical_path()),
+            'critical_path_time': {
+                'predicted': predicted_critical_time,
+                'actual': actual_critical_time,
+            },
             'wall_time': wall_time,
             'build_type': opts.build_type,
             'flags': opts.flags,
@@ -47,3 +47,86 @@ def calc_critical(task_infos):
         max_crit_task = back_edge.get(max_crit_task)
 
     return list(reversed([task_mapping[x] for x in crit_path]))
+
+
+def critical_time(critical_tasks):
+    return sum(task_info.timing[1] - task_info.timing[0] for task_info in critical_tasks)
+
+
+# Expected duration (in seconds) of a node without any historical statistics
+DEFAULT_DURATION = 1.0
+
+
+def _stat_duration(node):
+    min_reqs = getattr(node, 'min_reqs', None)
+    if not min_reqs or 'duration' not in min_reqs:
+        return None
+
+    from devtools.libs.parse_number.python import parse_number as pn
+
+    try:
+        # Duration is in format 123.45ms, see build.graph._update_graph_execution_cost
+        return float(pn.parse_human_readable_number(min_reqs['duration'][:-1]))
+    except Exception:
+        return None
+
+
+def _node_type(node):
+    return (node.kv or {}).get('p')
+
+
+def estimate_durations(nodes):
+    known = {}
+    by_type = collections.defaultdict(list)
+    for node in nodes:
+        duration = _stat_duration(node)
+        if duration is not None:
+            known[node] = duration
+            by_type[_node_type(node)].append(duration)
+
+    avg_by_type = {t: sum(durations) / len(durations) for t, durations in by_type.items()}
+    avg = sum(known.values()) / len(known) if known else DEFAULT_DURATION
+
+    return {node: known[node] if node in known else avg_by_type.get(_node_type(node), avg) for node in nodes}
+
+
+def calc_critical_prio(nodes):
+    """
+    Set node.critical_prio to the expected duration of the longest path from the node to the end of the build
+    (node itself included), durations are taken from historical statistics (node.min_reqs).
+    Without any statistics every node weighs DEFAULT_DURATION, so nodes with more nodes on the longest path
+    to the end of the build go first.
+    Return the expected duration of the critical path of the whole graph.
+    """
+    durations = estimate_durations(nodes)
+
+    # Post-order: dependencies go before the node
+    order = []
+    visited = set()
+    for root in nodes:
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, iter(root.dep_nodes()))]
+        while stack:
+            node, deps = stack[-1]
+            for dep in deps:
+                if dep not in visited:
+                    visited.add(dep)
+                    stack.append((dep, iter(dep.dep_nodes())))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+
+    tail = {}
+    predicted = 0
+    for node in reversed(order):
+        prio = durations[node] + tail.get(node, 0)
+        node.critical_prio = prio
+        predicted = max(predicted, prio)
+        for dep in node.dep_nodes():
+            if tail.get(dep, 0) < prio:
+                tail[dep] = prio
+
+    return predicted
@@ -8,16 +8,19 @@ from yalibrary.toolscache import tc_force_gc
 class CompactCacheTask(object):
     node_type = 'CompactCache'
 
-    def __init__(self, cache, state, opts, execution_log):
+    def __init__(self, cache, state, opts, execution_log, incremental_gc=False):
         self._cache = cache
         self._state = state
         self._opts = opts
         self._execution_log = execution_log
+        # Size limit is maintained by the background incremental GC
+        self._incremental_gc = incremental_gc
 
     def __call__(self, *args, **kwargs):
         if hasattr(self._cache, 'compact'):
             start_time = time.time()
-            self._cache.compact(getattr(self._opts, 'new_store_ttl'), getattr(self._opts, 'cache_size'), self._state)
+            max_cache_size = None if self._incremental_gc else getattr(self._opts, 'cache_size')
+            self._cache.compact(getattr(self._opts, 'new_store_ttl'), max_cache_size, self._state)
             self._execution_log["compact cache"] = {'timing': (start_time, time.time()), 'prepare': '', 'type': 'clean'}
 
             start_time = time.time()
@@ -191,7 +194,7 @@ class PutInCacheTask(object):
         return worker_threads.ResInfo(io=1)
 
     def prio(self):
-        return self._node.max_dist
+        return self._node.critical_prio
 
     def short_name(self):
         return 'put_in_cache[{}]'.format(self._node.kv.get('p', '??'))
@@ -257,7 +260,7 @@ class RestoreFromCacheTask(object):
         return 'FromCache({})'.format(str(self._node))
 
     def prio(self):
-        return self._node.max_dist
+        return self._node.critical_prio
 
     def res(self):
         return worker_threads.ResInfo(cpu=1)
@@ -307,7 +310,7 @@ class WriteThroughCachesTask(object):
         return worker_threads.ResInfo()
 
     def prio(self):
-        return self._node.max_dist
+        return self._node.critical_prio
 
     def short_name(self):
         return 'write_through_caches[{}]'.format(self._node.kv.get('p', '??'))
@@ -41,7 +41,7 @@ class PutInDistCacheTask(object):
         return worker_threads.ResInfo(upload=1)
 
     def prio(self):
-        return self._node.max_dist
+        return self._node.critical_prio
 
     def short_name(self):
         return 'put_in_dist_cache[{}]'.format(self._node.kv.get('p', '??'))
@@ -144,7 +144,7 @@ class RestoreFromDistCacheTask(object):
         return 'FromDistCache({})'.format(str(self._node))
 
     def prio(self):
-        return self._node.max_dist
+        return self._node.critical_prio
 
     def res(self):
         return worker_threads.ResInfo(download=1)
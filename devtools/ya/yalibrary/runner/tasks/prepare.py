@@ -43,6 +43,11 @@ class PrepareAllNodesTask(UniqueTask):
 
         touch_mode = not self._ctx.opts.clear_build and self._ctx.opts.strip_cache and hasattr(self._cache, 'compact')
         results = []
+        # uids found in the local cache when they are probed in a single batch
+        cached_uids = None
+        if touch_mode and hasattr(self._cache, 'has_many'):
+            # touch all uids for aggressive compaction, the answers are reused below
+            cached_uids = self._cache.has_many([node.uid for node in self._nodes if node.cacheable])
         for node in self._nodes:
             if node.is_result_node():
                 q.put(node)
@@ -50,7 +55,7 @@ class PrepareAllNodesTask(UniqueTask):
                 results.append(node)
                 node.refcount += 1
 
-            if touch_mode and node.cacheable:
+            if touch_mode and node.cacheable and cached_uids is None:
                 # touch node.uid for aggressive compaction
                 self._cache.has(node.uid)
 
@@ -61,7 +66,10 @@ class PrepareAllNodesTask(UniqueTask):
                 x.max_dist = max(x.max_dist, node.max_dist + 1)
 
             cacheable = not self._ctx.opts.clear_build and node.cacheable
-            local_cache_task = cacheable and self._cache.has(node.uid)
+            if cached_uids is not None:
+                local_cache_task = cacheable and node.uid in cached_uids
+            else:
+                local_cache_task = cacheable and self._cache.has(node.uid)
             dist_cache_task = False
             if cacheable and not local_cache_task and self._dist_cache and self._dist_cache.fits(node):
                 if self._dist_cache.has(node.uid):
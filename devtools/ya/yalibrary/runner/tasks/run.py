@@ -25,6 +25,7 @@ from yalibrary import formatter
 import yalibrary.worker_threads as worker_threads
 from exts.fs import create_dirs, ensure_removed, hardlink_tree, remove_tree_with_perm_update
 from yalibrary.runner.build_root import BuildRootError
+from yalibrary.runner.tasks import supervisor
 
 if tp.TYPE_CHECKING:
     from yalibrary.runner.build_root import BuildRoot  # noqa
@@ -183,43 +184,63 @@ class PopenExecutor(ExecutorBase):
 
             f.close()
 
+        stderr = []
+
+        def handle_line(line):
+            if line.startswith(self.status_prefix):
+                status = line[self.status_prefix_len :].rstrip(os.linesep)
+                self._set_status_func(status)
+            elif line.startswith(self.append_prefix):
+                self._append_tag_func(line[self.append_prefix_len :].strip())
+            elif line.startswith(self.prefix):
+                self._display_func(line[self.prefix_len :].replace("|n", "\n"))
+            else:
+                stderr.append(line)
+
         with self._state.with_finalizer(cancel_cb):
             proc = exts.process.popen(
                 args, stderr=subprocess.PIPE, stdout=stdout, env=env, cwd=cwd, close_fds=close_fds, preexec_fn=set_nice
             )
-            stderr = ""
 
-            queue = Queue.Queue()
-            read_thread = threading.Thread(target=readline, args=(proc.stderr, queue))
-            read_thread.start()
+            if exts.windows.on_win() or not supervisor.is_available():
+                queue = Queue.Queue()
+                read_thread = threading.Thread(target=readline, args=(proc.stderr, queue))
+                read_thread.start()
+
+                while True:
+                    if queue is not None:
+                        try:
+                            line = queue.get(True, 1)
+
+                            if not line:
+                                queue = None
+                            else:
+                                handle_line(line)
+                        except Queue.Empty:
+                            pass
+                    elif proc.poll() is not None:
+                        break
 
-            while True:
-                if queue is not None:
+                    self._state.check_cancel_state()
+            else:
+                # stderr is read by the supervisor thread, the queue ends as soon as the process exits
+                supervised = supervisor.get_supervisor().watch(proc)
+                while True:
                     try:
-                        line = queue.get(True, 1)
-
-                        if not line:
-                            queue = None
-
-                        if line.startswith(self.status_prefix):
-                            status = line[self.status_prefix_len :].rstrip(os.linesep)
-                            self._set_status_func(status)
-                        elif line.startswith(self.append_prefix):
-                            self._append_tag_func(line[self.append_prefix_len :].strip())
-                        elif line.startswith(self.prefix):
-                            self._display_func(line[self.prefix_len :].replace("|n", "\n"))
-                        else:
-                            stderr += line
+                        line = supervised.lines.get(True, 1)
+                        if line is None:
+                            break
+                        handle_line(line)
                     except Queue.Empty:
                         pass
-                elif proc.poll() is not None:
-                    break
 
-                self._state.check_cancel_state()
+                    self._state.check_cancel_state()
+                if supervised.error:
+                    raise supervised.error
 
             self._state.check_cancel_state()
 
-            return stderr, proc.returncode
+            return "".join(stderr), proc.returncode
 
 
 class LocalExecutor(ExecutorBase):
@@ -604,7 +625,7 @@ class RunNodeTask(object):
         return self._detailed_timings.dump()
 
     def prio(self):
-        return self._node.max_dist
+        return self._node.critical_prio
 
     def res(self):
         p = self._node.kv.get('p')
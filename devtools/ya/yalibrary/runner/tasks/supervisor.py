@@ -0,0 +1,218 @@
+import errno
+import logging
+import os
+import threading
+
+import six
+from six.moves import queue as Queue
+
+try:
+    import selectors
+except ImportError:  # python 2
+    selectors = None
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1 << 16
+# Poll interval for processes which closed stderr but haven't exited yet (when pidfd is not available)
+EXIT_POLL_INTERVAL = 0.01
+
+
+def is_available():
+    """The supervisor needs selectors and non-blocking pipes of python 3"""
+    return selectors is not None and hasattr(os, 'set_blocking')
+
+
+class SupervisedProcess(object):
+    def __init__(self, proc):
+        self.proc = proc
+        # Stderr lines for the worker owning the process, None marks the completion
+        self.lines = Queue.Queue()
+        self._buffer = b''
+        self._done = threading.Event()
+        self.stderr_closed = False
+        self.pidfd = None
+        self.error = None
+        # Fds of the process registered in the supervisor's selector
+        self.registered = set()
+
+    def feed(self, data):
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self.lines.put(six.ensure_str(line + b'\n', errors='replace'))
+
+    def finish_stderr(self):
+        if self._buffer:
+            self.lines.put(six.ensure_str(self._buffer, errors='replace'))
+            self._buffer = b''
+        self.stderr_closed = True
+
+    def set_done(self):
+        if not self._done.is_set():
+            self._done.set()
+            self.lines.put(None)
+
+    def done(self):
+        return self._done.is_set()
+
+
+class ProcessSupervisor(object):
+    """
+    Single thread which reads stderr of all running commands and detects their termination.
+    Lines are queued to the worker owning the process, so a slow consumer doesn't delay reading
+    of other processes, a job needs no extra reader thread and its completion is reported
+    as soon as the process exits.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._exiting = set()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._loop, name='ProcessSupervisor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def watch(self, proc):
+        """Start supervising process with stderr=PIPE, its stderr lines are delivered to SupervisedProcess.lines"""
+        sp = SupervisedProcess(proc)
+        os.set_blocking(proc.stderr.fileno(), False)
+        pidfd_open = getattr(os, 'pidfd_open', None)
+        if pidfd_open:
+            try:
+                sp.pidfd = pidfd_open(proc.pid)
+            except OSError as e:
+                logger.debug("pidfd_open failed for %s: %s", proc.pid, e)
+
+        with self._lock:
+            self._pending.append(sp)
+        self._wakeup()
+        return sp
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _register(self, sp, fd):
+        self._selector.register(fd, selectors.EVENT_READ, sp)
+        sp.registered.add(fd)
+
+    def _unregister(self, sp, fd):
+        if fd in sp.registered:
+            sp.registered.discard(fd)
+            self._selector.unregister(fd)
+
+    def _register_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for sp in pending:
+            try:
+                self._register(sp, sp.proc.stderr.fileno())
+            except Exception as e:
+                self._fail(sp, e)
+
+    def _on_stderr(self, sp, fd):
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b''
+            sp.error = e
+
+        if data:
+            sp.feed(data)
+            return
+
+        self._unregister(sp, fd)
+        sp.proc.stderr.close()
+        sp.finish_stderr()
+        self._wait_exit(sp)
+
+    def _wait_exit(self, sp):
+        if sp.pidfd is not None:
+            self._register(sp, sp.pidfd)
+        else:
+            self._exiting.add(sp)
+
+    def _on_exit(self, sp):
+        if sp.pidfd is not None:
+            self._unregister(sp, sp.pidfd)
+            os.close(sp.pidfd)
+            sp.pidfd = None
+        self._exiting.discard(sp)
+        sp.set_done()
+
+    def _fail(self, sp, error):
+        """Stop reading stderr of the process, it's reported as done (and reaped) when exits"""
+        logger.error('Error while supervising process %s: %s', sp.proc.pid, error, exc_info=True)
+        if sp.error is None:
+            sp.error = error
+        try:
+            for fd in list(sp.registered):
+                self._unregister(sp, fd)
+            if sp.stderr_closed:
+                # Waiting for the exit is failed itself
+                if sp.pidfd is not None:
+                    os.close(sp.pidfd)
+                    sp.pidfd = None
+                self._exiting.discard(sp)
+                sp.proc.wait()
+                sp.set_done()
+                return
+            sp.stderr_closed = True
+            sp.proc.stderr.close()
+            self._wait_exit(sp)
+        except Exception:
+            logger.exception('Unable to wait for process %s', sp.proc.pid)
+            # Last resort: don't leave the waiter hanging
+            self._exiting.discard(sp)
+            sp.set_done()
+
+    def _handle(self, sp):
+        try:
+            if not sp.stderr_closed:
+                self._on_stderr(sp, sp.proc.stderr.fileno())
+            elif sp.proc.poll() is not None:
+                self._on_exit(sp)
+        except Exception as e:
+            self._fail(sp, e)
+
+    def _loop(self):
+        while True:
+            timeout = EXIT_POLL_INTERVAL if self._exiting else None
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        os.read(self._wakeup_r, READ_SIZE)
+                    except OSError:
+                        pass
+                    self._register_pending()
+                elif key.data.done():
+                    # The process is failed while handling another event of the same select
+                    continue
+                else:
+                    self._handle(key.data)
+
+            for sp in list(self._exiting):
+                self._handle(sp)
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor():
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = ProcessSupervisor()
+        return _supervisor
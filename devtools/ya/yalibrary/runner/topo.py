@@ -1,124 +1,148 @@
-import collections
 import threading
 
 
 class DisjointSet(object):
+    """
+    Union-find over dense integer ids.
+    Ids are allocated by add() in order 0, 1, 2, ...
+    """
+
     def __init__(self):
-        self._leader = {}
+        self._leader = []
         self._followers = {}
         self._values = {}
 
-    def __contains__(self, item):
-        return item in self._leader
-
-    def __getitem__(self, item):
-        return self._values[self.leader(item)]
-
-    def __setitem__(self, key, value):
-        if key not in self._leader:
-            self._leader[key] = key
-            self._followers[key] = [key]
-        self._values[self.leader(key)] = value
-
-    def leader(self, node):
-        if self._leader[node] != node:
-            self._leader[node] = self.leader(self._leader[node])
-
-        return self._leader[node]
-
-    def merge(self, node1, node2, value_merger):
-        lead1 = self.leader(node1)
-        lead2 = self.leader(node2)
+    def __len__(self):
+        return len(self._leader)
+
+    def add(self, value):
+        i = len(self._leader)
+        self._leader.append(i)
+        self._followers[i] = [i]
+        self._values[i] = value
+        return i
+
+    def __getitem__(self, i):
+        return self._values[self.leader(i)]
+
+    def __setitem__(self, i, value):
+        self._values[self.leader(i)] = value
+
+    def leader(self, i):
+        leader = self._leader
+        root = i
+        while leader[root] != root:
+            root = leader[root]
+        # Path compression
+        while leader[i] != root:
+            leader[i], i = root, leader[i]
+        return root
+
+    def merge(self, i1, i2, value_merger):
+        lead1 = self.leader(i1)
+        lead2 = self.leader(i2)
         if lead1 == lead2:
             return
         merged_value = value_merger(self._values.pop(lead1), self._values.pop(lead2))
-        if len(self._followers[lead1]) >= len(self._followers[lead2]):
-            self._leader[lead2] = lead1
-            self._followers[lead1].extend(self._followers.pop(lead2))
-            self._values[lead1] = merged_value
-        else:
-            self._leader[lead1] = lead2
-            self._followers[lead2].extend(self._followers.pop(lead1))
-            self._values[lead2] = merged_value
-
-    def group(self, node):
-        return tuple(self._followers[self.leader(node)])
+        if len(self._followers[lead1]) < len(self._followers[lead2]):
+            lead1, lead2 = lead2, lead1
+        self._leader[lead2] = lead1
+        self._followers[lead1].extend(self._followers.pop(lead2))
+        self._values[lead1] = merged_value
 
-    def keys(self):
-        return list(self._leader.keys())
+    def group(self, i):
+        return self._followers[self.leader(i)]
 
 
 class Topo(object):
     """
-    Node states: (a) added (in _dsu) -> (s) scheduled (in _scheduled) -> (c) completed (in _completed).
+    Node states: (a) added (has id) -> (s) scheduled (_scheduled[id]) -> (c) completed (_completed[id]).
     Dependencies can be only updated in (a).
 
-    Node is in (c) if all nodes in its set from _dsu called notify_dependants, or _dsu[node] == 0.
+    Node is in (c) if all nodes in its set from _dsu called notify_dependants, or _dsu[id] == 0.
     Action from _when_ready should be performed only when the node is in (s) and its dependencies are in (c).
     For each node _when_ready should be performed once.
 
     For convenience, node called notify_dependants is called semi-completed (sc).
     When last node in node's set calls notify, all of them become completed (c).
     notify_dependants should be called once for each node and when node is in (s) from _when_ready.
+
+    Nodes are assigned dense integer ids on add_node, all per-node state is kept in flat lists indexed by id.
     """
 
     def __init__(self):
-        self._deps = collections.defaultdict(list)
-        self._who_awaits = collections.defaultdict(list)
-        # All dependencies are fixed, and all dependants are notified.
-        self._completed = set()
+        self._ids = {}
+        self._nodes = []
+        self._deps = []
+        self._who_awaits = []
+        # Number of not completed dependencies
+        self._awaiting = []
         # All dependencies are fixed, scheduled.
-        self._scheduled = set()
+        self._scheduled = bytearray()
+        # All dependencies are fixed, and all dependants are notified.
+        self._completed = bytearray()
         self._lock = threading.RLock()
         self._when_ready = {}
         self._dsu = DisjointSet()
-        self._awaiting = {}
         self._activation_order = []
 
     def __contains__(self, item):
         with self._lock:
-            return item in self._dsu
+            return item in self._ids
 
     def is_completed(self, node):
         with self._lock:
-            return node in self._completed
+            i = self._ids.get(node)
+            return i is not None and bool(self._completed[i])
 
     def add_node(self, node):
         with self._lock:
-            if node in self._dsu:
+            if node in self._ids:
                 return
-            self._dsu[node] = 1
-            self._who_awaits[node] = []
-            self._awaiting[node] = 0
+            i = self._dsu.add(1)
+            self._ids[node] = i
+            self._nodes.append(node)
+            self._deps.append([])
+            self._who_awaits.append([])
+            self._awaiting.append(0)
+            self._scheduled.append(0)
+            self._completed.append(0)
 
     def add_deps(self, from_node, *to_nodes):
         with self._lock:
+            assert from_node in self._ids, "Node {} is not in DSU".format(from_node)  # check existence
+            i = self._ids[from_node]
+            assert not self._scheduled[i], "Node {} has been already scheduled".format(from_node)
+
+            deps = self._deps[i]
             for to_node in to_nodes:
-                assert to_node in self._dsu, "Node {} is not in DSU".format(to_node)  # check existence
-                assert from_node in self._dsu, "Node {} is not in DSU".format(from_node)  # check existence
-                assert from_node not in self._scheduled, "Node {} has been already scheduled".format(from_node)
+                assert to_node in self._ids, "Node {} is not in DSU".format(to_node)  # check existence
+                j = self._ids[to_node]
 
-                self._deps[from_node].append(to_node)
+                deps.append(j)
 
-                if to_node not in self._completed:
-                    self._who_awaits[to_node].append(from_node)
-                    self._awaiting[from_node] += 1
+                if not self._completed[j]:
+                    self._who_awaits[j].append(i)
+                    self._awaiting[i] += 1
 
     def merge_nodes(self, node1, node2):
         with self._lock:
-            assert node1 not in self._completed
-            assert node2 not in self._completed
-            self._dsu.merge(node1, node2, lambda x, y: x + y)
+            i1 = self._ids[node1]
+            i2 = self._ids[node2]
+            assert not self._completed[i1]
+            assert not self._completed[i2]
+            self._dsu.merge(i1, i2, lambda x, y: x + y)
 
     def schedule_node(self, node, when_ready=None, inplace_execution=False):
         with self._lock:
-            assert node in self._dsu
-            assert node not in self._scheduled
+            assert node in self._ids
+            i = self._ids[node]
+            assert not self._scheduled[i]
 
             if when_ready:
-                self._when_ready[node] = when_ready
-            self._scheduled.add(node)
-            action = self._check_ready(node, inplace_execution=inplace_execution)
+                self._when_ready[i] = when_ready
+            self._scheduled[i] = 1
+            action = self._check_ready(i, inplace_execution=inplace_execution)
 
         if action:
             action()
@@ -127,15 +151,20 @@ class Topo(object):
         actions = []
 
         with self._lock:
-            self._dsu[node] -= 1
-            if self._dsu[node] == 0:
-                self._activation_order.append(self._dsu.group(node))
-                for y in self._dsu.group(node):
-                    self._completed.add(y)
+            i = self._ids[node]
+            left = self._dsu[i] - 1
+            self._dsu[i] = left
+            if left == 0:
+                group = tuple(self._dsu.group(i))
+                self._activation_order.append(group)
+                awaiting = self._awaiting
+                scheduled = self._scheduled
+                for y in group:
+                    self._completed[y] = 1
                     for x in self._who_awaits[y]:
-                        self._awaiting[x] -= 1
+                        awaiting[x] -= 1
                         # Redundant: _when_ready is set in schedule_node and reset in _check_ready
-                        if x not in self._scheduled:
+                        if not scheduled[x]:
                             continue
 
                         action = self._check_ready(x)
@@ -146,31 +175,61 @@ class Topo(object):
         for action in actions:
             action()
 
-    def _iter_deps(self, node):
-        for x in self._deps[node]:
+    def _iter_deps(self, i):
+        nodes = self._nodes
+        for x in self._deps[i]:
             for y in self._dsu.group(x):
-                yield y
+                yield nodes[y]
 
-    def _check_ready(self, node, inplace_execution=False):
-        assert self._awaiting[node] >= 0
+    def _check_ready(self, i, inplace_execution=False):
+        assert self._awaiting[i] >= 0
 
-        with self._lock:
-            if self._awaiting[node] != 0:
-                return
+        if self._awaiting[i] != 0:
+            return
 
-            if node in self._when_ready:
-                func = self._when_ready.pop(node)
-                if inplace_execution:
-                    return lambda: func(node, list(self._iter_deps(node)), inplace_execution=inplace_execution)
-                else:
-                    return lambda: func(node, list(self._iter_deps(node)))
+        func = self._when_ready.pop(i, None)
+        if func is not None:
+            node = self._nodes[i]
+            if inplace_execution:
+                return lambda: func(node, list(self._iter_deps(i)), inplace_execution=inplace_execution)
+            else:
+                return lambda: func(node, list(self._iter_deps(i)))
 
     def replay(self):
         for g in self._activation_order:
-            yield [(x, list(self._iter_deps(x))) for x in g]
+            yield [(self._nodes[x], list(self._iter_deps(x))) for x in g]
 
     def get_unscheduled(self):
-        return set(self._dsu.keys()) - self._scheduled
+        return set(node for node, scheduled in zip(self._nodes, self._scheduled) if not scheduled)
 
     def get_uncompleted(self):
-        return set(self._dsu.keys()) - self._completed
+        return set(node for node, completed in zip(self._nodes, self._completed) if not completed)
+
+
+if __name__ == '__main__':
+    import time
+
+    qty = 500000
+    width = 8
+
+    t1 = time.time()
+    tp = Topo()
+    for x in range(qty):
+        tp.add_node(x)
+        tp.add_deps(x, *range(max(0, x - width), x))
+
+    t2 = time.time()
+    ready = []
+    for x in range(qty):
+        tp.schedule_node(x, when_ready=lambda node, deps: ready.append(node))
+
+    t3 = time.time()
+    while ready:
+        tp.notify_dependants(ready.pop())
+
+    t4 = time.time()
+
+    assert not tp.get_uncompleted()
+    print('per one add (us)', 1000000.0 * (t2 - t1) / qty)
+    print('per one schedule (us)', 1000000.0 * (t3 - t2) / qty)
+    print('per one notify (us)', 1000000.0 * (t4 - t3) / qty)
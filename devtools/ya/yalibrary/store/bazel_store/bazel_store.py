@@ -1,11 +1,15 @@
 import binascii
+import collections
 import hashlib
 import json
 import json.decoder as json_decoder
 import logging
 import os
 import os.path as os_path
+import threading
+import library.python.fs as fs
 import library.python.retry as retry
+from multiprocessing.pool import ThreadPool
 
 import requests
 import requests.adapters
@@ -13,13 +17,18 @@ import requests.auth
 from six.moves.urllib import parse
 
 from exts.func import memoize
+from exts import digest_cache
 from exts import hashing
 from yalibrary.store.dist_store import DistStore
 import zstandard as zstd
 
 DOWNLOAD_CHUNK_SIZE = 1 << 15
+# Max number of blobs of a single node transferred simultaneously
+NODE_TRANSFER_CONCURRENCY = 8
 META_VERSION = '1'
 SHA256_LENGTH = 64
+# Max number of digests of the blobs known to be present in the CAS remembered by the client
+KNOWN_BLOBS_LIMIT = 100000
 
 EXCLUDED_P = frozenset(['UN', 'PK', 'GO', 'ld', 'SB', 'CP', 'DL'])
 
@@ -120,9 +129,89 @@ class StreamWriter:
         return self._inner_writer.get_hexdigest()
 
 
+class TransferPool(object):
+    """
+    Runs blob transfers in parallel.
+    Global concurrency is bounded by the pool size (one thread per http connection),
+    per-node concurrency is bounded by node_concurrency.
+    """
+
+    def __init__(self, size, node_concurrency=NODE_TRANSFER_CONCURRENCY):
+        self._size = size
+        self._node_concurrency = max(1, min(node_concurrency, size))
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self._size)
+            return self._pool
+
+    def map(self, func, items):
+        """
+        Apply func to every item and return results in the items order.
+        On failure the transfers which are not started yet are skipped,
+        the ones in flight are awaited and the error of the first failed item (in items order) is raised.
+        """
+        if len(items) <= 1 or self._size <= 1:
+            return [func(item) for item in items]
+
+        pool = self._get_pool()
+        node_sem = threading.BoundedSemaphore(self._node_concurrency)
+        failed = threading.Event()
+
+        def run(item):
+            try:
+                if failed.is_set():
+                    return None, True
+                try:
+                    return func(item), False
+                except Exception:
+                    failed.set()
+                    raise
+            finally:
+                node_sem.release()
+
+        pending = []
+        for item in items:
+            node_sem.acquire()
+            if failed.is_set():
+                node_sem.release()
+                break
+            pending.append(pool.apply_async(run, (item,)))
+
+        results = []
+        error = None
+        for res in pending:
+            try:
+                value, skipped = res.get()
+                if not skipped:
+                    results.append(value)
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+        return results
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+
 class BazelStoreClient(object):
-    def __init__(self, base_uri, username=None, password=None, max_connections=48):
+    def __init__(self, base_uri, username=None, password=None, max_connections=48, digest_cache_file=None):
         self.base_uri = base_uri
+        self._transfers = TransferPool(max_connections)
+        self._digest_cache = digest_cache.DigestCache(digest_cache_file)
+        # Digests of the blobs which are known to be present in the CAS, least recently used first
+        self._known_blobs = collections.OrderedDict()
+        self._known_blobs_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.skipped_upload_size = 0
         self.session = requests.Session()
         adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
         self.session.mount('http://', adapter)
@@ -158,7 +247,8 @@ class BazelStoreClient(object):
         cas_url = self._cas_url(hash)
         dirname = os_path.dirname(file_path)
         if not os_path.exists(dirname):
-            os.makedirs(dirname)
+            # Blobs of a single node are downloaded concurrently
+            fs.ensure_dir(dirname)
         codec = self.get_codec()
         headers = {'Accept-Encoding': codec}
         digest_got = self._retry_func(
@@ -171,9 +261,47 @@ class BazelStoreClient(object):
                 hash,
             )
 
-    def put_blob(self, file_path):
-        hashstr = hashing.file_hash(file_path, hashlib.sha256())
-        size = os.stat(file_path).st_size
+    def _is_known_blob(self, hash):
+        with self._known_blobs_lock:
+            if hash not in self._known_blobs:
+                return False
+            self._known_blobs[hash] = self._known_blobs.pop(hash)
+            return True
+
+    def _add_known_blob(self, hash):
+        with self._known_blobs_lock:
+            self._known_blobs.pop(hash, None)
+            self._known_blobs[hash] = True
+            if len(self._known_blobs) > KNOWN_BLOBS_LIMIT:
+                self._known_blobs.popitem(last=False)
+
+    def blob_exists(self, hash, probe=True):
+        if self._is_known_blob(hash):
+            return True
+        if not probe:
+            return False
+        response = self.session.head(self._cas_url(hash))
+        if response.status_code == 200:
+            self._add_known_blob(hash)
+            return True
+        if response.status_code != 404:
+            # Not a miss: fail, so the probe is retried along with the upload by the caller's retry
+            raise BazelStoreException('Failed to probe blob %s, status_code %d', hash, response.status_code)
+        return False
+
+    def put_blob(self, file_path, probe=True):
+        """
+        Upload the file to the CAS unless it's known to be there, the CAS is asked for it only if probe is set.
+        Should be called with the write retry policy which covers both the probe and the upload.
+        """
+        stat = os.stat(file_path)
+        size = stat.st_size
+        hashstr = self._digest_cache.get(file_path, lambda path: hashing.file_hash(path, hashlib.sha256()), stat)
+
+        if self.blob_exists(hashstr, probe):
+            with self._stats_lock:
+                self.skipped_upload_size += size
+            return hashstr
 
         cas_url = self._cas_url(hashstr)
         if size == 0:
@@ -188,6 +316,7 @@ class BazelStoreClient(object):
                 file_path,
                 response.status_code,
             )
+        self._add_known_blob(hashstr)
         return hashstr
 
     def put_meta(self, uid, meta):
@@ -205,21 +334,32 @@ class BazelStoreClient(object):
             raise BazelStoreException('Broken metadata for UID `%s`', uid)
         return result
 
-    def put_data(self, files, root_dir, uid, name):
+    def _put_file(self, file, probe=True):
+        stat = os.stat(file)
+        return {
+            'hash': self._retry_func(
+                self.put_blob, f_args=(os_path.abspath(file), probe), conf=BAZEL_RETRY_POLICY.get_write_conf()
+            ),
+            'executable': os.access(file, os.X_OK),
+            'mode': stat.st_mode,
+            'size': stat.st_size,
+        }
+
+    def put_data(self, files, root_dir, uid, name, probe_blobs=True):
+        """
+        Upload files and the uid metadata.
+        When the uid is known to be missing in the AC, its blobs are unlikely to be in the CAS,
+        so probe_blobs=False uploads them without asking the CAS first (saves a round trip per blob).
+        """
         result = {'files': {}, 'name': name}
-        for file in sorted(files):
+        files = sorted(files)
+        for file in files:
             if not file.startswith(root_dir):
                 raise BazelStoreException('File is outside of rootpath')
 
-            stat = os.stat(file)
-            result['files'][os_path.relpath(file, root_dir)] = {
-                'hash': self._retry_func(
-                    self.put_blob, f_args=(os_path.abspath(file),), conf=BAZEL_RETRY_POLICY.get_write_conf()
-                ),
-                'executable': os.access(file, os.X_OK),
-                'mode': stat.st_mode,
-                'size': stat.st_size,
-            }
+        uploads = self._transfers.map(lambda file: self._put_file(file, probe_blobs), files)
+        for file, file_data in zip(files, uploads):
+            result['files'][os_path.relpath(file, root_dir)] = file_data
         self._retry_func(self.put_meta, f_args=(uid, result), conf=BAZEL_RETRY_POLICY.get_write_conf())
         return result
 
@@ -227,15 +367,19 @@ class BazelStoreClient(object):
         self.get_blob(file_data['hash'], file_path)
         os.chmod(file_path, file_data['mode'])
 
-    def get_data(self, root_dir, uid, filter_func=None):
-        meta = self.get_meta(uid)
+    def get_data(self, root_dir, uid, filter_func=None, meta=None):
+        if meta is None:
+            meta = self.get_meta(uid)
         if filter_func is None:
             filter_func = always_false
 
-        for rel_path, file_data in meta['files'].items():
+        downloads = []
+        for rel_path, file_data in sorted(meta['files'].items()):
             file_path = os_path.join(root_dir, rel_path)
             if not filter_func(file_path, self._cas_url(file_data['hash'])):
-                self.download_file(file_path, file_data)
+                downloads.append((file_path, file_data))
+
+        self._transfers.map(lambda args: self.download_file(*args), downloads)
         return meta
 
     def exists(self, uid):
@@ -257,6 +401,11 @@ class BazelStore(DistStore):
         )
         self._client = BazelStoreClient(*args, **kwargs)
         self._disabled = False
+        self._prefetch_threads = kwargs.get('max_connections', 48)
+        # uid -> found, filled by load_meta() in background
+        self._probed = {}
+        # uid -> metadata fetched by load_meta() in heater mode, consumed by restore
+        self._prefetched_meta = {}
 
     def _get_data_size(self, meta_info):
         return sum(x.get('size', 0) for x in meta_info['files'].values())
@@ -297,20 +446,60 @@ class BazelStore(DistStore):
         return True
 
     def load_meta(self, uids, heater_mode=False, refresh_on_read=False):
-        # Meta preloading is no required for bazel store
-        return
+        if self._disabled or not uids:
+            return
+        # Probe uids in background, has() falls back to synchronous request for not yet probed uids
+        thread = threading.Thread(target=self._prefetch_meta, args=(list(uids), heater_mode), name='BazelPrefetch')
+        thread.daemon = True
+        thread.start()
+
+    def _fetch_meta(self, uid):
+        try:
+            self._prefetched_meta[uid] = self._client.get_meta(uid)
+            return True
+        except BazelStoreException:
+            return False
+
+    def _prefetch_meta(self, uids, heater_mode):
+        # Heater restores every found uid, so metadata is fetched right away instead of probing:
+        # a single request per uid instead of a probe and a metadata request on restore
+        check = self._fetch_meta if heater_mode else self._client.exists
+
+        def probe(uid):
+            if self._disabled or uid in self._probed:
+                return uid, None
+            try:
+                return uid, check(uid)
+            except BazelStoreBrokenException:
+                return uid, None
+
+        pool = ThreadPool(self._prefetch_threads)
+        try:
+            probed = 0
+            for uid, found in pool.imap_unordered(probe, uids):
+                if found is not None:
+                    self._probed[uid] = found
+                    probed += 1
+            logger.debug('Bazel-remote prefetched %d of %d uids', probed, len(uids))
+        except Exception:
+            logger.exception('Bazel-remote prefetch failed')
+        finally:
+            pool.close()
 
     @memoize(thread_safe=False)
     def _do_has(self, uid):
         if self._disabled:
             return False
 
-        try:
-            found = self._client.exists(uid)
-        except BazelStoreBrokenException:
-            found = False
-            self._disable_store()
+        found = self._probed.get(uid)
+        if found is None:
+            try:
+                found = self._client.exists(uid)
+            except BazelStoreBrokenException:
+                found = False
+                self._disable_store()
         logger.debug('Bazel-remote Probing %s => %s', uid, found)
+        self._probed[uid] = found
         self._inc_cache_hit(found)
         return found
 
@@ -325,7 +514,7 @@ class BazelStore(DistStore):
             logger.debug('Put %s(%s) to Bazel-remote completed(no-op)', name, uid)
             return True
         try:
-            meta = self._client.put_data(files, root_dir, uid, name)
+            meta = self._client.put_data(files, root_dir, uid, name, probe_blobs=self._probed.get(uid) is not False)
             self._meta[uid] = meta
         except BazelStoreException as e:
             logger.debug('Put %s(%s) to Bazel-remote failed: %s', name, uid, e)
@@ -340,12 +529,19 @@ class BazelStore(DistStore):
         self._inc_data_size(data_size, 'put')
         return True
 
+    def stats(self, execution_log, evlog_writer):
+        super(BazelStore, self).stats(execution_log, evlog_writer)
+        execution_log['$({}-put-skipped-data-size)'.format(self._name)] = {
+            'data_size': self._client.skipped_upload_size,
+            'type': self._name,
+        }
+
     def _do_try_restore(self, uid, into_dir, filter_func=None):
         if self._disabled:
             return False
 
         try:
-            meta = self._client.get_data(into_dir, uid, filter_func)
+            meta = self._client.get_data(into_dir, uid, filter_func, meta=self._prefetched_meta.pop(uid, None))
         except BazelStoreException:
             self._count_failure('get')
             return False
@@ -360,3 +556,91 @@ class BazelStore(DistStore):
     @property
     def avg_compression_ratio(self):
         return 1.0
+
+
+if __name__ == '__main__':
+    import shutil
+    import tempfile
+    import time
+
+    from six.moves import BaseHTTPServer, socketserver
+
+    # Round trip time emulated by the stand-in server
+    latency = 0.005
+    qty = 64
+    file_size = 64 * 1024
+
+    blobs = {}
+
+    class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        """In-memory stand-in of bazel-remote http API: /ac/<key> and /cas/<sha256>"""
+
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, code, body=b''):
+            time.sleep(latency)
+            self.send_response(code)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def do_HEAD(self):
+            self._reply(200 if self.path in blobs else 404)
+
+        def do_GET(self):
+            if self.path not in blobs:
+                return self._reply(404)
+            data = blobs[self.path]
+            if self.path.startswith('/cas/'):
+                data = zstd.ZstdCompressor().compress(data)
+            self._reply(200, data)
+
+        def do_PUT(self):
+            blobs[self.path] = self.rfile.read(int(self.headers['Content-Length']))
+            self._reply(200)
+
+    class StandInServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server_thread = threading.Thread(target=server.serve_forever, name='BazelRemoteStandIn')
+    server_thread.daemon = True
+    server_thread.start()
+    base_uri = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        src_dir = os.path.join(work_dir, 'src')
+        files = []
+        for x in range(qty):
+            path = os.path.join(src_dir, 'out', str(x))
+            fs.ensure_dir(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(file_size))
+            files.append(path)
+
+        for connections in 1, 48:
+            blobs.clear()
+            client = BazelStoreClient(base_uri, max_connections=connections)
+            uid = 'bench-{}'.format(connections)
+
+            t1 = time.time()
+            client.put_data(files, src_dir, uid, 'bench')
+            t2 = time.time()
+            client.get_data(os.path.join(work_dir, uid), uid)
+            t3 = time.time()
+            client.put_data(files, src_dir, uid + '-again', 'bench')
+            t4 = time.time()
+
+            client._transfers.close()
+            print('connections', connections)
+            print('  put_data (ms)', 1000.0 * (t2 - t1))
+            print('  get_data (ms)', 1000.0 * (t3 - t2))
+            print('  put_data of known blobs (ms)', 1000.0 * (t4 - t3))
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir)
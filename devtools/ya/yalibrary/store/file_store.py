@@ -104,7 +104,7 @@ class Store(object):
         tmp_path = self._gen_tmp_path()
 
         if codec:
-            compress.compress(path, tmp_path, codec=codec)
+            compress.compress(path, tmp_path, codec=codec, index=True)
         else:
             hardlink(path, tmp_path)
 
@@ -1,10 +1,16 @@
-import struct
 import errno
+import logging
+import mmap
 import os
+import struct
+import threading
 import six
 
+from exts import filelock
 from exts import fs
 
+logger = logging.getLogger(__name__)
+
 
 def open_file(fname, size):
     fs.create_dirs(os.path.dirname(fname))
@@ -30,48 +36,224 @@ def open_file(fname, size):
 
 
 class OpenHashMap(object):
-    def __init__(self, mm, fmt):
-        self._mm = mm
-        self._fmt = 'Q' + fmt
+    """
+    mmap-backed hash map with linear probing.
+    Only 64-bit hashes of the keys are stored, slot with zero hash is empty, slot with hash 1 is a tombstone.
+    File layout: header (magic, buckets, used, tombstones, moved), then buckets of (hash, values...).
+    The table is rehashed into a new file when load factor exceeds MAX_LOAD,
+    other processes mapping the old file are notified with the 'moved' flag and reopen the table.
+    Files of the previous format (no header, one entry per bucket) are converted on open,
+    tables of other header versions are reset with a warning.
+    Modifications take a file lock, so counters and rehashing are consistent between processes.
+    """
+
+    MAGIC = b'YAHMAP02'
+    HEADER_FMT = '<8sQQQQ'
+    HEADER_SIZE = struct.calcsize(HEADER_FMT)
+    MAX_LOAD = 0.7
+
+    EMPTY = 0
+    TOMBSTONE = 1
+
+    def __init__(self, fname, fmt, buckets):
+        self._fname = fname
+        self._fmt = '<Q' + fmt
         self._item_size = struct.calcsize(self._fmt)
-        self._buckets = len(self._mm) // self._item_size
+        self._f = None
+        self._mm = None
+        self._lock = threading.Lock()
+        self._file_lock = filelock.FileLock(fname + '.lock')
+        with self._file_lock:
+            self._open(buckets)
 
     @staticmethod
     def _hash(key):
         import cityhash
 
-        return cityhash.hash64(six.ensure_binary(key))
+        h = cityhash.hash64(six.ensure_binary(key))
+        # 0 and 1 are reserved for empty and deleted slots
+        return h if h > OpenHashMap.TOMBSTONE else h + 2
+
+    def _file_size(self, buckets):
+        return self.HEADER_SIZE + buckets * self._item_size
+
+    def _open(self, buckets):
+        self._f = open_file(self._fname, self._file_size(buckets))
+        self._mm = mmap.mmap(self._f.fileno(), 0)
+        magic, self._buckets = struct.unpack_from('<8sQ', self._mm, 0)
+        if magic == self.MAGIC:
+            return
+
+        size = len(self._mm)
+        zero_header = self._mm[: self.HEADER_SIZE] == b'\0' * self.HEADER_SIZE
+        if zero_header and (size - self.HEADER_SIZE) % self._item_size == 0:
+            # Just created
+            self._buckets = (size - self.HEADER_SIZE) // self._item_size
+            struct.pack_into(self.HEADER_FMT, self._mm, 0, self.MAGIC, self._buckets, 0, 0, 0)
+            return
+
+        if magic.startswith(self.MAGIC[:-2]):
+            logger.warning("Reset %s: unsupported table version %r", self._fname, magic)
+            self._rehash(buckets, [])
+            return
+
+        # Previous format: table without header
+        legacy = list(self._iter_slots(self._mm, 0, size // self._item_size))
+        logger.debug("Convert headerless table %s, %d entries", self._fname, len(legacy))
+        self._rehash(max(buckets, int(len(legacy) / self.MAX_LOAD) + 1), legacy)
+
+    def _close_mapping(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def close(self):
+        with self._lock:
+            self._mm.flush()
+            self._close_mapping()
+
+    def _iter_slots(self, mm, start, buckets):
+        for i in six.moves.xrange(buckets):
+            values = struct.unpack_from(self._fmt, mm, start + i * self._item_size)
+            if values[0] > self.TOMBSTONE:
+                yield values
 
-    def _offset(self, hash):
-        return hash % self._buckets * self._item_size
+    def _rehash(self, buckets, entries):
+        """Write entries into a new table of given size and atomically replace the file"""
+        temp = "{}.{}.tmp".format(self._fname, os.getpid())
+        size = self._file_size(buckets)
+        with open(temp, 'w+b') as f:
+            f.seek(size - 1)
+            f.write(b'\0')
+            f.flush()
+            mm = mmap.mmap(f.fileno(), 0)
+            try:
+                used = 0
+                for values in entries:
+                    offset = self._probe_free(mm, buckets, values[0])
+                    struct.pack_into(self._fmt, mm, offset, *values)
+                    used += 1
+                struct.pack_into(self.HEADER_FMT, mm, 0, self.MAGIC, buckets, used, 0, 0)
+                mm.flush()
+            finally:
+                mm.close()
+        os.rename(temp, self._fname)
+
+        if self._mm is not None and len(self._mm) >= self.HEADER_SIZE:
+            # Notify other processes which still map the old table
+            struct.pack_into('<Q', self._mm, self.HEADER_SIZE - 8, 1)
+        self._close_mapping()
+        self._f = open(self._fname, "r+b")
+        self._mm = mmap.mmap(self._f.fileno(), 0)
+        self._buckets = buckets
+
+    def _probe_free(self, mm, buckets, h):
+        i = h % buckets
+        while True:
+            offset = self.HEADER_SIZE + i * self._item_size
+            if struct.unpack_from('<Q', mm, offset)[0] == self.EMPTY:
+                return offset
+            i = (i + 1) % buckets
+
+    def _check_moved(self):
+        if struct.unpack_from('<Q', self._mm, self.HEADER_SIZE - 8)[0]:
+            self._close_mapping()
+            self._f = open(self._fname, "r+b")
+            self._mm = mmap.mmap(self._f.fileno(), 0)
+            self._buckets = struct.unpack_from('<8sQ', self._mm, 0)[1]
+
+    def _counters(self):
+        return struct.unpack_from('<QQ', self._mm, 16)
+
+    def _set_counters(self, used, tombstones):
+        struct.pack_into('<QQ', self._mm, 16, max(used, 0), max(tombstones, 0))
+
+    def _find(self, h):
+        """Return (offset of the key or None, offset of the first free slot suitable for insertion)"""
+        buckets = self._buckets
+        i = h % buckets
+        free = None
+        for _ in six.moves.xrange(buckets):
+            offset = self.HEADER_SIZE + i * self._item_size
+            slot = struct.unpack_from('<Q', self._mm, offset)[0]
+            if slot == h:
+                return offset, None
+            if slot == self.EMPTY:
+                return None, offset if free is None else free
+            if slot == self.TOMBSTONE and free is None:
+                free = offset
+            i = (i + 1) % buckets
+        return None, free
+
+    def __len__(self):
+        with self._lock:
+            self._check_moved()
+            return self._counters()[0]
 
     def __iter__(self):
-        for i in six.moves.xrange(self._buckets):
-            values = self._get_from(i * self._item_size)
-            if values[0] != 0:
-                yield values[1:]
+        with self._lock:
+            self._check_moved()
+            entries = list(self._iter_slots(self._mm, self.HEADER_SIZE, self._buckets))
+        for values in entries:
+            yield values[1:]
+
+    def _set(self, h, values):
+        offset, free = self._find(h)
+        if offset is None:
+            used, tombstones = self._counters()
+            if free is None or used + tombstones + 1 > self._buckets * self.MAX_LOAD:
+                self._grow(used)
+                offset, free = self._find(h)
+                used, tombstones = self._counters()
+            if struct.unpack_from('<Q', self._mm, free)[0] == self.TOMBSTONE:
+                tombstones -= 1
+            offset = free
+            self._set_counters(used + 1, tombstones)
+        struct.pack_into(self._fmt, self._mm, offset, h, *values)
+
+    def _grow(self, used):
+        entries = list(self._iter_slots(self._mm, self.HEADER_SIZE, self._buckets))
+        # Grow only if the table is full of live entries, otherwise just drop tombstones
+        buckets = self._buckets * 2 if used + 1 > self._buckets * self.MAX_LOAD / 2 else self._buckets
+        self._rehash(buckets, entries)
 
     def __setitem__(self, key, values):
         h = self._hash(key)
-        offset = self._offset(h)
-        struct.pack_into(self._fmt, self._mm, offset, h, *values)
+        with self._lock, self._file_lock:
+            self._check_moved()
+            self._set(h, values)
 
-    def _get_from(self, offset):
-        return struct.unpack_from(self._fmt, self._mm, offset)
+    def update(self, items):
+        """Batched __setitem__ for iterable of (key, values)"""
+        hashed = [(self._hash(key), values) for key, values in items]
+        with self._lock, self._file_lock:
+            self._check_moved()
+            for h, values in hashed:
+                self._set(h, values)
 
     def __getitem__(self, key):
-        h0 = self._hash(key)
-        offset = self._offset(h0)
-        values = self._get_from(offset)
-        h, values = values[0], values[1:]
-        if h != h0:
-            raise KeyError
-        return values
+        h = self._hash(key)
+        with self._lock:
+            self._check_moved()
+            offset, _ = self._find(h)
+            if offset is None:
+                raise KeyError(key)
+            return struct.unpack_from(self._fmt, self._mm, offset)[1:]
 
     def __delitem__(self, key):
         h = self._hash(key)
-        offset = self._offset(h)
-        self._mm[offset : offset + self._item_size] = b'\0' * self._item_size
+        with self._lock, self._file_lock:
+            self._check_moved()
+            offset, _ = self._find(h)
+            if offset is None:
+                return
+            struct.pack_into('<Q', self._mm, offset, self.TOMBSTONE)
+            used, tombstones = self._counters()
+            self._set_counters(used - 1, tombstones + 1)
 
     def flush(self):
-        self._mm.flush()
+        with self._lock:
+            self._mm.flush()
@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Eviction starts when the cache exceeds max size and frees space down to this fraction of it
+LOW_WATERMARK = 0.9
+# Max duration of a single eviction slice (seconds)
+SLICE_TIME = 0.05
+# Pause between slices, leaves the store to the build (seconds)
+SLICE_PAUSE = 0.2
+# Check interval when the cache fits into max size (seconds)
+IDLE_INTERVAL = 5.0
+
+
+class IncrementalGC(object):
+    """
+    Size-budgeted eviction of the least recently used entries of the local cache.
+    Work is split into short time-bounded slices, so eviction may run in the background concurrently with a build
+    instead of stopping the world to sieve the whole lru queue.
+    The cache must provide size() and evict(target_size, deadline, state) (see NewStore).
+    """
+
+    def __init__(
+        self,
+        cache,
+        max_cache_size,
+        low_watermark=LOW_WATERMARK,
+        slice_time=SLICE_TIME,
+        slice_pause=SLICE_PAUSE,
+        idle_interval=IDLE_INTERVAL,
+        state=None,
+    ):
+        self._cache = cache
+        self._max_cache_size = max_cache_size
+        self._target_size = int(max_cache_size * low_watermark)
+        self._slice_time = slice_time
+        self._slice_pause = slice_pause
+        self._idle_interval = idle_interval
+        self._state = state
+        self._evicting = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._slices = 0
+        self._removed = 0
+        self._bytes_freed = 0
+        self._total_time = 0.0
+        self._max_slice_time = 0.0
+        self._errors = 0
+
+    @staticmethod
+    def supported(cache):
+        return hasattr(cache, 'evict') and hasattr(cache, 'size')
+
+    def need_eviction(self):
+        size = self._cache.size()
+        # Hysteresis: once started, evict down to the low watermark
+        if self._evicting:
+            self._evicting = size > self._target_size
+        else:
+            self._evicting = size > self._max_cache_size
+        return self._evicting
+
+    def run_slice(self):
+        """Evict entries for at most slice_time seconds. Returns slice metrics."""
+        start = time.time()
+        removed, bytes_freed = self._cache.evict(self._target_size, start + self._slice_time, self._state)
+        duration = time.time() - start
+        with self._lock:
+            self._slices += 1
+            self._removed += removed
+            self._bytes_freed += bytes_freed
+            self._total_time += duration
+            self._max_slice_time = max(self._max_slice_time, duration)
+        logger.debug('GC slice: %d entries, %d bytes freed in %0.3fs', removed, bytes_freed, duration)
+        return {'duration': duration, 'removed': removed, 'bytes_freed': bytes_freed}
+
+    def run(self):
+        """Run slices until the cache size drops to the low watermark or stop() is called"""
+        while not self._stop.is_set() and self.need_eviction():
+            metrics = self.run_slice()
+            if not metrics['removed'] and metrics['duration'] < self._slice_time:
+                # Lru queue is exhausted before the deadline: nothing left to evict
+                break
+            self._stop.wait(self._slice_pause)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run()
+            except Exception:
+                self._errors += 1
+                logger.exception('Incremental cache GC failed')
+            self._stop.wait(self._idle_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='IncrementalGC')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'slices': self._slices,
+                'removed': self._removed,
+                'bytes_freed': self._bytes_freed,
+                'total_time': self._total_time,
+                'avg_slice_time': self._total_time / self._slices if self._slices else 0.0,
+                'max_slice_time': self._max_slice_time,
+                'errors': self._errors,
+                'cache_size': self._cache.size(),
+            }
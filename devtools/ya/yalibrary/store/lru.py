@@ -1,12 +1,51 @@
 from itertools import chain
+import datetime as dt
+import logging
 import os
 import time
 import threading
 
 import yalibrary.store.usage_map as usage_map
 
+from exts import fs
+from exts import filelock
 from yalibrary.chunked_queue import queue
 
+logger = logging.getLogger(__name__)
+
+# Journal is compacted when there are at least COMPACT_MIN_CHUNKS chunks older than COMPACT_MIN_AGE
+COMPACT_MIN_CHUNKS = 16
+COMPACT_MIN_AGE = dt.timedelta(hours=1)
+
+
+def parse_line(line):
+    key, stamp, id = line.split('|')
+    return key, int(stamp), int(id)
+
+
+def migrate_text_queue(text_queue_dir, journal_dir):
+    """Convert chunks of the text queue ('key|stamp|id' lines) into binary journal chunks with the same tags"""
+    data_dir = os.path.join(text_queue_dir, 'data')
+    if not os.path.isdir(data_dir):
+        return
+
+    journal_data_dir = os.path.join(journal_dir, 'data')
+    fs.create_dirs(journal_data_dir)
+    with filelock.FileLock(os.path.join(text_queue_dir, 'consume.lock')):
+        for chunk_name in sorted(os.listdir(data_dir)):
+            records = []
+            chunk_path = os.path.join(data_dir, chunk_name)
+            with open(chunk_path) as f:
+                for line in f:
+                    try:
+                        records.append(parse_line(line))
+                    except ValueError:
+                        pass
+            queue.Chunk(journal_data_dir, chunk_name, queue.RECORD_CODEC).write_all(records)
+            fs.remove_file(chunk_path)
+            logger.debug('Migrated %d records of lru chunk %s', len(records), chunk_name)
+    fs.remove_tree_safe(text_queue_dir)
+
 
 class Series(object):
     def __init__(self):
@@ -22,50 +61,47 @@ class Series(object):
 class LruQueue(object):
     def __init__(self, store_path, updater=None):
         self._usage = usage_map.UsageMap(os.path.join(store_path, 'usage'))
-        self._queue = queue.Queue(os.path.join(store_path, 'queue'))
+        journal_dir = os.path.join(store_path, 'journal')
+        migrate_text_queue(os.path.join(store_path, 'queue'), journal_dir)
+        self._queue = queue.Queue(journal_dir, queue.RECORD_CODEC)
         self._updater = updater
         if self._updater:
             # Postponed updates
-            self._update_queue = queue.Queue(os.path.join(store_path, 'queue'))
+            self._update_queue = queue.Queue(journal_dir, queue.RECORD_CODEC)
         self._series = Series()
 
     def touch(self, key, update_queue=None):
         stamp = int(time.time())
         id = self._series.next()
         self._usage.touch(key, stamp=stamp, id=id)
-        self._queue.push(key + '|' + str(stamp) + '|' + str(id))
+        self._queue.push((key, stamp, id))
         if update_queue and self._updater:
-            self._update_queue.push(key + '|' + str(stamp) + '|' + str(id))
+            self._update_queue.push((key, stamp, id))
+
+    def _is_last_usage(self, key, stamp, id):
+        last_usage, last_id = self._usage.last_usage(key)
+        return last_usage is None or last_usage == stamp and last_id == id
 
     def __action(self, consumer, value):
         """Wrapper for consumer to use in sieve, avoids double processing"""
-        try:
-            key, stamp, id = value.split('|')
-            stamp = int(stamp)
-            id = int(id)
-        except ValueError:
-            # TODO: logging
-            return
-        last_usage, last_id = self._usage.last_usage(key)
-        if last_usage is None or last_usage == stamp and last_id == id:
+        key, stamp, id = value
+        if self._is_last_usage(key, stamp, id):
             ret = consumer(stamp, key)
             yield key, stamp, ret
 
     def __strip_action(self, line_to_retain, value):
         """Wrapper for consumer to use in sieve, avoids double processing"""
-        try:
-            key, stamp, id = value.split('|')
-            stamp = int(stamp)
-            id = int(id)
-        except ValueError:
-            # TODO: logging
-            return
-        last_usage, last_id = self._usage.last_usage(key)
-        if last_usage is None or last_usage == stamp and last_id == id:
+        key, stamp, id = value
+        if self._is_last_usage(key, stamp, id):
             ret = line_to_retain(stamp, key)
             if ret:
                 yield value
 
+    def __compact_action(self, value):
+        """Drops records superseded by later touches"""
+        if self._is_last_usage(*value):
+            yield value
+
     def sieve(self, eraser, max_chunks=None):
         if self._updater:
             return chain(
@@ -87,6 +123,11 @@ class LruQueue(object):
         self._queue.flush()
         self._usage.flush()
 
+    def compact(self):
+        merged = self._queue.compact(self.__compact_action, COMPACT_MIN_CHUNKS, COMPACT_MIN_AGE)
+        if merged:
+            logger.debug('Compacted %d lru chunks', merged)
+
     # Should be synchronized externally
     def strip(self, uids_filter):
         return self._queue.strip(lambda value: self.__strip_action(uids_filter, value))
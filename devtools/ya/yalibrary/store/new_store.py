@@ -8,6 +8,7 @@ else:
 import exts.yjson as json
 import os
 import logging
+import threading
 import time
 
 import core.report
@@ -17,6 +18,7 @@ from exts.timer import AccumulateTime
 import yalibrary.store.file_store as file_store
 import yalibrary.store.lru as lru
 import yalibrary.store.size_store as size_store
+import yalibrary.store.uid_index as uid_index
 
 logger = logging.getLogger(__name__)
 
@@ -57,10 +59,15 @@ class NewStore(object):
             return 'P' + key[0], key[1:]
 
         self._file_store = file_store.Store(os.path.join(store_path, 'blob'))
-        self._uid_store = file_store.Store(os.path.join(store_path, 'uid'))
+        self._uid_store = uid_index.UidIndex(
+            os.path.join(store_path, 'uid_index', 'index.sqlite'),
+            legacy_store_path=os.path.join(store_path, 'uid'),
+        )
         self._lru = lru.LruQueue(os.path.join(store_path, 'lru'), touch_finalizer)
         self._size_store = size_store.SizeStore(os.path.join(store_path, 'size'))
         self._store_path = store_path
+        # Lru queue consumption is synchronized between processes only
+        self._sieve_lock = threading.Lock()
         logger.debug('Initialized store in %s', self._store_path)
 
         self.timers = {'has': 0, 'put': 0, 'get': 0, 'remove': 0}
@@ -114,6 +121,13 @@ class NewStore(object):
 
             return res
 
+    def has_many(self, uids):
+        with AccumulateTime(lambda x: self._inc_time(x, 'has')):
+            found = self._uid_store.has_many(uids)
+            for uid in found:
+                self._lru.touch(ItemType.UID + uid, update_queue=True)
+            return found
+
     @staticmethod
     def _rollback_if_need(uid, paths):
         if paths:
@@ -216,7 +230,8 @@ class NewStore(object):
 
         try:
             for x in self._lru.sieve(remover):
-                state.check_cancel_state()
+                if state is not None:
+                    state.check_cancel_state()
                 yield x
         except StopSieve:
             return
@@ -255,7 +270,29 @@ class NewStore(object):
                 return False
             return True
 
-        return list(self.sieve(stopper, state))
+        with self._sieve_lock:
+            removed = list(self.sieve(stopper, state))
+            self._lru.compact()
+        return removed
+
+    def evict(self, target_size, deadline, state=None):
+        """
+        Remove least recently used entries until the store size drops to target_size or time.time() reaches deadline.
+        Returns (number of removed entries, bytes freed).
+        Interrupted eviction is resumed by the next call from the first unprocessed lru record.
+        """
+
+        def stopper(stamp):
+            return self._size_store.size() <= target_size or time.time() >= deadline
+
+        with self._sieve_lock:
+            size_before = self._size_store.size()
+            if size_before <= target_size:
+                return 0, 0
+            removed = 0
+            for _ in self.sieve(stopper, state):
+                removed += 1
+        return removed, max(0, size_before - self._size_store.size())
 
     def convert(self, converter, state):
         """
@@ -0,0 +1,116 @@
+import logging
+import os
+import sqlite3
+import threading
+
+import exts.yjson as json
+from exts import fs
+
+from yalibrary.store.file_store import NotInCacheError
+
+
+logger = logging.getLogger(__name__)
+
+# Max number of sqlite host parameters in a single statement
+_BATCH_SIZE = 500
+# Number of uids of the legacy store imported in a single transaction
+_MIGRATION_BATCH_SIZE = 10000
+
+
+def _batches(items, size=_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class UidIndex(object):
+    """
+    uid -> metadata (json with files, hashes, modes and sizes) stored in a single sqlite database.
+    Drop-in replacement for file_store.Store used as uid store of NewStore.
+    """
+
+    def __init__(self, index_path, legacy_store_path=None):
+        fs.create_dirs(os.path.dirname(index_path))
+        self._index_path = index_path
+        self._lock = threading.Lock()
+        # Connection is shared by runner threads and guarded by self._lock
+        self._conn = sqlite3.connect(index_path, timeout=600, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS uids (uid TEXT PRIMARY KEY, meta TEXT NOT NULL) WITHOUT ROWID')
+
+        if legacy_store_path and os.path.isdir(legacy_store_path):
+            self._migrate(legacy_store_path)
+
+    def _migrate(self, legacy_store_path):
+        """One-time import of the uid store with one json file per uid"""
+        data_dir = os.path.join(legacy_store_path, 'data')
+        items = []
+        migrated = 0
+        for root, _, files in os.walk(data_dir):
+            for file_name in files:
+                try:
+                    with open(os.path.join(root, file_name)) as f:
+                        content = f.read()
+                    items.append((json.loads(content)['uid'], content))
+                except (IOError, ValueError, KeyError) as e:
+                    logger.debug('Skip broken uid file %s: %s', file_name, e)
+                if len(items) >= _MIGRATION_BATCH_SIZE:
+                    self.put_many(items)
+                    migrated += len(items)
+                    items = []
+
+        self.put_many(items)
+        migrated += len(items)
+        logger.debug('Migrated %d uids from %s to %s', migrated, legacy_store_path, self._index_path)
+        fs.remove_tree_safe(legacy_store_path)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def has(self, key):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM uids WHERE uid = ?', (key,)).fetchone() is not None
+
+    def has_many(self, keys):
+        keys = list(keys)
+        found = set()
+        with self._lock:
+            for batch in _batches(keys):
+                query = 'SELECT uid FROM uids WHERE uid IN ({})'.format(','.join('?' * len(batch)))
+                found.update(row[0] for row in self._conn.execute(query, batch))
+        return found
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT meta FROM uids WHERE uid = ?', (key,)).fetchone()
+        if row is None:
+            raise NotInCacheError('Cannot find item by "key" {} (probing {})'.format(key, self._index_path))
+        return row[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO uids (uid, meta) VALUES (?, ?)', (key, value))
+        return self._index_path
+
+    def put_many(self, items):
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.executemany('INSERT OR REPLACE INTO uids (uid, meta) VALUES (?, ?)', items)
+
+    def remove(self, key):
+        with self._lock:
+            return self._conn.execute('DELETE FROM uids WHERE uid = ?', (key,)).rowcount > 0
+
+    def clear_tray(self):
+        pass
+
+    # Only single-threaded context
+    def gc(self, ids_to_retain):
+        with self._lock:
+            to_remove = [(row[0],) for row in self._conn.execute('SELECT uid FROM uids') if row[0] not in ids_to_retain]
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.executemany('DELETE FROM uids WHERE uid = ?', to_remove)
+        logger.debug('Removed %d uids from %s', len(to_remove), self._index_path)
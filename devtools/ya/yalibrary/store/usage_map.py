@@ -1,31 +1,31 @@
 from __future__ import print_function
-import mmap
 import time
 import six
 from yalibrary.store import hash_map
 
 
 class UsageMap(object):
-    FILE_SIZE = 12 * 1003001
+    INITIAL_BUCKETS = 1 << 20
 
     def __init__(self, fname):
-        self._f = hash_map.open_file(fname, self.FILE_SIZE)
-        self._mm = mmap.mmap(self._f.fileno(), 0)
-        self._hmap = hash_map.OpenHashMap(self._mm, 'II')
+        self._hmap = hash_map.OpenHashMap(fname, 'II', self.INITIAL_BUCKETS)
 
     def close(self):
-        self._hmap.flush()
-        self._mm.close()
-        self._f.close()
+        self._hmap.close()
 
     def touch(self, key, stamp=None, id=0):
         if stamp is None:
-            stamp = time.time()
+            stamp = int(time.time())
         self._hmap[key] = (
             stamp,
             id,
         )
 
+    def touch_many(self, keys, stamp=None, id=0):
+        if stamp is None:
+            stamp = int(time.time())
+        self._hmap.update((key, (stamp, id)) for key in keys)
+
     def last_usage(self, key):
         try:
             return self._hmap[key]
@@ -38,9 +38,14 @@ class UsageMap(object):
 
 if __name__ == '__main__':
     import contextlib
+    import os
 
     qty = 1000000
 
+    for fname in 'out', 'out.batch':
+        if os.path.exists(fname):
+            os.unlink(fname)
+
     with contextlib.closing(UsageMap('out')) as mp:
         t1 = time.time()
 
@@ -51,10 +56,21 @@ if __name__ == '__main__':
 
         washed_away = 0
         for x in six.moves.xrange(qty):
-            washed_away += 1 if mp.last_usage(str(x)) is None else 0
+            washed_away += 1 if mp.last_usage(str(x)) == (None, None) else 0
 
         t3 = time.time()
 
         print('washed out (percent)', 100.0 * washed_away / qty)
         print('per one touch (ms)', 1000.0 * (t2 - t1) / qty)
         print('per one last_usage (ms)', 1000.0 * (t3 - t2) / qty)
+
+    with contextlib.closing(UsageMap('out.batch')) as mp:
+        batch = 1000
+        t1 = time.time()
+
+        for x in six.moves.xrange(0, qty, batch):
+            mp.touch_many(str(y) for y in six.moves.xrange(x, x + batch))
+
+        t2 = time.time()
+
+        print('per one touch_many item (ms)', 1000.0 * (t2 - t1) / qty)
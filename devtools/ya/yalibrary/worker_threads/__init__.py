@@ -4,6 +4,7 @@ import logging
 import threading
 import time
 
+import six
 import six.moves.queue as Queue
 from exts import asyncthread
 
@@ -40,26 +41,37 @@ class Action(object):
 
 
 class ResInfo(object):
-    def __init__(self, *args, **kwargs):
-        self.__d = dict(*args, **kwargs)
-        self._hash = hash(tuple(sorted(self.__d.items())))
+    __slots__ = ['__d', '_key', '_hash']
 
-    @staticmethod
-    def _iter(d1, d2):
-        for k in set(d1.keys()) | set(d2.keys()):
-            yield k, d1.get(k, 0), d2.get(k, 0)
+    def __init__(self, *args, **kwargs):
+        # Missing resource means zero usage, drop zeros to make equal infos hash equally
+        self.__d = dict((k, v) for k, v in six.iteritems(dict(*args, **kwargs)) if v)
+        self._key = tuple(sorted(self.__d.items()))
+        self._hash = hash(self._key)
 
     def __add__(self, other):
-        return ResInfo((k, v1 + v2) for k, v1, v2 in self._iter(self.__d, other.__d))
+        d = dict(self.__d)
+        for k, v in six.iteritems(other.__d):
+            d[k] = d.get(k, 0) + v
+        return ResInfo(d)
 
     def __sub__(self, other):
-        return ResInfo((k, v1 - v2) for k, v1, v2 in self._iter(self.__d, other.__d))
+        d = dict(self.__d)
+        for k, v in six.iteritems(other.__d):
+            d[k] = d.get(k, 0) - v
+        return ResInfo(d)
 
     def __le__(self, other):
-        return all(v1 <= v2 for _, v1, v2 in self._iter(self.__d, other.__d))
+        d1, d2 = self.__d, other.__d
+        return all(v <= d2.get(k, 0) for k, v in six.iteritems(d1)) and all(
+            0 <= v for k, v in six.iteritems(d2) if k not in d1
+        )
 
     def __eq__(self, other):
-        return all(v1 == v2 for _, v1, v2 in self._iter(self.__d, other.__d))
+        return self._key == other._key
+
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
         return self._hash
@@ -69,14 +81,23 @@ class ResInfo(object):
 
 
 class WorkerThreads(object):
+    # Limit on memoized (resource class, usage) -> fits entries
+    _FITS_CACHE_LIMIT = 1 << 16
+
     def __init__(self, state, threads, zero, cap, evlog):
         self._all_threads = []
         self._state = state
         self._out_q = Queue.Queue()
         self._active = 0
 
+        # resource class -> heap of (-prio, action)
         self._active_set = collections.defaultdict(list)
+        # Resource classes with non-empty heaps
+        self._ready = set()
         self._active_res_usage = [zero]
+        self._cap = cap
+        self._fits_cache = {}
+        self._idle = 0
         self._condition = threading.Condition(threading.Lock())
         self._evlog_writer = evlog.get_writer(__name__) if evlog else lambda *a, **kw: None
 
@@ -84,28 +105,30 @@ class WorkerThreads(object):
             def take_or_wait():
                 while self._state.check_cancel_state():
                     with self._condition:
-                        max_prio = None
-                        best_key = None
-                        for k, v in self._active_set.items():
-                            if v and k + self._active_res_usage[0] <= cap:
-                                if max_prio is None or max_prio < -v[0][0]:
-                                    max_prio = -v[0][0]
-                                    best_key = k
+                        best_key = self._best_fitting()
 
                         if best_key is not None:
+                            heap = self._active_set[best_key]
+                            prio, elem = heapq.heappop(heap)
+                            if not heap:
+                                self._ready.discard(best_key)
                             self._active_res_usage[0] += best_key
                             logger.debug('Active res usage %s', self._active_res_usage)
-                            _, elem = heapq.heappop(self._active_set[best_key])
-                            self._condition.notify()
-                            logger.debug('Found job %s %s with prio %s', best_key, elem, max_prio)
+                            logger.debug('Found job %s %s with prio %s', best_key, elem, -prio)
+                            # Pass the turn if something else can be started right now
+                            self._wake_up(1)
                             return best_key, elem
 
                         logger.debug(
-                            'Cannot find any job from %s', dict((k, len(v)) for k, v in self._active_set.items())
+                            'Cannot find any job from %s', dict((k, len(self._active_set[k])) for k in self._ready)
                         )
 
                         self._state.check_cancel_state()
-                        self._condition.wait()
+                        self._idle += 1
+                        try:
+                            self._condition.wait()
+                        finally:
+                            self._idle -= 1
 
             def execute():
                 while self._state.check_cancel_state():
@@ -114,7 +137,7 @@ class WorkerThreads(object):
                     with self._condition:
                         self._active_res_usage[0] -= res
                         logger.debug('Active res usage %s', self._active_res_usage)
-                        self._condition.notify()
+                        self._wake_up(self._idle)
 
             self._out_q.put(asyncthread.wrap(execute))
 
@@ -123,6 +146,42 @@ class WorkerThreads(object):
             exec_thr.start()
             self._all_threads.append(exec_thr)
 
+    # Should be called under self._condition
+    def _fits(self, res):
+        key = (res, self._active_res_usage[0])
+        fits = self._fits_cache.get(key)
+        if fits is None:
+            if len(self._fits_cache) > self._FITS_CACHE_LIMIT:
+                self._fits_cache.clear()
+            fits = self._fits_cache[key] = res + self._active_res_usage[0] <= self._cap
+        return fits
+
+    # Should be called under self._condition
+    def _best_fitting(self):
+        max_prio = None
+        best_key = None
+        for k in self._ready:
+            prio = -self._active_set[k][0][0]
+            if (max_prio is None or max_prio < prio) and self._fits(k):
+                max_prio = prio
+                best_key = k
+        return best_key
+
+    # Should be called under self._condition
+    def _wake_up(self, limit):
+        """Wake up no more idle threads than there are jobs which can be started"""
+        if not self._idle or not limit:
+            return
+        limit = min(limit, self._idle)
+        runnable = 0
+        for k in self._ready:
+            if self._fits(k):
+                runnable += len(self._active_set[k])
+                if runnable >= limit:
+                    break
+        if runnable:
+            self._condition.notify(min(limit, runnable))
+
     def __execute_action(self, action, res, inline=False):
         logger.debug('Run %s with res %s', action, res)
         name = str(action) + ("-inline" if inline else "")
@@ -164,7 +223,8 @@ class WorkerThreads(object):
                         action,
                     ),
                 )
-                if len(self._active_set[res]) == 1:
+                self._ready.add(res)
+                if self._idle and self._fits(res):
                     self._condition.notify()
 
     def __iter__(self):
@@ -216,3 +276,53 @@ class WorkerThreads(object):
                         pass
             except Queue.Empty:
                 break
+
+
+if __name__ == '__main__':
+    from yalibrary.active_state import ActiveState
+    from yalibrary.runner import runqueue
+
+    class NoopTask(object):
+        def __init__(self, num, res):
+            self._num = num
+            self._res = res
+
+        def __call__(self, deps):
+            pass
+
+        def res(self):
+            return self._res
+
+        def prio(self):
+            return self._num % 100
+
+        def __str__(self):
+            return 'Noop-{}'.format(self._num)
+
+    qty = 100000
+    shapes = [ResInfo(cpu=1), ResInfo(io=1), ResInfo(download=1), ResInfo(test=1, cpu=1), ResInfo()]
+
+    for threads in 1, 8, 32, 64:
+        state = ActiveState('bench')
+        cap = ResInfo(io=2, cpu=threads, test=threads, download=threads + 3, upload=3)
+        workers = WorkerThreads(state, threads, ResInfo(), cap, None)
+        queue = runqueue.RunQueue(workers.add)
+
+        t1 = time.time()
+        for num in range(qty):
+            queue.add(NoopTask(num, shapes[num % len(shapes)]))
+
+        t2 = time.time()
+        while True:
+            try:
+                workers.next()
+            except StopIteration:
+                break
+
+        t3 = time.time()
+        state.stop()
+        workers.join()
+
+        print('threads', threads)
+        print('per one add (ms)', 1000.0 * (t2 - t1) / qty)
+        print('per one task (ms)', 1000.0 * (t3 - t1) / qty)
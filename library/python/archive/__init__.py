@@ -6,6 +6,10 @@ import shutil
 import stat
 import string
 import sys
+import tarfile
+import threading
+
+from six.moves import queue
 
 import six
 
@@ -26,6 +30,10 @@ class ConfigureError(Exception):
     pass
 
 
+class UnsafeEntryError(Exception):
+    pass
+
+
 class Level(object):
     def __init__(self, level):
         self.level = level
@@ -60,9 +68,12 @@ def encode(value, encoding):
     return value.encode(encoding)
 
 
-def extract_tar(tar_file_path, output_dir, strip_components=None, fail_on_duplicates=True):
+def extract_tar(tar_file_path, output_dir, strip_components=None, fail_on_duplicates=True, threads=None):
+    if threads and threads > 1:
+        return _extract_tar_parallel(tar_file_path, output_dir, strip_components, fail_on_duplicates, threads)
+
     output_dir = encode(output_dir, ENCODING)
-    _make_dirs(output_dir)
+    make_dirs = _DirsCache(output_dir)
     with libarchive.Archive(tar_file_path, mode="rb") as tarfile:
         for e in tarfile:
             p = _strip_prefix(e.pathname, strip_components)
@@ -70,7 +81,7 @@ def extract_tar(tar_file_path, output_dir, strip_components=None, fail_on_duplic
                 continue
             dest = os.path.join(output_dir, encode(p, ENCODING))
             if e.pathname.endswith("/") or e.isdir():
-                _make_dirs(dest)
+                make_dirs(dest)
                 continue
 
             if strip_components and fail_on_duplicates:
@@ -79,7 +90,7 @@ def extract_tar(tar_file_path, output_dir, strip_components=None, fail_on_duplic
                         "The file {} is duplicated because of strip_components={}".format(dest, strip_components)
                     )
 
-            _make_dirs(os.path.dirname(dest))
+            make_dirs(os.path.dirname(dest))
 
             if e.ishardlink():
                 src = os.path.join(output_dir, _strip_prefix(e.hardlink, strip_components))
@@ -101,6 +112,281 @@ def extract_tar(tar_file_path, output_dir, strip_components=None, fail_on_duplic
                 )
 
 
+# Files up to this size are read into memory and written by the writer pool,
+# larger ones are pre-sized and written directly from the archive
+SMALL_FILE_SIZE = 1024 * 1024
+# Number of small files queued for the writer pool per writer (bounds memory)
+QUEUE_SIZE_PER_WRITER = 16
+
+
+def _extract_tar_parallel(tar_file_path, output_dir, strip_components, fail_on_duplicates, threads):
+    """
+    Reads the archive once in the current thread, creating directories and links on the way, while file contents
+    are written by a pool of writers. Entries take effect in archive order: the reader waits for pending writes
+    when an entry touches a path being written (duplicates, hardlinks to queued files).
+    """
+    output_dir = encode(output_dir, ENCODING)
+    make_dirs = _DirsCache(output_dir)
+    pool = _WriterPool(threads)
+    pending = _PendingWrites(pool)
+    extracted = set()
+    try:
+        with libarchive.Archive(tar_file_path, mode="rb") as tarfile:
+            for e in tarfile:
+                p = _strip_prefix(e.pathname, strip_components)
+                if not p:
+                    continue
+                dest = os.path.join(output_dir, encode(p, ENCODING))
+                if e.pathname.endswith("/") or e.isdir():
+                    make_dirs(dest)
+                    continue
+
+                if strip_components and fail_on_duplicates:
+                    # Files may be not written yet, so duplicates are looked up among extracted entries
+                    if dest in extracted:
+                        raise Exception(
+                            "The file {} is duplicated because of strip_components={}".format(dest, strip_components)
+                        )
+                    extracted.add(dest)
+
+                make_dirs(os.path.dirname(dest))
+
+                if e.ishardlink():
+                    src = os.path.join(output_dir, _strip_prefix(e.hardlink, strip_components))
+                    pending.wait_for(src, dest)
+                    _hardlink(src, dest)
+                    continue
+                if e.issym():
+                    src = _strip_prefix(e.linkname, strip_components)
+                    if hasattr(os, "symlink"):
+                        pending.wait_for(dest)
+                    else:
+                        # The link is emulated by copying its target, which must be written
+                        pending.wait()
+                    _symlink(src, dest)
+                    pending.add_symlink()
+                    continue
+
+                pending.wait_for(dest)
+                if e.size <= SMALL_FILE_SIZE:
+                    pool.put(dest, e.mode, tarfile.read(e.size) if e.size else b"")
+                    pending.add(dest)
+                    continue
+
+                fd = _open_for_write(dest, e.mode)
+                try:
+                    _preallocate(fd, e.size)
+                    libarchive.call_and_check(
+                        _libarchive.archive_read_data_into_fd,
+                        tarfile._a,
+                        tarfile._a,
+                        fd,
+                    )
+                finally:
+                    os.close(fd)
+    except Exception:
+        # Writers' errors are likely caused by the reader's one, which is reported
+        pool.close(check=False)
+        raise
+    pool.close()
+
+
+class _PendingWrites(object):
+    """Files queued to the writer pool since the last wait for it"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._paths = set()
+        self._has_symlinks = False
+
+    def _key(self, path):
+        if not self._has_symlinks:
+            return path
+        # Different names may refer to the same file through symlinked directories
+        return os.path.join(os.path.realpath(os.path.dirname(path)), os.path.basename(path))
+
+    def add(self, path):
+        self._paths.add(self._key(path))
+
+    def add_symlink(self):
+        if not self._has_symlinks:
+            self._has_symlinks = True
+            self._paths = set(self._key(path) for path in self._paths)
+
+    def wait(self):
+        self._pool.wait()
+        self._paths.clear()
+
+    def wait_for(self, *paths):
+        if self._paths and any(self._key(path) in self._paths for path in paths):
+            self.wait()
+
+
+class _WriterPool(object):
+    def __init__(self, threads):
+        self._queue = queue.Queue(maxsize=threads * QUEUE_SIZE_PER_WRITER)
+        self._error = None
+        self._cancelled = False
+        self._threads = []
+        for i in range(threads):
+            t = threading.Thread(target=self._run, name="ArchiveWriter{}".format(i))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is not None or self._cancelled:
+                    continue
+                dest, mode, data = item
+                try:
+                    fd = _open_for_write(dest, mode)
+                    try:
+                        _write_all(fd, data)
+                    finally:
+                        os.close(fd)
+                except Exception as e:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def put(self, dest, mode, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((dest, mode, data))
+
+    def wait(self):
+        self._queue.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self, check=True):
+        self._cancelled = not check
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        if check and self._error is not None:
+            raise self._error
+
+
+def _open_for_write(dest, mode):
+    fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o600)
+    if hasattr(os, "fchmod"):
+        os.fchmod(fd, mode & 0o7777)
+    return fd
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def _preallocate(fd, size):
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            # Not supported by the file system
+            pass
+
+
+# Stream compression modes of tarfile by signature of the stream
+_STREAM_MODES = (
+    (0, b"\x1f\x8b", "r|gz"),
+    (0, b"BZh", "r|bz2"),
+    (0, b"\xfd7zXZ\x00", "r|xz"),
+    (257, b"ustar", "r|"),
+)
+STREAM_HEADER_SIZE = 512
+
+
+def get_stream_mode(header):
+    """
+    Returns tarfile mode to read a stream starting with the header (STREAM_HEADER_SIZE bytes) or None
+    if the stream can't be extracted on the fly (zstd and other filters are not supported by tarfile)
+    """
+    for offset, magic, mode in _STREAM_MODES:
+        if header[offset : offset + len(magic)] == magic:
+            return mode
+    return None
+
+
+def extract_tar_stream(stream, output_dir, strip_components=None, fail_on_duplicates=True, mode="r|*"):
+    """
+    Extracts tar archive from a non-seekable stream (object with read() method) as it's being read.
+    Unlike extract_tar, doesn't need the whole archive on disk, so extraction may be pipelined with downloading.
+    The stream isn't verified before it's extracted, so entries and link targets are not allowed to leave
+    output_dir (absolute paths, '..' and writes through symlinks raise UnsafeEntryError).
+    """
+    root = os.path.realpath(output_dir)
+    make_dirs = _DirsCache(output_dir)
+    with tarfile.open(fileobj=stream, mode=mode) as tar:
+        for e in tar:
+            p = _strip_prefix(e.name, strip_components)
+            if not p:
+                continue
+            dest = os.path.join(output_dir, p)
+            if e.isdir():
+                _check_inside(root, dest, e.name)
+                make_dirs(dest)
+                continue
+
+            _check_inside(root, os.path.dirname(dest), e.name)
+            if strip_components and fail_on_duplicates:
+                if os.path.exists(dest):
+                    raise Exception(
+                        "The file {} is duplicated because of strip_components={}".format(dest, strip_components)
+                    )
+
+            make_dirs(os.path.dirname(dest))
+
+            if e.islnk():
+                src = os.path.join(output_dir, _strip_prefix(e.linkname, strip_components))
+                _check_inside(root, src, e.name)
+                _hardlink(src, dest)
+                continue
+            if e.issym():
+                src = _strip_prefix(e.linkname, strip_components)
+                _check_inside(root, os.path.join(os.path.dirname(dest), src), e.name)
+                _symlink(src, dest)
+                continue
+
+            if os.path.islink(dest):
+                # Replace the link instead of writing through it
+                os.unlink(dest)
+            with open(dest, "wb") as f:
+                if hasattr(os, "fchmod"):
+                    os.fchmod(f.fileno(), e.mode & 0o7777)
+                data = tar.extractfile(e)
+                if data is not None:
+                    shutil.copyfileobj(data, f, 1024 * 1024)
+
+
+def _check_inside(root, path, name):
+    real_path = os.path.realpath(path)
+    if real_path != root and not real_path.startswith(os.path.join(root, "")):
+        raise UnsafeEntryError("Archive entry {} points outside of {}".format(name, root))
+
+
+class _DirsCache(object):
+    """Creates directories remembering created ones, so an archive entry costs no syscalls for its directory"""
+
+    def __init__(self, root):
+        self._created = set()
+        self(root)
+
+    def __call__(self, path):
+        if path not in self._created:
+            _make_dirs(path)
+            self._created.add(path)
+
+
 def _strip_prefix(path, strip_components):
     if not strip_components:
         return path
@@ -126,6 +412,7 @@ def tar(
     onerror=None,
     postprocess=None,
     dereference=False,
+    threads=None,
 ):
     if isinstance(paths, six.string_types):
         paths = [paths]
@@ -150,6 +437,9 @@ def tar(
             # force gzip don't store mtime of the original file being compressed (http://www.gzip.org/zlib/rfc-gzip.html#file-format)
             if fixed_mtime is not None and compression_filter == GZIP:
                 filter_opts["timestamp"] = ""
+            # zstd compresses blocks in parallel, output doesn't depend on the number of threads
+            if threads and compression_filter == ZSTD:
+                filter_opts["threads"] = str(threads)
         else:
             filter_name = filter_opts = None
 
@@ -0,0 +1,67 @@
+"""
+Compares sequential and parallel extract_tar on archives of many small files and of few large files
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import library.python.archive as archive
+
+
+def _generate_tree(root, files_count, file_size, files_per_dir=100):
+    data = os.urandom(file_size)
+    for i in range(files_count):
+        d = os.path.join(root, "d{}".format(i // files_per_dir))
+        if i % files_per_dir == 0:
+            os.makedirs(d)
+        with open(os.path.join(d, "f{}".format(i)), "wb") as f:
+            f.write(data)
+
+
+def _measure(tar_path, work_dir, threads, repeats):
+    best = None
+    for _ in range(repeats):
+        output_dir = tempfile.mkdtemp(dir=work_dir)
+        start = time.time()
+        archive.extract_tar(tar_path, output_dir, threads=threads)
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+        shutil.rmtree(output_dir)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--work-dir", default=None)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--compression", default=None, choices=[None, archive.GZIP, archive.ZSTD])
+    args = parser.parse_args()
+
+    cases = [
+        ("many small files", 20000, 4 * 1024),
+        ("few large files", 8, 64 * 1024 * 1024),
+    ]
+
+    work_dir = tempfile.mkdtemp(dir=args.work_dir)
+    try:
+        for name, files_count, file_size in cases:
+            src = os.path.join(work_dir, "src")
+            _generate_tree(src, files_count, file_size)
+            tar_path = os.path.join(work_dir, "archive.tar")
+            archive.tar([(src, ".")], tar_path, compression_filter=args.compression)
+            shutil.rmtree(src)
+
+            print("{}: {} x {} bytes".format(name, files_count, file_size))
+            for threads in args.threads:
+                duration = _measure(tar_path, work_dir, threads, args.repeats)
+                print("  threads={:<3} {:.3f}s".format(threads, duration))
+            os.remove(tar_path)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 from io import open
 
+import bisect
+import io
+import mmap
 import struct
 import json
 import os
 import logging
+import collections
 
 import library.python.par_apply as lpp
 import library.python.codecs as lpc
@@ -11,6 +15,14 @@ import library.python.codecs as lpc
 
 logger = logging.getLogger('compress')
 
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# Optional frame index is written after the end of the stream:
+# <I 0> (stops old readers), entries <QQ (offset of the block length prefix, uncompressed size)>, trailer
+INDEX_MAGIC = b'YACIDX01'
+INDEX_ENTRY = struct.Struct('<QQ')
+INDEX_TRAILER = struct.Struct('<QQ8s')
+
 
 def list_all_codecs():
     return sorted(frozenset(lpc.list_all_codecs()))
@@ -38,32 +50,43 @@ def codec_for(path):
     raise Exception('unsupported file %s' % path)
 
 
-def compress(fr, to, codec=None, fopen=open, threads=1):
+def compress(fr, to, codec=None, fopen=open, threads=1, index=False):
     if codec:
         codec = find_codec(codec)
     else:
         codec = codec_for(to)
 
     func = codec['c']
+    sizes = collections.deque()
 
-    def iter_blocks():
-        with fopen(fr, 'rb') as f:
-            while True:
-                chunk = f.read(16 * 1024 * 1024)
+    def read_blocks(f):
+        while True:
+            chunk = f.read(BLOCK_SIZE)
+            sizes.append(len(chunk))
 
-                if chunk:
-                    yield chunk
-                else:
-                    yield b''
+            if chunk:
+                yield chunk
+            else:
+                yield b''
 
-                    return
+                return
+
+    def iter_blocks():
+        # fr is either a path or a readable stream
+        if hasattr(fr, 'read'):
+            for chunk in read_blocks(fr):
+                yield chunk
+        else:
+            with fopen(fr, 'rb') as f:
+                for chunk in read_blocks(f):
+                    yield chunk
 
     def iter_results():
         info = {
             'codec': codec['n'],
         }
 
-        if fr:
+        if fr and not hasattr(fr, 'read'):
             info['size'] = os.path.getsize(fr)
 
         yield json.dumps(info, sort_keys=True) + '\n'
@@ -71,15 +94,34 @@ def compress(fr, to, codec=None, fopen=open, threads=1):
         for c in lpp.par_apply(iter_blocks(), func, threads):
             yield c
 
+    entries = []
+    offset = 0
+
     with fopen(to, 'wb') as f:
-        for c in iter_results():
+        for n, c in enumerate(iter_results()):
             logger.debug('complete %s', len(c))
             f.write(struct.pack('<I', len(c)))
 
-            try:
-                f.write(c)
-            except TypeError:
-                f.write(c.encode('utf-8'))
+            if not isinstance(c, bytes):
+                c = c.encode('utf-8')
+
+            f.write(c)
+
+            if n:
+                size = sizes.popleft()
+                if size:
+                    entries.append((offset, size))
+
+            offset += 4 + len(c)
+
+        if index:
+            f.write(struct.pack('<I', 0))
+            offset += 4
+
+            for entry in entries:
+                f.write(INDEX_ENTRY.pack(*entry))
+
+            f.write(INDEX_TRAILER.pack(offset, len(entries), INDEX_MAGIC))
 
 
 def decompress(fr, to, codec=None, fopen=open, threads=1):
@@ -145,3 +187,218 @@ def decompress(fr, to, codec=None, fopen=open, threads=1):
                 f.write(c)
             else:
                 break
+
+
+class CompressedFile(io.RawIOBase):
+    """
+    Read-only seekable file-like view of the uncompressed content of a stream written by compress().
+    The stream is mmap-ed, only blocks covering the requested range are decoded, several blocks are decoded in parallel.
+    Streams with frame index are opened instantly, for streams without index block sizes are found by decoding them once.
+    """
+
+    def __init__(self, path, codec=None, threads=1):
+        super(CompressedFile, self).__init__()
+        self.name = path
+        self._threads = threads
+        self._pos = 0
+        self._cached = (None, b'')
+
+        self._f = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file can not be mapped
+            self._f.close()
+            raise Exception('empty stream')
+
+        header, data_offset = self._read_header()
+
+        if 'codec' in header:
+            self._dc = find_codec(header['codec'])['d']
+        elif codec:
+            self._dc = find_codec(codec)['d']
+        else:
+            self._dc = codec_for(path)['d']
+
+        # (offset of the block length prefix, uncompressed size)
+        entries = self._read_index()
+        if entries is None:
+            entries = self._scan(data_offset)
+
+        self._offsets = [o for o, _ in entries]
+        self._starts = []
+        pos = 0
+        for _, size in entries:
+            self._starts.append(pos)
+            pos += size
+        self._size = pos
+
+    def _chunk_at(self, offset):
+        if offset + 4 > len(self._mm):
+            return None
+        ll = struct.unpack_from('<I', self._mm, offset)[0]
+        if not ll:
+            return None
+        if ll > 100000000:
+            raise Exception('broken stream')
+        return self._mm[offset + 4 : offset + 4 + ll]
+
+    def _read_header(self):
+        chunk = self._chunk_at(0)
+        if chunk is None:
+            raise Exception('empty stream')
+        try:
+            return json.loads(chunk), 4 + len(chunk)
+        except Exception as e:
+            logger.info('can not parse header, suspect old format: %s', e)
+            return {}, 0
+
+    def _read_index(self):
+        mm = self._mm
+        if len(mm) < INDEX_TRAILER.size:
+            return None
+        index_offset, count, magic = INDEX_TRAILER.unpack_from(mm, len(mm) - INDEX_TRAILER.size)
+        if magic != INDEX_MAGIC or index_offset + count * INDEX_ENTRY.size + INDEX_TRAILER.size != len(mm):
+            return None
+        return [INDEX_ENTRY.unpack_from(mm, index_offset + i * INDEX_ENTRY.size) for i in range(count)]
+
+    def _scan(self, offset):
+        offsets = []
+        while True:
+            chunk = self._chunk_at(offset)
+            if chunk is None:
+                break
+            offsets.append(offset)
+            offset += 4 + len(chunk)
+
+        entries = []
+        for o, size in zip(offsets, lpp.par_apply(offsets, lambda o: len(self._decode(o)), self._threads)):
+            if not size:
+                break
+            entries.append((o, size))
+        return entries
+
+    def _decode(self, offset):
+        return self._dc(self._chunk_at(offset))
+
+    def _block_of(self, pos):
+        return bisect.bisect_right(self._starts, pos) - 1
+
+    @property
+    def size(self):
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError('invalid whence ({})'.format(whence))
+        if pos < 0:
+            raise ValueError('negative seek position {}'.format(pos))
+        self._pos = pos
+        return pos
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        end = self._size if size is None or size < 0 else min(self._size, self._pos + size)
+        if self._pos >= end:
+            return b''
+
+        first = self._block_of(self._pos)
+        last = self._block_of(end - 1)
+
+        blocks = []
+        todo = []
+        for n in range(first, last + 1):
+            if n == self._cached[0]:
+                blocks.append(self._cached[1])
+            else:
+                blocks.append(None)
+                todo.append(n)
+
+        decoded = lpp.par_apply([self._offsets[n] for n in todo], self._decode, self._threads)
+        for n, data in zip(todo, decoded):
+            blocks[n - first] = data
+
+        self._cached = (last, blocks[-1])
+        head = self._pos - self._starts[first]
+        tail = end - self._starts[last]
+        if first == last:
+            result = blocks[0][head:tail]
+        else:
+            result = b''.join([blocks[0][head:]] + blocks[1:-1] + [blocks[-1][:tail]])
+
+        self._pos = end
+        return result
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._mm.close()
+            self._f.close()
+        super(CompressedFile, self).close()
+
+
+def open_compressed(path, codec=None, threads=1):
+    return CompressedFile(path, codec=codec, threads=threads)
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import time
+
+    # Full vs ranged reads: python library/python/compress/__init__.py [size_mb [codec [threads]]]
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    codec = sys.argv[2] if len(sys.argv) > 2 else 'zstd_1'
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    tmp_dir = tempfile.mkdtemp()
+    raw = os.path.join(tmp_dir, 'raw')
+    with open(raw, 'wb') as f:
+        chunk = os.urandom(1024 * 1024 // 2) * 2
+        for _ in range(size_mb):
+            f.write(chunk)
+
+    for use_index in (False, True):
+        packed = os.path.join(tmp_dir, 'packed.{}'.format(int(use_index)))
+        compress(raw, packed, codec=codec, threads=threads, index=use_index)
+
+        t = time.time()
+        decompress(packed, os.path.join(tmp_dir, 'unpacked'), codec=codec, threads=threads)
+        full = time.time() - t
+
+        t = time.time()
+        with open_compressed(packed, codec=codec, threads=threads) as f:
+            f.seek(-BLOCK_SIZE // 2, os.SEEK_END)
+            tail = f.read()
+        ranged = time.time() - t
+
+        assert len(tail) == BLOCK_SIZE // 2
+        print('index={} full decompress {:.3f}s, tail read {:.3f}s'.format(use_index, full, ranged))
+
+    import shutil
+
+    shutil.rmtree(tmp_dir)